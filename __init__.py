@@ -17,3 +17,23 @@ from .tellurium import *
 from .bismuth import *
 from .argon import *
 from .cardf import *
+from .locks import *
+from .carp_expander import *
+from .smbus_pool import *
+from .config import *
+from .daemon import card_server
+from .client import *
+from .command_queue import *
+from .scheduler import *
+from .sweep import *
+from .aio import *
+from .backend import *
+from .sim import *
+from .i2c_dev import *
+from .metrics import textfile_exporter, write_textfile, prometheus_text
+from .edge_trigger import *
+from .agc import *
+from .trace import trace_recorder, trace_replayer, read_trace, trace_event
+from .chassis import chassis
+from .cost_model import cost_model, capture
+from .state_shm import state_publisher, state_reader, enable_state_publication, disable_state_publication
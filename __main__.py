@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Execute a stream of card commands
+
+The configured cards are instantiated once, then commands are read from a
+file or stdin and executed in order. Commands are either JSON lines
+
+    {"card": "argon0", "method": "configure_synth", "args": [12e9]}
+
+or simple lines of the form card method [args...] [name=value...]
+
+    argon0 configure_synth 12e9 autofilter=True
+    bismuth1 configure_rx_att 2
+
+Commands between the lines "batch" and "end" (or in a JSON line
+{"batch": [...]}) are executed as one batch, with the CARP expander
+writes of the whole batch applied together and timed as a unit.
+
+**To run**
+
+    python -m pc_card_control cards.json commands.txt --timing
+    echo "selenium0 configure_filters 1e9" | python -m pc_card_control cards.json --dry-run
+"""
+
+import ast
+import sys
+import json
+import time
+import argparse
+import contextlib
+from .config import *
+from .backend import *
+from .sim import *
+from .carp_expander import *
+from .card_operation import *
+from .trace import trace_recorder
+from .chassis import chassis
+
+def parse_value(text):
+    """
+    Parse a command argument as a Python literal, falling back to the
+    plain string
+
+    Args:
+        text (str): The argument text
+
+    Returns:
+        The parsed value
+    """
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+def parse_command(line):
+    """
+    Parse one command line in either format
+
+    Args:
+        line (str): The command line
+
+    Returns:
+        tuple: (card, method, args, kwargs), "batch", "end" or None for
+               blank and comment lines
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line.startswith("{"):
+        cmd = json.loads(line)
+        if "batch" in cmd:
+            return ("batch", [(c["card"], c["method"], c.get("args", []), c.get("kwargs", {}))
+                              for c in cmd["batch"]])
+        return (cmd["card"], cmd["method"], cmd.get("args", []), cmd.get("kwargs", {}))
+    if line in ("batch", "end"):
+        return line
+    words = line.split()
+    args = [parse_value(w) for w in words[2:] if "=" not in w]
+    kwargs = dict((w.split("=", 1)[0], parse_value(w.split("=", 1)[1])) for w in words[2:] if "=" in w)
+    return (words[0], words[1], args, kwargs)
+
+def read_commands(f):
+    """
+    Read commands from a file, grouping batches
+
+    Args:
+        f (file): File to read from
+
+    Yields:
+        list[tuple]: The commands of a single command or batch
+    """
+    batch = None
+    for line in f:
+        cmd = parse_command(line)
+        if cmd is None:
+            continue
+        if cmd == "batch":
+            batch = []
+        elif cmd == "end":
+            if batch:
+                yield batch
+            batch = None
+        elif cmd[0] == "batch":
+            yield cmd[1]
+        elif batch is not None:
+            batch.append(cmd)
+        else:
+            yield [cmd]
+    if batch:
+        yield batch
+
+def describe(cmd):
+    card, method, args, kwargs = cmd
+    params = [repr(a) for a in args] + ["{}={!r}".format(k, v) for k, v in kwargs.items()]
+    return "{}.{}({})".format(card, method, ", ".join(params))
+
+def execute(cards, commands, batched):
+    """
+    Execute a command or batch
+
+    Args:
+        cards (dict): Card instances keyed by name
+
+        commands (list[tuple]): The commands to execute
+
+        batched (bool): Apply CARP expander writes once for all commands
+
+    Returns:
+        list: The results of the commands
+    """
+    expander = batched and any(getattr(c, "batch", None) for c in cards.values())
+    with get_carp_expander().batch() if expander else contextlib.nullcontext():
+        return [getattr(cards[card], method)(*args, **kwargs)
+                for card, method, args, kwargs in commands]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pc_card_control",
+                                     description="Execute a stream of personality card commands")
+    parser.add_argument("config", help="JSON card configuration")
+    parser.add_argument("commands", nargs="?", default="-", help="Command file (Default: stdin)")
+    parser.add_argument("--timing", action="store_true", help="Print the execution time of each command")
+    parser.add_argument("--dry-run", action="store_true", help="Print the planned hardware operations instead of executing them")
+    parser.add_argument("--keep-going", action="store_true", help="Continue after a failing command")
+    parser.add_argument("--record", metavar="TRACE", help="Record the hardware operations to a trace file (see trace)")
+    args = parser.parse_args(argv)
+
+    if args.dry_run:
+        set_backend(sim_backend(on_op=lambda op: print("    " + op)))
+
+    with trace_recorder(args.record) if args.record else contextlib.nullcontext():
+        #Bring the cards up one after another under --dry-run so the printed
+        #operations of different cards are not interleaved
+        bring_up = chassis(load_config(args.config), parallel=not args.dry_run)
+        cards = bring_up.bring_up()
+        if args.timing:
+            for line in bring_up.report().splitlines():
+                print("# " + line)
+
+        status = 0
+        with open(args.commands) if args.commands != "-" else contextlib.nullcontext(sys.stdin) as f:
+            for commands in read_commands(f):
+                for cmd in commands:
+                    print(describe(cmd))
+                start = time.perf_counter()
+                try:
+                    results = execute(cards, commands, len(commands) > 1)
+                except Exception as e:
+                    print("error: {}: {}".format(type(e).__name__, e), file=sys.stderr)
+                    status = 1
+                    if args.keep_going:
+                        continue
+                    break
+                elapsed = (time.perf_counter() - start)*1000
+                for cmd, result in zip(commands, results):
+                    if result is not None and not isinstance(result, ready_at):
+                        print("{} -> {!r}".format(describe(cmd), result))
+                if args.timing:
+                    print("# {:.3f} ms".format(elapsed))
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
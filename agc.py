@@ -0,0 +1,229 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Closed-loop RX attenuation control for Bismuth
+
+A dedicated thread samples the AD9361 RSSI of one receive channel at a
+fixed rate and steps the Bismuth RX attenuator (configure_rx_att) with
+hysteresis and dwell. The attenuation is only written when the level
+actually changes.
+
+The RSSI is read from the "rssi" attribute of the channel through an IIO
+context of the active backend, so the loop can be run against
+sim_backend by setting the simulated attribute.
+
+**Expected usage:**
+
+    agc = pc_card_control.rx_att_agc(my_bismuth, channel=0, rate=200)
+    ...
+    print(agc.stats())
+    agc.stop()
+"""
+
+import time
+import logging
+import threading
+from . import metrics
+from .backend import *
+
+AGC_LOOP_METRIC = "pc_card_agc_loop_seconds"
+"""Histogram of the duration of one AGC iteration (RSSI read and step)"""
+
+AGC_STEP_METRIC = "pc_card_agc_steps_total"
+"""Counter of the attenuation steps taken by the AGC"""
+
+RX_ATT_STEP_DB = 6
+"""Attenuation added by each rx_att level in dB"""
+
+RX_ATT_MAX = 3
+"""Highest rx_att level (18dB)"""
+
+def parse_rssi(value):
+    """
+    Parse an AD9361 rssi attribute
+
+    Args:
+        value (str): The attribute, e.g. "34.25 dB"
+
+    Returns:
+        float: The RSSI in dB below full scale
+    """
+    return float(value.split()[0])
+
+class rx_att_agc:
+    """
+    Runs the RX attenuation AGC loop of a Bismuth card in a thread
+
+    The RSSI reported by the AD9361 is in dB below full scale, so a
+    smaller value is a stronger signal. When it stays below strong_db
+    for dwell seconds the attenuation is raised one step, and when it
+    stays above weak_db for dwell seconds it is lowered one step. The
+    band between the two thresholds must be wider than one step so that
+    a step cannot push the RSSI across the opposite threshold.
+    """
+
+    def __init__(self, card, channel=0, dev_device="ad9361-phy", rate=100.0,
+                 strong_db=20.0, weak_db=40.0, dwell=0.05, start=True):
+        """
+        Create a rx_att_agc instance
+
+        Args:
+            card (bismuth): The card whose RX attenuation is controlled
+
+            channel (int): AD9361 receive channel of the card (Default: 0)
+
+            dev_device (str): Name of the IIO device reporting the RSSI
+                              (Default: "ad9361-phy")
+
+            rate (float): Loop rate in Hz (Default: 100.0)
+
+            strong_db (float): Raise the attenuation while the RSSI is
+                               below this (Default: 20.0)
+
+            weak_db (float): Lower the attenuation while the RSSI is
+                             above this (Default: 40.0)
+
+            dwell (float): Time in seconds the RSSI must stay beyond a
+                           threshold before a step (Default: 0.05)
+
+            start (bool): Start the loop thread (Default: True)
+        """
+        if weak_db - strong_db <= RX_ATT_STEP_DB:
+            raise ValueError("The hysteresis band must be wider than {}dB".format(RX_ATT_STEP_DB))
+        self.log = logging.getLogger("{}_agc".format(card.log.name))
+        self.card = card
+        self.period = 1/rate
+        self.strong_db = strong_db
+        self.weak_db = weak_db
+        self.dwell = dwell
+        self.labels = (("card", card.log.name),)
+
+        #Share the card's IIO context rather than opening another one,
+        #unless its GPOs are driven through debugfs
+        gpo_ctrl = getattr(card, "gpo_ctrl", None)
+        self.ctx = getattr(gpo_ctrl, "ctx", None) or open_iio_context()
+        self.rssi_attr = self.ctx.find_device(dev_device).find_channel("voltage{}".format(channel), False).attrs["rssi"]
+
+        #Direction the RSSI is asking for and since when
+        self.pending = 0
+        self.pending_since = None
+
+        self.counts = {"samples": 0, "steps_up": 0, "steps_down": 0, "elided": 0, "overruns": 0}
+        self.loop_ns = 0
+        self.max_loop_ns = 0
+        self.rssi = None
+        self.started_ns = None
+        self.started_samples = 0
+
+        self.running = False
+        self.stop_event = threading.Event()
+        self.thread = None
+        if start:
+            self.start()
+
+    def start(self):
+        """Start the loop thread"""
+        self.running = True
+        self.stop_event.clear()
+        self.started_ns = time.monotonic_ns()
+        self.started_samples = self.counts["samples"]
+        self.thread = threading.Thread(target=self.run, name=self.log.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the loop thread"""
+        self.running = False
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """Loop thread body, sampling at fixed deadlines"""
+        deadline = time.monotonic()
+        while self.running:
+            try:
+                self.sample()
+            except Exception as e:
+                self.log.warning("AGC iteration failed: {}".format(e))
+            deadline += self.period
+            delay = deadline - time.monotonic()
+            if delay < 0:
+                #Skip the missed deadlines instead of running back to back
+                self.counts["overruns"] += 1
+                deadline = time.monotonic()
+                delay = 0
+            self.stop_event.wait(delay)
+
+    def sample(self, now=None):
+        """
+        Perform one AGC iteration: read the RSSI and step the attenuation
+        if it has been beyond a threshold for the dwell time
+
+        Args:
+            now (float): Monotonic time of the sample, for testing
+                         (Default: time.monotonic())
+
+        Returns:
+            int: The rx_att level after the iteration
+        """
+        start = time.perf_counter_ns()
+        now = time.monotonic() if now is None else now
+        self.rssi = parse_rssi(self.rssi_attr.value)
+        self.counts["samples"] += 1
+
+        level = self.card.state.get("rx_att", 0)
+        if self.rssi < self.strong_db:
+            direction = 1
+        elif self.rssi > self.weak_db:
+            direction = -1
+        else:
+            direction = 0
+
+        if direction != self.pending:
+            self.pending = direction
+            self.pending_since = now
+        elif direction and now - self.pending_since >= self.dwell:
+            target = min(max(level + direction, 0), RX_ATT_MAX)
+            if target == level:
+                self.counts["elided"] += 1
+            else:
+                self.card.configure_rx_att(target)
+                level = target
+                step = "up" if direction > 0 else "down"
+                self.counts["steps_" + step] += 1
+                metrics.count(AGC_STEP_METRIC, self.labels + (("direction", step),))
+                self.log.debug("RSSI {}dB, rx_att stepped {} to {}".format(self.rssi, step, level))
+            #The next step needs a full dwell at the new level
+            self.pending_since = now
+
+        duration = time.perf_counter_ns() - start
+        self.loop_ns += duration
+        self.max_loop_ns = max(self.max_loop_ns, duration)
+        metrics.observe(AGC_LOOP_METRIC, self.labels, duration/1e9)
+        return level
+
+    def stats(self):
+        """
+        Summarize the loop
+
+        Returns:
+            dict: samples, steps_up, steps_down, elided (steps not taken
+                  because the attenuation was already at its limit),
+                  overruns (iterations that missed their deadline),
+                  loop_hz (sample rate achieved since start),
+                  mean_loop_ns and max_loop_ns (duration of an
+                  iteration), rssi (last RSSI in dB) and rx_att
+                  (current level)
+        """
+        result = dict(self.counts)
+        samples = result["samples"]
+        if self.started_ns is not None:
+            result["loop_hz"] = (samples - self.started_samples)/((time.monotonic_ns() - self.started_ns)/1e9)
+        result["mean_loop_ns"] = self.loop_ns/samples if samples else 0
+        result["max_loop_ns"] = self.max_loop_ns
+        result["rssi"] = self.rssi
+        result["rx_att"] = self.card.state.get("rx_att")
+        return result
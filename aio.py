@@ -0,0 +1,230 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+asyncio variants of the card classes
+
+Blocking hardware access runs on a single-threaded executor dedicated to
+the bus the card sits on (its I2C expander's gpiochip, or its I2C bus for
+Argon), so cards on independent buses run concurrently under
+asyncio.gather while accesses to one bus stay in order. Waits inside an
+operation, such as Argon's calibration delay and lock polling, are
+awaited instead of slept, and so is settling (async_wait_ready).
+
+**Expected usage:**
+
+    argon0 = await pc_card_control.async_argon.create(0, 2, 0, 1, 0x2B)
+    selenium1 = await pc_card_control.async_selenium.create(1, 3, carp=1)
+    offset, _ = await asyncio.gather(argon0.configure_synth(12e9),
+                                     selenium1.configure_filters(1e9))
+"""
+
+import asyncio
+import inspect
+import functools
+import threading
+import contextvars
+import concurrent.futures
+from .gpio_line_mux import *
+from .iio_gpo_control import *
+from .selenium import *
+from .tellurium import *
+from .bismuth import *
+from .argon import *
+from .cardf import *
+
+_executor_lock = threading.Lock()
+_executors = {}
+
+def bus_executor(kind, key=None):
+    """
+    Returns the single-threaded executor dedicated to a bus
+
+    Args:
+        kind (str): Kind of resource, as for resource_lock
+
+        key: Identifier of the resource within its kind (Default: None)
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: The bus's executor
+    """
+    with _executor_lock:
+        executor = _executors.get((kind, key))
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="{}{}".format(kind, "" if key is None else key))
+            _executors[(kind, key)] = executor
+        return executor
+
+async def async_wait_ready(*items):
+    """
+    Awaitable wait_ready
+
+    Args:
+        items: ready_at timestamps and/or cards, synchronous or asyncio
+               variants
+    """
+    await asyncio.sleep(latest_ready(*[getattr(i, "card", i) for i in items]).remaining())
+
+def _step(steps):
+    """Advance a step generator by one step on the executor"""
+    try:
+        return False, next(steps)
+    except StopIteration as e:
+        return True, e.value
+
+class async_card:
+    """
+    Base class of the asyncio card variants. Every public method of the
+    wrapped card is available as a coroutine. Operations on one card are
+    serialized by an asyncio.Lock.
+    """
+
+    card_class = None
+    """class: The synchronous card class wrapped"""
+
+    bus_arg = ("gpiochip", "gpiochip_num")
+    """tuple: Resource kind and constructor argument naming the card's bus"""
+
+    factory = None
+    """function: Returns the instance to wrap, if not card_class itself"""
+
+    def __init__(self, card, executor):
+        """
+        Wrap an existing card instance
+
+        Args:
+            card (object): The synchronous card instance
+
+            executor (concurrent.futures.Executor): Executor to run its
+                                                    blocking calls on
+        """
+        self.card = card
+        self.executor = executor
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """
+        Construct the card on its bus executor, or look up the shared
+        instance with factory if the class has one
+
+        Args:
+            Same as the synchronous card class
+
+        Returns:
+            async_card: The asyncio variant of the card
+        """
+        kind, arg = cls.bus_arg
+        bound = inspect.signature(cls.card_class).bind(*args, **kwargs)
+        given = dict(bound.arguments)
+        bound.apply_defaults()
+        executor = bus_executor(kind, bound.arguments.get(arg))
+        if cls.factory is None:
+            make = functools.partial(cls.card_class, *args, **kwargs)
+        else:
+            #Shared instances are looked up with their arguments by name
+            make = functools.partial(cls.factory, **given)
+        loop = asyncio.get_running_loop()
+        card = await loop.run_in_executor(executor, make)
+        return cls(card, executor)
+
+    async def call(self, method, *args, **kwargs):
+        """
+        Run a method of the card on its bus executor
+
+        Args:
+            method (str): Name of the method
+
+        Returns:
+            The return value of the method
+        """
+        loop = asyncio.get_running_loop()
+        async with self.lock:
+            return await loop.run_in_executor(self.executor, functools.partial(getattr(self.card, method), *args, **kwargs))
+
+    async def run_steps(self, steps):
+        """
+        Drive a step generator, running each step on the bus executor and
+        awaiting the waits it yields. The steps run in a context of their
+        own, so a CARP batch held across the waits (see operation_steps)
+        does not defer the writes of other work on the executor. If the
+        caller is cancelled the generator is closed on the executor,
+        releasing what it holds.
+
+        Args:
+            steps (generator): The step generator
+
+        Returns:
+            The return value of the generator
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.Context()
+        async with self.lock:
+            try:
+                while True:
+                    done, value = await loop.run_in_executor(self.executor, context.run, _step, steps)
+                    if done:
+                        return value
+                    await asyncio.sleep(value)
+            except BaseException:
+                await asyncio.shield(loop.run_in_executor(self.executor, context.run, steps.close))
+                raise
+
+    async def wait_ready(self):
+        """Wait until the card's outputs have settled (see wait_ready)"""
+        await async_wait_ready(self.card)
+
+    def __getattr__(self, name):
+        if name.startswith("_") or not callable(getattr(self.card, name, None)):
+            raise AttributeError(name)
+        async def method(*args, **kwargs):
+            return await self.call(name, *args, **kwargs)
+        method.__name__ = name
+        return method
+
+class async_selenium(async_card):
+    """asyncio variant of selenium"""
+    card_class = selenium
+
+class async_tellurium(async_card):
+    """asyncio variant of tellurium"""
+    card_class = tellurium
+
+class async_bismuth(async_card):
+    """asyncio variant of bismuth"""
+    card_class = bismuth
+
+class async_cardf(async_card):
+    """asyncio variant of cardf"""
+    card_class = cardf
+
+class async_argon(async_card):
+    """
+    asyncio variant of argon. The calibration delay and lock polling of
+    configure_synth are awaited.
+    """
+    card_class = argon
+    bus_arg = ("i2c", "i2cbus")
+
+    async def configure_synth(self, frequency, autofilter=False):
+        """Awaitable argon.configure_synth"""
+        return await self.run_steps(operation_steps(self.card, "configure_synth",
+                                                    self.card.synth_steps(frequency, autofilter)))
+
+    async def wait_for_lock(self):
+        """Awaitable argon.wait_for_lock"""
+        return await self.run_steps(operation_steps(self.card, "wait_for_lock", self.card.lock_steps()))
+
+class async_gpio_line_mux(async_card):
+    """asyncio variant of the shared gpio_line_mux (see get_line_mux)"""
+    card_class = gpio_line_mux
+    factory = staticmethod(get_line_mux)
+    bus_arg = ("mux", None)
+
+class async_iio_gpo_control(async_card):
+    """asyncio variant of the shared iio_gpo_control (see get_gpo_control)"""
+    card_class = iio_gpo_control
+    factory = staticmethod(get_gpo_control)
+    bus_arg = ("iio", "dev_device")
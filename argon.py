@@ -2,13 +2,16 @@
 
 # SPDX-License-Identifier: MIT
 
-import gpiod
-import smbus
+import threading
 import time
 import copy
 import logging
 from .gpio_line_mux import *
 from .iio_gpo_control import *
+from .card_operation import *
+from .carp_expander import *
+from .smbus_pool import *
+from .backend import *
 from .constants import *
 
 class synth_settings:
@@ -95,6 +98,25 @@ class synth_settings:
         list[int]: Commands to be sent to enable calibration on the
                    synthesizer
         """
+        self.MUXOUT_READBACK = [0x00, 0x27, 0x10]
+        """
+        list[int]: Commands to be sent to switch MUXout to register
+                   readback (without retriggering calibration)
+        """
+        self.MUXOUT_LD = [0x00, 0x27, 0x14]
+        """
+        list[int]: Commands to be sent to switch MUXout back to lock
+                   detect (without retriggering calibration)
+        """
+        self.LD_REG = 110
+        """
+        int: Readback register holding rb_LD_VTUNE in bits [10:9]
+        """
+        self.LD_LOCKED = 2
+        """
+        int: rb_LD_VTUNE value reported once calibration has finished and
+             the synthesizer is locked
+        """
 
     def get_settings(self, index):
         """
@@ -113,6 +135,22 @@ class synth_settings:
             settings[k] = v
         return settings
 
+    def get_payloads(self, index, cs):
+        """
+        Returns the register settings for the index as precompiled I2C
+        payloads for the I2C->SPI bridge
+
+        Args:
+            index (int): The index of the desired frequency setting from
+                         SYNTH_FREQ
+
+            cs (int): The bridge function ID (chip select) to prefix
+
+        Returns:
+            list[bytes]: One payload per register write
+        """
+        return [bytes([cs] + reg) for reg in self.get_settings(index)]
+
 class argon:
     """
     A class for controlling the Argon personality card
@@ -122,7 +160,20 @@ class argon:
         my_argon = pc_card_control.argon(0, 2, 0, 1, 0x2B)
     """
 
-    def __init__(self, pc_slot, gpiochip_num, transceiver_num, i2cbus, address, carp=0, control_rxtx=1, reset=1):
+    #The synthesizer's lock is waited for by configure_synth; the mixers
+    #enabled after it still need to settle
+    SETTLING = {"configure_tx_filters":    10e-6,
+                "configure_tx_unfiltered": 10e-6,
+                "configure_synth":         100e-6,
+                "reset_synth":             10e-6,
+                "configure_receive":       50e-6,
+                "configure_transmit":      50e-6}
+    """dict: Analog settling time in seconds after each operation (see operation)"""
+
+    EXPANDER_LINES = [1, 2, 3]
+    """list[int]: CARP expander lines driven by the card, relative to 6*pc_slot"""
+
+    def __init__(self, pc_slot, gpiochip_num, transceiver_num, i2cbus, address, carp=0, control_rxtx=1, reset=1, lock_timeout=0.05, i2c_backend="smbus", gpo_backend="iio", debugfs_path=None, mux_options=None):
         """
         Initialize an Argon board
 
@@ -149,10 +200,40 @@ class argon:
 
             reset (int): Should the reset() function be called at the end
                          of initialization (Default:1)
+
+            lock_timeout (float): Maximum time in seconds to wait for the
+                                  synthesizer to lock after calibration
+                                  is started (Default: 0.05)
+
+            i2c_backend (str): Backend for the I2C bus if it is not
+                               already open: "smbus", or "i2c-dev" to
+                               send register images as combined
+                               I2C_RDWR transfers (Default: "smbus")
+
+            gpo_backend (str): Register backend of the transceiver GPO
+                               control if it is not already open: "iio",
+                               or "debugfs" to keep the direct_reg_access
+                               file open (Default: "iio")
+
+            debugfs_path (str): direct_reg_access file for the debugfs
+                                GPO backend. Found from the IIO device
+                                name if not set (Default: None)
+
+            mux_options (dict): gpio_line_mux arguments on CARP, used if
+                                the line mux is not already open, e.g.
+                                {"mux_backend": "mmap", "mmap_base": ...}
+                                (Default: None)
         """
         #Setup logger
         self.log = logging.getLogger("argon_{}".format(pc_slot))
 
+        #Serializes operations on this card between threads
+        self.lock = threading.RLock()
+
+        #Logical state of the card, published by state_shm when enabled
+        self.state = {}
+        self.pc_slot = pc_slot
+
         self.synth_settings = synth_settings()
 
         #This chip select is defined here as it should never change
@@ -171,16 +252,30 @@ class argon:
             self.log.debug("Set to control RX/TX")
 
         #GPIO setup
-        self.gpiochip0 = gpiod.Chip('gpiochip{}'.format(BASE_GPIO_CHIP))
+        self.gpiochip0 = open_line_bank(BASE_GPIO_CHIP)
         if carp:
-            self.gpiochip2 = gpiod.Chip('gpiochip{}'.format(CARP_GPIO_CHIP))
-            self.line_mux  = gpio_line_mux()
+            self.gpiochip2 = get_carp_expander()
+            self.gpiochip2.claim(slot_lines(pc_slot, self.EXPANDER_LINES))
+            self.batch     = self.gpiochip2.batch
+            self.line_mux  = get_line_mux(**(mux_options or {}))
         else:
-            self.gpo_ctrl = iio_gpo_control()
-        self.gpiochip  = gpiod.Chip("gpiochip{}".format(gpiochip_num))
-
-        self.bus = smbus.SMBus(i2cbus)
+            self.gpo_ctrl = get_gpo_control(reg_backend=gpo_backend, debugfs_path=debugfs_path)
+        self.gpiochip  = open_line_bank(gpiochip_num)
+        if carp:
+            #Writes to the other chips must not overtake expander writes
+            #still pending in the operation's batch
+            self.gpiochip0 = self.gpiochip2.ordered(self.gpiochip0)
+            self.gpiochip  = self.gpiochip2.ordered(self.gpiochip)
+            self.line_mux  = self.gpiochip2.ordered(self.line_mux)
+
+        #Argons sharing an I2C bus share one handle and must not
+        #interleave their SPI bursts
+        self.bus = get_bus(i2cbus, i2c_backend)
+        self.compiled = {}
         self.address = address
+        self.lock_timeout = lock_timeout
+        self.synth_locked = False
+        self.last_cal_time = None
         self.bus.write_i2c_block_data(self.address, 0x00, [0x00])
 
         if carp:
@@ -227,19 +322,25 @@ class argon:
         self.rx_mix_en = self.gpiochip.get_lines([1])
         self.tx_mix_en = self.gpiochip.get_lines([2])
 
-        self.synth_en.request( consumer='ARGON_SYNTH_EN',  type=gpiod.LINE_REQ_DIR_OUT)
-        self.rx_mix_en.request(consumer='ARGON_RX_MIX_EN', type=gpiod.LINE_REQ_DIR_OUT)
-        self.tx_mix_en.request(consumer='ARGON_TX_MIX_EN', type=gpiod.LINE_REQ_DIR_OUT)
+        self.synth_en.request( consumer='ARGON_SYNTH_EN',  type=LINE_REQ_DIR_OUT)
+        self.rx_mix_en.request(consumer='ARGON_RX_MIX_EN', type=LINE_REQ_DIR_OUT)
+        self.tx_mix_en.request(consumer='ARGON_TX_MIX_EN', type=LINE_REQ_DIR_OUT)
         if control_rxtx:
-            self.rx.request(consumer='ARGON_RX_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
-            self.tx.request(consumer='ARGON_TX_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
+            self.rx.request(consumer='ARGON_RX_CTRL', type=LINE_REQ_DIR_OUT)
+            self.tx.request(consumer='ARGON_TX_CTRL', type=LINE_REQ_DIR_OUT)
 
         for i in self.tx_filt:
-            i.request(consumer='ARGON_TX_FILT', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='ARGON_TX_FILT', type=LINE_REQ_DIR_OUT)
+
+        #The lines above only set the initial values; each chip's lines are
+        #claimed here in one request, driven to those values
+        self.gpiochip0.request(consumer='ARGON')
+        self.gpiochip.request(consumer='ARGON')
 
         if reset:
             self.reset()
 
+    @operation
     def reset(self):
         """
         Base reset for the board. Turns off the synthesizer, disables TX
@@ -249,6 +350,7 @@ class argon:
         self.configure_tx_unfiltered()
         self.configure_receive()
 
+    @operation
     def configure_tx_filters(self, freq):
         """
         Configure the TX filters for the requested frequency
@@ -273,32 +375,76 @@ class argon:
                 self.log.info("Configuring TX filters for {}".format(k))
                 for gpio, val in zip(self.tx_filt, v):
                     gpio.set_values([val])
+                self.state["tx_filter0"] = k
                 return
 
+    @operation
     def reset_synth(self):
         """
         Reset the synthesizer. Power it down via registers, disable it, and
         disable the RX/TX mixer paths
         """
         self.log.info("Resetting Synthesizer")
-        self.send_spi(self.synth_settings.RESET)
-        self.send_spi(self.synth_settings.POWER_D)
+        with self.bus.hold():
+            self.send_spi(self.synth_settings.RESET)
+            self.send_spi(self.synth_settings.POWER_D)
         self.current_synth_setting = -1
+        self.state["synth_band"] = -1
+        self.synth_locked = False
         self.synth_en.set_values([0])
         self.rx_mix_en.set_values([0])
         self.tx_mix_en.set_values([0])
 
+    @operation
     def configure_tx_unfiltered(self):
         """Configure the TX filters to the unfiltered setting"""
         self.configure_tx_filters(4000000000)
 
+    def synth_band(self, frequency):
+        """
+        Returns the synthesizer setting configure_synth would select for a
+        frequency, without touching the hardware
+
+        Args:
+            frequency (int): The desired frequency for the radio to be
+                             configured to.
+
+        Returns:
+            int: Index into SYNTH_FREQ, or -1 if the synthesizer is not
+                 used for (or cannot reach) the frequency
+        """
+        bounds = self.synth_settings.SYNTH_BOUNDS
+        for i in range(1, len(bounds)):
+            if bounds[0] <= frequency < bounds[i]:
+                return i-1
+        return -1
+
+    def tuned_frequency(self, frequency, band):
+        """
+        Returns the frequency the radio should be tuned to for a frequency
+        with the given synthesizer setting
+
+        Args:
+            frequency (int): The desired frequency
+
+            band (int): Index into SYNTH_FREQ, or -1 for no synthesizer
+
+        Returns:
+            int: The frequency to tune the transceiver to
+        """
+        if band == -1:
+            return frequency
+        return frequency-self.synth_settings.SYNTH_FREQ[band]
+
+    @operation
     def configure_synth(self, frequency, autofilter=False):
         """
         Configure the synthesizer for the given frequency. If autofilter
         is set, also set the proper TX filters. If the synthesizer must
         be used to achieve the desired frequency, we enable the RX/TX
         mixer paths and the synthesizer itself. If it is not required,
-        we disable all of these.
+        we disable all of these. After starting calibration this waits
+        for the synthesizer to report lock (see wait_for_lock).
 
         Args:
             frequency (int): The desired frequency for the radio to be
@@ -315,22 +461,41 @@ class argon:
                         the requested frequency (taking into account the
                         synthesizer setting).
         """
+        return run_steps(self.synth_steps(frequency, autofilter))
+
+    def synth_steps(self, frequency, autofilter=False):
+        """
+        Generator performing configure_synth one step at a time. Each
+        wait is yielded as a number of seconds instead of slept, so that
+        callers can wait without blocking (see run_steps).
+
+        Args:
+            frequency (int): The desired frequency for the radio to be
+                             configured to.
+
+            autofilter (bool): Change filters to the appropriate setting
+                               after configuring the synthesizer.
+                               (Default: False)
+
+        Returns:
+            freq (int): The return value of configure_synth
+        """
         self.reset_synth()
         if frequency >= self.synth_settings.SYNTH_BOUNDS[0]:
             #Power synth back up and enable
             self.synth_en.set_values([1])
-            self.send_spi(self.synth_settings.POWER_U)
-            self.send_spi(self.synth_settings.RESET)
+            with self.bus.hold():
+                self.send_spi(self.synth_settings.POWER_U)
+                self.send_spi(self.synth_settings.RESET)
             for i in range(1, len(self.synth_settings.SYNTH_BOUNDS)):
                 if frequency < self.synth_settings.SYNTH_BOUNDS[i]:
                     self.log.info("Configuring synthesizer for frequency {}".format(self.synth_settings.SYNTH_FREQ[i-1]))
-                    settings = self.synth_settings.get_settings(i-1)
-                    for j in settings:
-                        self.send_spi(j)
+                    self.upload_settings(i-1)
                     self.current_synth_setting = i-1
                     #According to the datasheet, you should wait 10ms before attempting calibration
-                    time.sleep(10/1000)
+                    yield 10/1000
                     self.send_spi(self.synth_settings.FCAL_EN)
+                    yield from self.lock_steps()
                     break
                 else:
                     self.current_synth_setting = i
@@ -348,11 +513,133 @@ class argon:
                 self.tx_mix_en.set_values([1])
         elif autofilter:
             self.configure_tx_filters(frequency)
+        self.state["synth_band"] = self.current_synth_setting
         if self.current_synth_setting == -1:
             return frequency
         else:
             return frequency-self.synth_settings.SYNTH_FREQ[self.current_synth_setting]
 
+    @operation
+    def wait_for_lock(self):
+        """
+        Poll the synthesizer's lock detect readback after calibration has
+        been started, with a short backoff, until it reports lock or
+        lock_timeout expires. The measured time is stored in
+        last_cal_time and the outcome in synth_locked.
+
+        Returns:
+            bool: True if the synthesizer locked
+        """
+        return run_steps(self.lock_steps())
+
+    def lock_steps(self):
+        """
+        Generator performing wait_for_lock, yielding each backoff delay
+        in seconds instead of sleeping (see run_steps)
+
+        Returns:
+            bool: True if the synthesizer locked
+        """
+        start = time.monotonic()
+        deadline = start + self.lock_timeout
+        delay = 100e-6
+        self.send_spi(self.synth_settings.MUXOUT_READBACK)
+        while True:
+            locked = self.read_lock_detect() == self.synth_settings.LD_LOCKED
+            now = time.monotonic()
+            if locked or now >= deadline:
+                break
+            yield min(delay, deadline - now)
+            delay = min(delay*2, 2e-3)
+        self.send_spi(self.synth_settings.MUXOUT_LD)
+
+        self.last_cal_time = now - start
+        self.synth_locked = locked
+        if locked:
+            self.log.info("Synthesizer locked after {:.2f}ms".format(self.last_cal_time*1000))
+        else:
+            self.log.warning("Synthesizer did not lock within {:.2f}ms".format(self.lock_timeout*1000))
+        return locked
+
+    @operation
+    def read_lock_detect(self):
+        """
+        Read the synthesizer's lock detect state. MUXout must be set to
+        register readback.
+
+        Returns:
+            int: rb_LD_VTUNE (0: calibrating, 1: VTUNE high,
+                 2: locked, 3: VTUNE low)
+        """
+        return (self.read_spi(self.synth_settings.LD_REG) >> 9) & 0x3
+
+    @operation
+    def read_spi(self, reg):
+        """
+        Read a synthesizer register through the I2C->SPI bridge
+
+        Args:
+            reg (int): Register number to read
+
+        Returns:
+            int: 16-bit register value
+        """
+        with self.bus.hold():
+            self.bus.write_i2c_block_data(self.address, self.CS, [0x80 | reg, 0x00, 0x00])
+            data = self.bus.read(self.address, 3)
+        return (data[1] << 8) | data[2]
+
+    def compile_settings(self, index):
+        """
+        Returns the register image of a synthesizer setting compiled for
+        the bus, compiling it on first use
+
+        Args:
+            index (int): The index of the desired frequency setting from
+                         SYNTH_FREQ
+
+        Returns:
+            The compiled burst (see smbus_pool.compile)
+        """
+        burst = self.compiled.get(index)
+        if burst is None:
+            burst = self.bus.compile(self.address, self.synth_settings.get_payloads(index, self.CS))
+            self.compiled[index] = burst
+        return burst
+
+    def prepare(self, method, *args, **kwargs):
+        """
+        Precompute the register payloads of an operation that will be
+        called later, e.g. at a deadline (see command_scheduler), so the
+        call only has to send them. For configure_synth the register
+        image of the target band is compiled for the bus.
+
+        Args:
+            method (str): Name of the operation
+
+            args: Arguments the operation will be called with
+        """
+        if method == "configure_synth":
+            frequency = args[0] if args else kwargs["frequency"]
+            band = self.synth_band(frequency)
+            if band != -1:
+                self.compile_settings(band)
+
+    @operation
+    def upload_settings(self, index):
+        """
+        Send the full register image for a synthesizer setting as one
+        burst. The image is compiled for the bus on first use.
+
+        Args:
+            index (int): The index of the desired frequency setting from
+                         SYNTH_FREQ
+        """
+        burst = self.compile_settings(index)
+        self.log.debug("Sending register image {}".format(index))
+        self.bus.transfer(burst)
+
+    @operation
     def send_spi(self, data):
         """
         Sends a list of commands on the SPI bus.
@@ -364,6 +651,7 @@ class argon:
         self.log.debug("Sending {}".format([hex(num) for num in data]))
         self.bus.write_i2c_block_data(self.address, self.CS, data)
 
+    @operation
     def configure_transmit(self):
         """
         Configures the radio for transmit. Disable RX and enables TX (if
@@ -376,7 +664,9 @@ class argon:
         if self.tx:
             self.tx.set_values([1])
         self.tx_enable.set_values([1])
+        self.state["transmit"] = 1
 
+    @operation
     def configure_receive(self):
         """
         Configures the radio for receive. Disables the TX enable line.
@@ -389,3 +679,4 @@ class argon:
             self.tx.set_values([0])
         if self.rx:
             self.rx.set_values([1])
+        self.state["transmit"] = 0
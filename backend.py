@@ -0,0 +1,455 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Hardware access backends
+
+Cards open their gpiochips, I2C buses and IIO contexts through the
+functions in this module instead of calling gpiod, smbus and iio
+directly. The active backend decides what is opened, which allows the
+hardware to be replaced by a simulation (see sim) for dry runs.
+
+Every handle returned is wrapped so that each hardware primitive is
+timed and reported to the registered listeners (see add_listener). The
+metrics module is always registered.
+"""
+
+import time
+import threading
+from . import metrics
+
+#Line request types and event types, with the values of the libgpiod v1
+#API. Cards use these instead of the gpiod module's so that they work
+#with every backend.
+LINE_REQ_DIR_IN = 2
+LINE_REQ_DIR_OUT = 3
+LINE_REQ_EV_FALLING_EDGE = 4
+LINE_REQ_EV_RISING_EDGE = 5
+LINE_REQ_EV_BOTH_EDGES = 6
+EVENT_RISING_EDGE = 1
+EVENT_FALLING_EDGE = 2
+
+class hw_backend:
+    """Backend opening the real hardware through gpiod, smbus and iio"""
+
+    def __init__(self, gpiod_api="auto", lazy_requests=False):
+        """
+        Create a hw_backend instance
+
+        Args:
+            gpiod_api (str): "v1" or "v2" to select the libgpiod Python
+                             API, "auto" to use the one installed, or
+                             "uapi" to issue the GPIO_V2 ioctls directly
+                             (see gpio_uapi) (Default: "auto")
+
+            lazy_requests (bool): With libgpiod v2, defer and merge output
+                                  line requests until the lines are first
+                                  written (see gpiod_v2) (Default: False)
+        """
+        self.gpiod_api = gpiod_api
+        self.lazy_requests = lazy_requests
+
+    def open_chip(self, num):
+        if self.gpiod_api == "uapi":
+            from .gpio_uapi import uapi_chip
+            return uapi_chip(num)
+        import gpiod
+        api = self.gpiod_api
+        if api == "auto":
+            api = "v2" if hasattr(gpiod, "request_lines") else "v1"
+        if api == "v2":
+            from .gpiod_v2 import v2_chip
+            return v2_chip(num, self.lazy_requests)
+        return gpiod.Chip('gpiochip{}'.format(num))
+
+    def open_smbus(self, num):
+        import smbus
+        return smbus.SMBus(num)
+
+    def open_i2c_dev(self, num):
+        from .i2c_dev import i2c_dev
+        return i2c_dev(num)
+
+    def open_iio_context(self):
+        import iio
+        return iio.LocalContext()
+
+    def open_debugfs_regs(self, path, name):
+        from .debugfs_regs import debugfs_regs
+        return debugfs_regs(path)
+
+    def open_mmap_regs(self, path, base, size):
+        from .mmap_regs import mmap_regs
+        return mmap_regs(path, base, size)
+
+_backend_lock = threading.Lock()
+_backend = hw_backend()
+_listeners = []
+
+def add_listener(listener):
+    """
+    Register a function to be called for every hardware primitive with
+    the arguments (op, target, detail, start_ns, duration_ns). op is one
+    of "line_request", "line_write", "line_release", "i2c_write", "i2c_read",
+    "i2c_transfer", "iio_reg_read" or "iio_reg_write", target names the
+    chip, bus or device, and detail holds the operation's arguments.
+
+    Args:
+        listener (function): The listener
+    """
+    with _backend_lock:
+        _listeners.append(listener)
+
+def remove_listener(listener):
+    """
+    Unregister a listener
+
+    Args:
+        listener (function): The listener
+    """
+    with _backend_lock:
+        _listeners.remove(listener)
+
+def notify(op, target, detail, start_ns, duration_ns):
+    """Report a hardware primitive to every listener"""
+    for listener in _listeners:
+        listener(op, target, detail, start_ns, duration_ns)
+
+class traced_chip:
+    """Wraps a gpiochip so that its line operations are reported"""
+
+    def __init__(self, chip, num):
+        self.chip = chip
+        self.target = "gpiochip{}".format(num)
+
+    def get_lines(self, offsets):
+        return traced_lines(self.chip.get_lines(offsets), self.target, list(offsets))
+
+    def __getattr__(self, name):
+        return getattr(self.chip, name)
+
+class traced_lines:
+    """Wraps gpiod lines so that requests and writes are reported"""
+
+    def __init__(self, lines, target, offsets):
+        self.lines = lines
+        self.target = target
+        self.offsets = offsets
+
+    def request(self, consumer=None, type=None, default_vals=None):
+        start = time.perf_counter_ns()
+        kwargs = {"consumer": consumer}
+        if type is not None:
+            kwargs["type"] = type
+        if default_vals is not None:
+            kwargs["default_vals"] = default_vals
+        self.lines.request(**kwargs)
+        notify("line_request", self.target,
+               (self.offsets, consumer, type, list(default_vals) if default_vals else None),
+               start, time.perf_counter_ns() - start)
+
+    def set_values(self, values):
+        start = time.perf_counter_ns()
+        self.lines.set_values(values)
+        notify("line_write", self.target, (self.offsets, list(values)),
+               start, time.perf_counter_ns() - start)
+
+    def release(self):
+        start = time.perf_counter_ns()
+        self.lines.release()
+        notify("line_release", self.target, (self.offsets,),
+               start, time.perf_counter_ns() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.lines, name)
+
+class traced_i2c:
+    """Wraps an SMBus or i2c_dev handle so that transfers are reported"""
+
+    def __init__(self, bus, num):
+        self.bus = bus
+        self.target = "i2c{}".format(num)
+
+    def write_i2c_block_data(self, address, cmd, data):
+        start = time.perf_counter_ns()
+        self.bus.write_i2c_block_data(address, cmd, data)
+        notify("i2c_write", self.target, (address, bytes([cmd] + list(data))),
+               start, time.perf_counter_ns() - start)
+
+    def read(self, address, count):
+        start = time.perf_counter_ns()
+        data = self.bus.read(address, count)
+        notify("i2c_read", self.target, (address, count), start, time.perf_counter_ns() - start)
+        return data
+
+    def transfer(self, compiled):
+        start = time.perf_counter_ns()
+        self.bus.transfer(compiled)
+        notify("i2c_transfer", self.target, (compiled.address, compiled.payloads),
+               start, time.perf_counter_ns() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.bus, name)
+
+class traced_iio_context:
+    """Wraps an IIO context so that devices found are traced"""
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    def find_device(self, name):
+        return traced_iio_device(self.ctx.find_device(name), name)
+
+    def __getattr__(self, name):
+        return getattr(self.ctx, name)
+
+class traced_iio_device:
+    """Wraps an IIO device so that register accesses are reported"""
+
+    def __init__(self, dev, name):
+        self.dev = dev
+        self.target = name
+
+    def reg_read(self, reg):
+        start = time.perf_counter_ns()
+        val = self.dev.reg_read(reg)
+        notify("iio_reg_read", self.target, (reg, val), start, time.perf_counter_ns() - start)
+        return val
+
+    def reg_write(self, reg, val):
+        start = time.perf_counter_ns()
+        self.dev.reg_write(reg, val)
+        notify("iio_reg_write", self.target, (reg, val), start, time.perf_counter_ns() - start)
+
+    def __getattr__(self, name):
+        return getattr(self.dev, name)
+
+def set_backend(backend):
+    """
+    Select the backend used to open hardware from now on. Cards that are
+    already open keep their handles.
+
+    Args:
+        backend (object): The backend instance
+
+    Returns:
+        object: The previously active backend
+    """
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+def get_backend():
+    """
+    Returns:
+        object: The active backend
+    """
+    return _backend
+
+def open_chip(num):
+    """
+    Open a gpiochip
+
+    Args:
+        num (int): Number of the gpiochip
+
+    Returns:
+        gpiod.Chip: The chip (or an object like it)
+    """
+    return traced_chip(_backend.open_chip(num), num)
+
+def open_line_bank(num):
+    """
+    Open a gpiochip for a card whose output lines on it are requested as
+    one bulk request (see line_bank)
+
+    Args:
+        num (int): Number of the gpiochip
+
+    Returns:
+        line_bank: The bank of the chip
+    """
+    return line_bank(open_chip(num))
+
+class line_bank:
+    """
+    The output lines a card uses on one chip, requested together. The
+    card takes gpiod-like handles from get_lines() and sets their initial
+    values with the handles' request(), then calls request() on the bank
+    once: every line is claimed in a single kernel request (one file
+    descriptor) with its initial value, instead of one request per line.
+    A write updates a shadow of the lines and is applied with a single
+    set_values on the whole request.
+    """
+
+    def __init__(self, chip):
+        """
+        Create a line_bank instance
+
+        Args:
+            chip (gpiod.Chip): The chip (or an object like it)
+        """
+        self.chip = chip
+        self.lock = threading.Lock()
+        self.offsets = []
+        self.index = {}
+        self.values = []
+        self.lines = None
+
+    def get_lines(self, offsets):
+        """
+        Add lines to the bank
+
+        Args:
+            offsets (list[int]): Lines of the chip
+
+        Returns:
+            bank_lines: Handle to the lines
+        """
+        with self.lock:
+            for o in offsets:
+                if o not in self.index:
+                    self.index[o] = len(self.offsets)
+                    self.offsets.append(o)
+                    self.values.append(0)
+        return bank_lines(self, offsets)
+
+    def request(self, consumer=None):
+        """
+        Request every line of the bank as outputs at their initial values
+
+        Args:
+            consumer (str): Consumer label of the request (Default: None)
+        """
+        with self.lock:
+            if not self.offsets or self.lines is not None:
+                return
+            lines = self.chip.get_lines(self.offsets)
+            lines.request(consumer=consumer, type=LINE_REQ_DIR_OUT, default_vals=list(self.values))
+            self.lines = lines
+
+    def write(self, offsets, values):
+        """
+        Set lines of the bank. Before request(), only the initial values
+        are updated. A write that changes nothing is not sent.
+
+        Args:
+            offsets (list[int]): Lines to set
+
+            values (list[int]): Values to set the lines to
+        """
+        with self.lock:
+            previous = list(self.values)
+            for o, v in zip(offsets, values):
+                self.values[self.index[o]] = 1 if v else 0
+            if self.lines is not None and self.values != previous:
+                try:
+                    self.lines.set_values(self.values)
+                except Exception:
+                    self.values = previous
+                    raise
+
+    def read(self, offsets):
+        """
+        Returns:
+            list[int]: Shadowed values of the requested lines
+        """
+        with self.lock:
+            return [self.values[self.index[o]] for o in offsets]
+
+    def release(self):
+        """Release the request of the bank"""
+        with self.lock:
+            if self.lines is not None:
+                self.lines.release()
+                self.lines = None
+
+class bank_lines:
+    """Lines of a line_bank, used like gpiod lines"""
+
+    def __init__(self, bank, offsets):
+        self.bank = bank
+        self.offsets = list(offsets)
+
+    def request(self, consumer=None, type=None, default_vals=None):
+        """
+        Set the initial values of the lines. The kernel request is made by
+        the bank's request(). Only outputs can be banked.
+        """
+        if type not in (None, LINE_REQ_DIR_OUT):
+            raise ValueError("Only output lines can be requested through a line_bank")
+        if default_vals is not None:
+            self.bank.write(self.offsets, default_vals)
+
+    def set_values(self, values):
+        self.bank.write(self.offsets, values)
+
+    def get_values(self):
+        return self.bank.read(self.offsets)
+
+def open_smbus(num):
+    """
+    Open an I2C bus as SMBus
+
+    Args:
+        num (int): Number of the I2C bus
+
+    Returns:
+        smbus.SMBus: The bus (or an object like it)
+    """
+    return traced_i2c(_backend.open_smbus(num), num)
+
+def open_i2c_dev(num):
+    """
+    Open an I2C bus as a raw i2c-dev handle
+
+    Args:
+        num (int): Number of the I2C bus
+
+    Returns:
+        i2c_dev: The bus (or an object like it)
+    """
+    return traced_i2c(_backend.open_i2c_dev(num), num)
+
+def open_iio_context():
+    """
+    Open the local IIO context
+
+    Returns:
+        iio.LocalContext: The context (or an object like it)
+    """
+    return traced_iio_context(_backend.open_iio_context())
+
+def open_debugfs_regs(path, name):
+    """
+    Open the debugfs register access file of an IIO device
+
+    Args:
+        path (str): Path of the direct_reg_access file
+
+        name (str): Name of the IIO device
+
+    Returns:
+        debugfs_regs: The register access (or an object like it)
+    """
+    return traced_iio_device(_backend.open_debugfs_regs(path, name), name)
+
+def open_mmap_regs(path, base=0, size=0x1000):
+    """
+    Map a window of registers. Stores to them are not traced.
+
+    Args:
+        path (str): File to map: /dev/mem, /dev/uioN or any file
+
+        base (int): Address of the registers in the file (Default: 0)
+
+        size (int): Size of the window in bytes (Default: 0x1000)
+
+    Returns:
+        mmap_regs: The registers (or an object like it)
+    """
+    return _backend.open_mmap_regs(path, base, size)
+
+add_listener(metrics.observe_hw)
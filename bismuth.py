@@ -2,10 +2,13 @@
 
 # SPDX-License-Identifier: MIT
 
-import gpiod
+import threading
 import logging
 from .gpio_line_mux import *
 from .iio_gpo_control import *
+from .card_operation import *
+from .carp_expander import *
+from .backend import *
 from .constants import *
 
 class bismuth:
@@ -17,7 +20,22 @@ class bismuth:
         my_bismuth = pc_card_control.bismuth(0, 2, 0)
     """
 
-    def __init__(self, pc_slot, gpiochip_num, transceiver_num, carp=0, control_rxtx=1, reset=1):
+    SETTLING = {"configure_tx_filters":    10e-6,
+                "configure_tx_unfiltered": 10e-6,
+                "configure_pa":            10e-6,
+                "enable_pa":               50e-6,
+                "disable_pa":              10e-6,
+                "enable_lnas":             10e-6,
+                "disable_lnas":            10e-6,
+                "configure_rx_att":        10e-6,
+                "configure_receive":       50e-6,
+                "configure_transmit":      50e-6}
+    """dict: Analog settling time in seconds after each operation (see operation)"""
+
+    EXPANDER_LINES = [1, 2, 3, 4, 5]
+    """list[int]: CARP expander lines driven by the card, relative to 6*pc_slot"""
+
+    def __init__(self, pc_slot, gpiochip_num, transceiver_num, carp=0, control_rxtx=1, reset=1, gpo_backend="iio", debugfs_path=None, mux_options=None):
         """
         Initialize a Bismuth board
 
@@ -39,11 +57,32 @@ class bismuth:
 
             reset (int): Should the reset() function be called at the end
                          of initialization (Default:1)
+
+            gpo_backend (str): Register backend of the transceiver GPO
+                               control if it is not already open: "iio",
+                               or "debugfs" to keep the direct_reg_access
+                               file open (Default: "iio")
+
+            debugfs_path (str): direct_reg_access file for the debugfs
+                                GPO backend. Found from the IIO device
+                                name if not set (Default: None)
+
+            mux_options (dict): gpio_line_mux arguments on CARP, used if
+                                the line mux is not already open, e.g.
+                                {"mux_backend": "mmap", "mmap_base": ...}
+                                (Default: None)
         """
 
         #Setup logger
         self.log = logging.getLogger("bismuth_{}".format(pc_slot))
 
+        #Serializes operations on this card between threads
+        self.lock = threading.RLock()
+
+        #Logical state of the card, published by state_shm when enabled
+        self.state = {}
+        self.pc_slot = pc_slot
+
         #Debug log to express initialization parameters
         self.log.debug("Bismuth init")
         self.log.debug("Using base GPIOCHIP{}".format(BASE_GPIO_CHIP))
@@ -56,13 +95,21 @@ class bismuth:
             self.log.debug("Set to control RX/TX")
 
         #GPIO setup
-        self.gpiochip0 = gpiod.Chip('gpiochip{}'.format(BASE_GPIO_CHIP))
+        self.gpiochip0 = open_line_bank(BASE_GPIO_CHIP)
         if carp:
-            self.gpiochip2 = gpiod.Chip('gpiochip{}'.format(CARP_GPIO_CHIP))
-            self.line_mux  = gpio_line_mux()
+            self.gpiochip2 = get_carp_expander()
+            self.gpiochip2.claim(slot_lines(pc_slot, self.EXPANDER_LINES))
+            self.batch     = self.gpiochip2.batch
+            self.line_mux  = get_line_mux(**(mux_options or {}))
         else:
-            self.gpo_ctrl = iio_gpo_control()
-        self.gpiochip  = gpiod.Chip("gpiochip{}".format(gpiochip_num))
+            self.gpo_ctrl = get_gpo_control(reg_backend=gpo_backend, debugfs_path=debugfs_path)
+        self.gpiochip  = open_line_bank(gpiochip_num)
+        if carp:
+            #Writes to the other chips must not overtake expander writes
+            #still pending in the operation's batch
+            self.gpiochip0 = self.gpiochip2.ordered(self.gpiochip0)
+            self.gpiochip  = self.gpiochip2.ordered(self.gpiochip)
+            self.line_mux  = self.gpiochip2.ordered(self.line_mux)
 
         self.lna_enable = [None]*2
         if carp:
@@ -122,21 +169,27 @@ class bismuth:
         self.rx_att[1] = self.gpiochip.get_lines([6])
         self.pa_enable = self.gpiochip.get_lines([7])
 
-        self.pa_enable.request(consumer='BISMUTH_PA_ENABLE', type=gpiod.LINE_REQ_DIR_OUT)
+        self.pa_enable.request(consumer='BISMUTH_PA_ENABLE', type=LINE_REQ_DIR_OUT)
         if control_rxtx:
-            self.rx.request(consumer='BISMUTH_RX_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
-            self.tx.request(consumer='BISMUTH_TX_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
+            self.rx.request(consumer='BISMUTH_RX_CTRL', type=LINE_REQ_DIR_OUT)
+            self.tx.request(consumer='BISMUTH_TX_CTRL', type=LINE_REQ_DIR_OUT)
 
         for i in self.pa:
-            i.request(consumer='BISMUTH_PA', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='BISMUTH_PA', type=LINE_REQ_DIR_OUT)
         for i in self.rx_att:
-            i.request(consumer='BISMUTH_RX_ATT', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='BISMUTH_RX_ATT', type=LINE_REQ_DIR_OUT)
         for i in self.tx_filt:
-            i.request(consumer='BISMUTH_TX_FILT', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='BISMUTH_TX_FILT', type=LINE_REQ_DIR_OUT)
+
+        #The lines above only set the initial values; each chip's lines are
+        #claimed here in one request, driven to those values
+        self.gpiochip0.request(consumer='BISMUTH')
+        self.gpiochip.request(consumer='BISMUTH')
 
         if reset:
             self.reset()
 
+    @operation
     def reset(self):
         """
         Base reset for the board. Disables TX filtering, sets to not use
@@ -149,6 +202,7 @@ class bismuth:
         self.disable_lnas()
         self.configure_rx_att(0)
 
+    @operation
     def configure_pa(self, power_level):
         """
         Configure the PA
@@ -170,7 +224,9 @@ class bismuth:
         for gpio, val in zip(self.pa, power[power_level]):
             gpio.set_values([val])
         self.log.info("Power level set to {}".format(power_level))
+        self.state["pa_level"] = power_level
 
+    @operation
     def enable_pa(self):
         """
         Enable the PAs. Disable the LNAs
@@ -179,7 +235,9 @@ class bismuth:
         self.disable_lnas()
         self.pa_enable.set_values([1])
         self.tx_enable.set_values([1])
+        self.state["pa_enabled"] = 1
 
+    @operation
     def disable_pa(self):
         """
         Disable the PAs.
@@ -187,7 +245,9 @@ class bismuth:
         self.log.info("Disabling PAs")
         self.tx_enable.set_values([0])
         self.pa_enable.set_values([0])
+        self.state["pa_enabled"] = 0
 
+    @operation
     def configure_receive(self):
         """
         Disable the PAs. If control_rxtx set, turn off TX and enable RX.
@@ -198,7 +258,9 @@ class bismuth:
             self.tx.set_values([0])
         if self.rx:
             self.rx.set_values([1])
+        self.state["transmit"] = 0
 
+    @operation
     def configure_transmit(self):
         """
         Disable the LNAs. If control_rxtx set, turn off RX and enable TX.
@@ -209,7 +271,9 @@ class bismuth:
             self.rx.set_values([0])
         if self.tx:
             self.tx.set_values([1])
+        self.state["transmit"] = 1
 
+    @operation
     def configure_tx_filters(self, freq):
         """
         Configure the TX filters for the requested frequency
@@ -229,25 +293,32 @@ class bismuth:
                 self.log.info("Configuring TX filters for {}".format(k))
                 for gpio, val in zip(self.tx_filt, v):
                     gpio.set_values([val])
+                self.state["tx_filter0"] = k
                 return
 
+    @operation
     def configure_tx_unfiltered(self):
         """Configure the TX filters to the unfiltered setting"""
         self.configure_tx_filters(4000000000)
 
+    @operation
     def enable_lnas(self):
         """Enables the LNAs. Also disables the PAs"""
         self.log.info("Enabling LNAs")
         self.disable_pa()
         for i in self.lna_enable:
             i.set_values([1])
+        self.state["lna_enabled"] = 1
 
+    @operation
     def disable_lnas(self):
         """Disables the LNAs"""
         self.log.info("Disabling LNAs")
         for i in self.lna_enable:
             i.set_values([0])
+        self.state["lna_enabled"] = 0
 
+    @operation
     def configure_rx_att(self, rx_att):
         """
         Configure the RX attenuation
@@ -273,3 +344,4 @@ class bismuth:
         for gpio, val in zip(self.rx_att, rx_lev[rx_att]):
             gpio.set_values([val])
         self.log.info("RX Attentuation set to {}dB".format(rx_map[rx_att]))
+        self.state["rx_att"] = rx_att
@@ -0,0 +1,244 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import time
+import functools
+import contextlib
+from . import metrics
+from . import state_shm
+
+class ready_at(int):
+    """
+    A time.monotonic_ns() timestamp at which the analog outputs of a card
+    have settled after an operation. Every card keeps its own in
+    card.ready_at (see operation).
+    """
+
+    def remaining(self):
+        """
+        Returns:
+            float: Seconds left until settled, 0 if already settled
+        """
+        return max(self - time.monotonic_ns(), 0)/1e9
+
+    def wait(self):
+        """Sleep until settled"""
+        wait_ready(self)
+
+def push_ready(card, seconds):
+    """
+    Push a card's ready_at to at least the given time from now
+
+    Args:
+        card (object): The card
+
+        seconds (float): Settling time from now
+
+    Returns:
+        ready_at: The card's new ready_at
+    """
+    card.ready_at = ready_at(max(getattr(card, "ready_at", 0), time.monotonic_ns() + int(seconds*1e9)))
+    return card.ready_at
+
+def latest_ready(*items):
+    """
+    Returns the time at which everything given has settled
+
+    Args:
+        items: ready_at timestamps and/or cards (whose ready_at is used)
+
+    Returns:
+        ready_at: The latest of the timestamps
+    """
+    return ready_at(max([i if isinstance(i, int) else getattr(i, "ready_at", 0) for i in items], default=0))
+
+def wait_ready(*items):
+    """
+    Sleep until everything given has settled. Issue the operations of
+    every card first and wait once, so that their settling times overlap.
+
+    Args:
+        items: ready_at timestamps and/or cards (whose ready_at is used)
+    """
+    delay = latest_ready(*items).remaining()
+    if delay > 0:
+        time.sleep(delay)
+
+def operation(method):
+    """
+    Decorator for the public methods of a card class. The method runs
+    while holding the card's lock (self.lock), so that a multi-line
+    sequence such as a filter code is never interleaved with another
+    thread operating on the same card. The lock is reentrant so
+    operations may call each other.
+
+    If the card has a batch context (self.batch, set by cards on CARP),
+    the method also runs inside it so that all of its expander writes
+    are applied at once when the outermost operation returns.
+
+    Every call is counted and timed in the metrics module, labelled with
+    the card's logger name and the method name. If state publication is
+    enabled (see state_shm), the card's logical state (self.state) is
+    published when the method returns.
+
+    The card's SETTLING dict gives the analog settling time in seconds
+    after each method. When the outermost operation returns (after its
+    batch has been written), card.ready_at is pushed to now plus the
+    longest settling time of the operations it performed. A method that
+    returns None returns this ready_at instead, other return values are
+    passed through unchanged:
+
+        my_tellurium.enable_pa().wait()
+
+    card.ready_at is shared by every thread using the card, so it may
+    already be overwritten by another operation when read. Use
+    with_ready() to get the return value together with the ready_at of
+    that very call:
+
+        freq, ready = with_ready(my_argon.configure_synth, 12e9)
+        ready.wait()
+
+    Nothing sleeps for settling; callers wait with wait_ready() when they
+    need the outputs settled, e.g. before sampling.
+
+    Args:
+        method (function): The card method to wrap
+
+    Returns:
+        function: The wrapped method
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with operation_context(self, name) as call:
+            call.result = method(self, *args, **kwargs)
+        return call.returned()
+    return wrapper
+
+def with_ready(method, *args, **kwargs):
+    """
+    Call an operation of a card and return its result together with its
+    ready_at. The card's lock is held until the ready_at is read, so it
+    belongs to this call even if other threads operate on the card.
+
+    Args:
+        method (function): A bound operation, e.g. my_argon.configure_synth
+
+        args: Positional arguments of the operation
+
+        kwargs: Keyword arguments of the operation
+
+    Returns:
+        tuple: The operation's return value and its ready_at
+    """
+    card = method.__self__
+    with card.lock:
+        result = method(*args, **kwargs)
+        return result, card.ready_at
+
+class operation_call:
+    """The result of an operation in progress (see operation_context)"""
+
+    def __init__(self):
+        self.result = None
+        self.ready = None
+
+    def returned(self):
+        """
+        Returns:
+            The result, or the ready_at of the operation if the result is None
+        """
+        return self.ready if self.result is None else self.result
+
+@contextlib.contextmanager
+def operation_context(card, name):
+    """
+    Run the body of a card operation as operation does: under the card's
+    lock and batch, timed into the metrics, with the card's settling and
+    state updated on exit. The body stores its return value in the
+    yielded operation_call, which receives the ready_at of the operation
+    on exit.
+
+    Args:
+        card (object): The card
+
+        name (str): Name of the operation
+
+    Yields:
+        operation_call: Holder of the result
+    """
+    batch = getattr(card, "batch", None)
+    settle = getattr(card, "SETTLING", {}).get(name, 0)
+    call = operation_call()
+    start = time.perf_counter_ns()
+    failed = True
+    try:
+        with card.lock:
+            #Longest settling time of the operations in progress
+            outer = getattr(card, "settling", None) is None
+            if outer:
+                card.settling = 0
+            try:
+                with batch() if batch is not None else contextlib.nullcontext():
+                    yield call
+                card.settling = max(card.settling, settle)
+                if outer:
+                    call.ready = push_ready(card, card.settling)
+                else:
+                    #Settled at the earliest when the outer operation returns
+                    call.ready = ready_at(time.monotonic_ns() + int(settle*1e9))
+            finally:
+                if outer:
+                    card.settling = None
+            publisher = state_shm.publisher
+            if publisher is not None:
+                publisher.publish(getattr(card, "pc_slot", state_shm.BACKPACK_SLOT),
+                                  state_shm.card_type(card), card.state)
+        failed = False
+    finally:
+        metrics.observe_method(card.log.name, name, start, time.perf_counter_ns() - start, failed)
+
+def operation_steps(card, name, steps):
+    """
+    Wrap a step generator (see run_steps) of a card as an operation. The
+    card's lock and batch are held from the first step to the last, and
+    the state is published and the call timed when it finishes, exactly
+    as operation does for the blocking method. All steps must be driven
+    from the same thread (the lock is a threading.RLock); aio drives them
+    on the card's bus executor, each operation in its own context.
+
+    Args:
+        card (object): The card
+
+        name (str): Name of the operation, e.g. "configure_synth"
+
+        steps (generator): The step generator
+
+    Returns:
+        generator: A step generator returning the same value as operation
+    """
+    with operation_context(card, name) as call:
+        call.result = yield from steps
+    return call.returned()
+
+def run_steps(steps):
+    """
+    Drive a step generator to completion, sleeping for each wait it
+    yields. Card methods that need to wait are written as generators
+    yielding the wait in seconds so the same steps can also be driven
+    without blocking (see aio).
+
+    Args:
+        steps (generator): The step generator
+
+    Returns:
+        The return value of the generator
+    """
+    while True:
+        try:
+            delay = next(steps)
+        except StopIteration as e:
+            return e.value
+        time.sleep(delay)
@@ -2,10 +2,12 @@
 
 # SPDX-License-Identifier: MIT
 
-import gpiod
+import threading
 import logging
 from .gpio_line_mux import *
 from .iio_gpo_control import *
+from .card_operation import *
+from .backend import *
 from .constants import *
 
 class cardf:
@@ -17,6 +19,22 @@ class cardf:
         my_cardf = pc_card_control.cardf(0, 2, reset=0)
     """
 
+    SETTLING = {"enable_bt":               10e-6,
+                "disable_bt":              10e-6,
+                "enable_wifi":             10e-6,
+                "disable_wifi":            10e-6,
+                "enable_lnas":             10e-6,
+                "disable_lnas":            10e-6,
+                "configure_rx_filters":    10e-6,
+                "configure_rx_unfiltered": 10e-6,
+                "configure_tx_filters":    10e-6,
+                "configure_tx_unfiltered": 10e-6,
+                "enable_pa":               50e-6,
+                "disable_pa":              10e-6,
+                "configure_receive":       50e-6,
+                "configure_transmit":      50e-6}
+    """dict: Analog settling time in seconds after each operation (see operation)"""
+
     def __init__(self, gpiochip_num, control_rxtx=1, reset=1):
         """
         Initialize a CARDF
@@ -36,6 +54,12 @@ class cardf:
         #Setup logger
         self.log = logging.getLogger("cardf")
 
+        #Serializes operations on this card between threads
+        self.lock = threading.RLock()
+
+        #Logical state of the card, published by state_shm when enabled
+        self.state = {}
+
         #Debug log to express initialization parameters
         self.log.debug("CARDF init")
         self.log.debug("Using base GPIOCHIP{}".format(BASE_GPIO_CHIP))
@@ -43,8 +67,8 @@ class cardf:
         if control_rxtx:
             self.log.debug("Set to control RX/TX")
 
-        self.gpiochip0 = gpiod.Chip('gpiochip{}'.format(BASE_GPIO_CHIP))
-        self.gpiochip  = gpiod.Chip("gpiochip{}".format(gpiochip_num))
+        self.gpiochip0 = open_line_bank(BASE_GPIO_CHIP)
+        self.gpiochip  = open_line_bank(gpiochip_num)
 
         self.tx_enable = [None] * 2
         self.tx_enable[0] = self.gpiochip0.get_lines([78])
@@ -101,33 +125,39 @@ class cardf:
 
         self.tx_inhib = self.gpiochip.get_lines([11])
 
-        self.tx_inhib.request(consumer='CARDF_TX_INHIB', type=gpiod.LINE_REQ_DIR_OUT)
+        self.tx_inhib.request(consumer='CARDF_TX_INHIB', type=LINE_REQ_DIR_OUT)
 
         if control_rxtx:
             for i in self.rx:
-                i.request(consumer='CARDF_RX_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
+                i.request(consumer='CARDF_RX_CTRL', type=LINE_REQ_DIR_OUT)
             for i in self.tx:
-                i.request(consumer='CARDF_TX_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
+                i.request(consumer='CARDF_TX_CTRL', type=LINE_REQ_DIR_OUT)
 
         for i in self.rx_bpf:
-            i.request(consumer='CARDF_RX_BPF', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='CARDF_RX_BPF', type=LINE_REQ_DIR_OUT)
         for j, i in enumerate(self.tx_filt):
             for k in i:
-                k.request(consumer='CARDF_TX_FILT_{}'.format(j), type=gpiod.LINE_REQ_DIR_OUT)
+                k.request(consumer='CARDF_TX_FILT_{}'.format(j), type=LINE_REQ_DIR_OUT)
         for i in self.lna_enable:
-            i.request(consumer='CARDF_LNA_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='CARDF_LNA_CTRL', type=LINE_REQ_DIR_OUT)
         for i in self.pa_enable:
-            i.request(consumer='CARDF_PA_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='CARDF_PA_CTRL', type=LINE_REQ_DIR_OUT)
         for i in self.bt_enable:
-            i.request(consumer='CARDF_BT_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='CARDF_BT_CTRL', type=LINE_REQ_DIR_OUT)
         for i in self.wifi_enable:
-            i.request(consumer='CARDF_WIFI_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='CARDF_WIFI_CTRL', type=LINE_REQ_DIR_OUT)
         for i in self.tx_enable:
-            i.request(consumer='CARDF_TX_EN', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='CARDF_TX_EN', type=LINE_REQ_DIR_OUT)
+
+        #The lines above only set the initial values; each chip's lines are
+        #claimed here in one request, driven to those values
+        self.gpiochip0.request(consumer='CARDF')
+        self.gpiochip.request(consumer='CARDF')
 
         if reset:
             self.reset()
 
+    @operation
     def reset(self):
         """
         Base reset for the board. Disables filtering, disables PAs/LNAs
@@ -137,42 +167,51 @@ class cardf:
         self.disable_pa()
         self.disable_lnas()
 
+    @operation
     def enable_bt(self):
         """Enable Bluetooth"""
         self.log.info("Enabling Bluetooth")
         for gpio in self.bt_enable:
             gpio.set_values([1])
 
+    @operation
     def disable_bt(self):
         """Disable Bluetooth"""
         self.log.info("Disabling Bluetooth")
         for gpio in self.bt_enable:
             gpio.set_values([0])
 
+    @operation
     def enable_wifi(self):
         """Enable WiFi"""
         self.log.info("Enabling WiFi")
         for gpio in self.wifi_enable:
             gpio.set_values([1])
 
+    @operation
     def disable_wifi(self):
         """Disable WiFi"""
         self.log.info("Disabling WiFi")
         for gpio in self.wifi_enable:
             gpio.set_values([0])
 
+    @operation
     def enable_lnas(self):
         """Enables the LNAs. Also disables the PAs"""
         self.log.info("Enabling LNAs")
         self.disable_pa()
         for gpio in self.lna_enable:
             gpio.set_values([1])
+        self.state["lna_enabled"] = 1
 
+    @operation
     def disable_lnas(self):
         """Disables the LNAs"""
         for gpio in self.lna_enable:
             gpio.set_values([0])
+        self.state["lna_enabled"] = 0
 
+    @operation
     def configure_rx_filters(self, freq):
         """
         Configure the RX filters for the requested frequency
@@ -192,12 +231,15 @@ class cardf:
                 for gpio, val in zip(self.rx_bpf, k[1]):
                     gpio.set_values([val])
                 self.log.info("Set BPF to {}".format(freq_names[i]))
+                self.state["rx_bpf"] = k[0][1]
                 return
 
+    @operation
     def configure_rx_unfiltered(self):
         """Configure the RX filters to the unfiltered setting"""
         self.configure_rx_filters(1)
 
+    @operation
     def configure_receive(self):
         """
         Disable the PAs. If control_rxtx set, turn off TX and enable RX.
@@ -210,7 +252,9 @@ class cardf:
         if self.rx:
             for gpio in self.rx:
                 gpio.set_values([1])
+        self.state["transmit"] = 0
 
+    @operation
     def configure_transmit(self):
         """
         Disable the LNAs. If control_rxtx set, turn off RX and enable TX.
@@ -223,7 +267,9 @@ class cardf:
         if self.tx:
             for gpio in self.tx:
                 gpio.set_values([1])
+        self.state["transmit"] = 1
 
+    @operation
     def enable_pa(self):
         """
         Enable the PAs. Disable the LNAs
@@ -235,7 +281,9 @@ class cardf:
         for gpio in self.tx_enable:
             gpio.set_values([1])
         self.tx_inhib.set_values([0])
+        self.state["pa_enabled"] = 1
 
+    @operation
     def disable_pa(self):
         """
         Disable the PAs.
@@ -246,7 +294,9 @@ class cardf:
             gpio.set_values([0])
         for gpio in self.pa_enable:
             gpio.set_values([0])
+        self.state["pa_enabled"] = 0
 
+    @operation
     def configure_tx_filters(self, freq, tx_path=-1):
         """
         Configure the TX filters for the requested frequency
@@ -265,16 +315,19 @@ class cardf:
 
         for k, v in freqs.items():
             if freq <= k:
-                if rx_path == -1 or rx_path == 0:
+                if tx_path == -1 or tx_path == 0:
                     self.log.info("Configuring TX filters for {} on TX 0".format(k))
                     for gpio, val in zip(self.tx_filt[0], v):
                         gpio.set_values([val])
-                if rx_path == -1 or rx_path == 1:
+                    self.state["tx_filter0"] = k
+                if tx_path == -1 or tx_path == 1:
                     self.log.info("Configuring TX filters for {} on TX 1".format(k))
                     for gpio, val in zip(self.tx_filt[1], v):
                         gpio.set_values([val])
+                    self.state["tx_filter1"] = k
                 return
 
+    @operation
     def configure_tx_unfiltered(self, tx_path=-1):
         """
         Configure the TX filters to the unfiltered setting
@@ -0,0 +1,276 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import logging
+import threading
+import contextlib
+import contextvars
+from .locks import *
+from .backend import *
+from .constants import *
+
+def slot_lines(pc_slot, lines):
+    """
+    Returns the expander offsets of lines of a personality card slot
+
+    Args:
+        pc_slot (int): Personality card slot number
+
+        lines (list[int]): Lines relative to the slot, such as a card's
+                           EXPANDER_LINES
+
+    Returns:
+        list[int]: The expander offsets
+    """
+    return [6*pc_slot + i for i in lines]
+
+_expander_lock = threading.Lock()
+_expander = None
+
+class carp_expander:
+    """
+    A chassis-level manager for the CARP I2C GPIO expander. It owns the
+    slot control lines claimed by the populated cards as a single request
+    and keeps a shadow of their values, so updates from any slot are
+    applied as one whole-port write. Lines no card has claimed, such as
+    those of empty slots or the lines a card type does not use, are never
+    requested or driven. Inside batch() the write is deferred until the
+    outermost batch exits, so several lines, operations or slots cost a
+    single I2C transaction.
+
+    Cards use it like a gpiod chip:
+
+        lines = get_carp_expander().get_lines([6*pc_slot+1])
+        lines.request(consumer='MY_CARD', type=LINE_REQ_DIR_OUT)
+        lines.set_values([1])
+    """
+
+    def __init__(self, gpiochip_num=CARP_GPIO_CHIP):
+        """
+        Open the expander. Lines are requested as cards claim them. Use
+        get_carp_expander() rather than creating instances directly so the
+        lines are shared.
+
+        Args:
+            gpiochip_num (int): Number of the expander's gpiochip
+                                (Default: CARP_GPIO_CHIP)
+        """
+        self.log = logging.getLogger("carp_expander")
+        self.lock = resource_lock("gpiochip", gpiochip_num)
+        #Batch nesting depth of the calling thread or step context (see aio)
+        self.depth = contextvars.ContextVar("carp_expander_batch_depth", default=0)
+        self.offsets = []
+        self.index = {}
+        self.values = []
+        self.dirty = False
+        self.updates = 0
+        self.writes = 0
+
+        self.gpiochip = open_chip(gpiochip_num)
+        self.lines = None
+
+    def claim(self, offsets, default_vals=None):
+        """
+        Add lines to the expander's request. A gpiod request cannot be
+        extended, so the request is released and replaced by one covering
+        every claimed line, with the shadowed values as the initial values.
+        The lines already claimed stop being driven in between, so claim
+        every line before the cards start operating: chassis claims the
+        lines of all of its cards at once, and each card claims all of its
+        lines (EXPANDER_LINES) in one call when it is created. If the new
+        request fails, the previous one is restored.
+
+        Args:
+            offsets (list[int]): Expander lines to claim
+
+            default_vals (list[int]): Initial values of the new lines
+                                      (Default: all 0)
+        """
+        if default_vals is None:
+            default_vals = [0]*len(offsets)
+        with self.lock:
+            new = [(o, v) for o, v in zip(offsets, default_vals) if o not in self.index]
+            if not new:
+                return
+            new_offsets = self.offsets + [o for o, _ in new]
+            new_values = self.values + [v for _, v in new]
+            if self.lines is not None:
+                self.lines.release()
+            try:
+                lines = self.gpiochip.get_lines(new_offsets)
+                lines.request(consumer='CARP_EXPANDER', type=LINE_REQ_DIR_OUT,
+                              default_vals=new_values)
+            except Exception:
+                if self.lines is not None:
+                    self.lines = self.gpiochip.get_lines(self.offsets)
+                    self.lines.request(consumer='CARP_EXPANDER', type=LINE_REQ_DIR_OUT,
+                                       default_vals=self.values)
+                raise
+            self.lines = lines
+            self.offsets = new_offsets
+            self.values = new_values
+            self.index = {o: i for i, o in enumerate(new_offsets)}
+            self.log.debug("Claimed expander lines {}".format(self.offsets))
+
+    def get_lines(self, offsets):
+        """
+        Returns an object like gpiod would for consistent looking code
+
+        Args:
+            offsets (list[int]): Expander lines to control
+
+        Returns:
+            expander_lines: Handle to the requested lines
+        """
+        return expander_lines(self, offsets)
+
+    def write(self, offsets, values):
+        """
+        Update lines in the shadow and write the port unless the calling
+        thread is inside a batch
+
+        Args:
+            offsets (list[int]): Expander lines to set
+
+            values (list[int]): Values to set the lines to
+        """
+        with self.lock:
+            for o, v in zip(offsets, values):
+                self.values[self.index[o]] = v
+            self.updates += 1
+            self.dirty = True
+            if not self.depth.get():
+                self.flush()
+
+    def read(self, offsets):
+        """
+        Returns:
+            list[int]: Shadowed values of the requested lines
+        """
+        with self.lock:
+            return [self.values[self.index[o]] for o in offsets]
+
+    def flush(self):
+        """Write the shadow to the expander if it has pending changes"""
+        with self.lock:
+            if self.dirty and self.lines is not None:
+                self.lines.set_values(self.values)
+                self.dirty = False
+                self.writes += 1
+
+    def ordered(self, chip):
+        """
+        Wrap a chip (or the line mux) whose writes must stay in program
+        order with this expander's: a write to its lines first flushes
+        the expander writes deferred by a batch, so that e.g. a PA enable
+        is never driven before the PA level set just before it
+
+        Args:
+            chip (object): The chip, with a gpiod-like get_lines()
+
+        Returns:
+            ordered_chip: The wrapped chip
+        """
+        return ordered_chip(chip, self)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Defer the writes of the calling thread until the outermost batch
+        exits, then write every pending change at once. The depth is a
+        context variable, so an operation whose steps are driven in their
+        own context (see aio) keeps its batch across its waits without
+        deferring the writes of other work on the same thread.
+        """
+        token = self.depth.set(self.depth.get() + 1)
+        try:
+            yield self
+        finally:
+            self.depth.reset(token)
+            if not self.depth.get():
+                self.flush()
+
+class expander_lines:
+    """
+    A class to control expander lines like gpiod lines. The lines are
+    normally claimed in the carp_expander's shared request before the
+    handle is requested.
+    """
+
+    def __init__(self, expander, offsets):
+        self.parent = expander
+        self.offsets = list(offsets)
+
+    def request(self, consumer=None, type=None, default_vals=None):
+        """
+        Claim the lines in the carp_expander if they are not claimed yet.
+        The lines are always outputs.
+
+        Args:
+            consumer (str): Ignored, the request is owned by the expander
+
+            type (int): Ignored, the lines are outputs
+
+            default_vals (list[int]): Initial values (Default: all 0)
+        """
+        self.parent.claim(self.offsets, default_vals)
+        if default_vals is not None:
+            self.set_values(default_vals)
+
+    def set_values(self, values):
+        """
+        Set the lines to the requested values
+
+        Args:
+            values (list[int]): Desired values of the lines
+        """
+        self.parent.write(self.offsets, values)
+
+    def get_values(self):
+        """
+        Returns:
+            list[int]: Current values of the lines
+        """
+        return self.parent.read(self.offsets)
+
+class ordered_chip:
+    """A chip whose line writes first flush the carp_expander (see ordered)"""
+
+    def __init__(self, chip, expander):
+        self.chip = chip
+        self.expander = expander
+
+    def get_lines(self, offsets):
+        return ordered_lines(self.chip.get_lines(offsets), self.expander)
+
+    def __getattr__(self, name):
+        return getattr(self.chip, name)
+
+class ordered_lines:
+    """Lines of an ordered_chip"""
+
+    def __init__(self, lines, expander):
+        self.lines = lines
+        self.expander = expander
+
+    def set_values(self, values):
+        self.expander.flush()
+        self.lines.set_values(values)
+
+    def __getattr__(self, name):
+        return getattr(self.lines, name)
+
+def get_carp_expander():
+    """
+    Returns the process-wide carp_expander, opening the expander on first
+    use
+
+    Returns:
+        carp_expander: The shared expander manager
+    """
+    global _expander
+    with _expander_lock:
+        if _expander is None:
+            _expander = carp_expander()
+        return _expander
@@ -0,0 +1,150 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Bring-up of every card in a chassis
+
+The resources shared between cards (the CARP expander, the FPGA line
+mux and the transceiver GPO control) are set up once first. The cards
+are then initialized in parallel, one thread per independent bus: cards
+whose control lines sit behind the same gpiochip, or Argons on the same
+I2C bus, are initialized one after another in the same thread. Shared
+resources are still protected by their own locks (see locks).
+
+**Expected usage:**
+
+    chassis = pc_card_control.chassis(pc_card_control.load_config("cards.json"))
+    cards = chassis.bring_up()
+    print(chassis.report())
+"""
+
+import time
+import inspect
+import logging
+import threading
+import collections
+import concurrent.futures
+from .config import *
+from .gpio_line_mux import *
+from .iio_gpo_control import *
+from .carp_expander import *
+
+def card_arguments(spec):
+    """
+    Returns the constructor arguments of a configuration entry by name
+
+    Args:
+        spec (dict): Configuration entry for the card
+
+    Returns:
+        dict: The bound constructor arguments, including defaults
+    """
+    kwargs = {k: v for k, v in spec.items() if k not in ("type", "args")}
+    bound = inspect.signature(CARD_TYPES[spec["type"]]).bind(*spec.get("args", []), **kwargs)
+    bound.apply_defaults()
+    return bound.arguments
+
+def bus_group(spec):
+    """
+    Returns the bus a card is initialized on. Cards in the same group
+    are not initialized in parallel.
+
+    Args:
+        spec (dict): Configuration entry for the card
+
+    Returns:
+        tuple: ("i2c", bus) for Argons, ("gpiochip", number) otherwise
+    """
+    args = card_arguments(spec)
+    if "i2cbus" in args:
+        return ("i2c", args["i2cbus"])
+    return ("gpiochip", args["gpiochip_num"])
+
+class chassis:
+    """Brings up the cards of a chassis in parallel"""
+
+    def __init__(self, layout, parallel=True):
+        """
+        Create a chassis instance
+
+        Args:
+            layout (dict): Card configuration as returned by load_config
+
+            parallel (bool): Initialize independent buses in parallel
+                             (Default: True)
+        """
+        self.log = logging.getLogger("chassis")
+        self.layout = layout
+        self.parallel = parallel
+        self.cards = {}
+        self.init_times = {}
+        self.shared_time = None
+        self.total_time = None
+
+    def setup_shared(self):
+        """Set up the resources shared between the cards of the layout"""
+        specs = [(spec["type"], card_arguments(spec)) for spec in self.layout.values()]
+        carp = [(t, args) for t, args in specs if args.get("carp")]
+        if carp:
+            #Claim the expander lines of every card in one request before
+            #any card drives them
+            get_carp_expander().claim([o for t, args in carp
+                                       for o in slot_lines(args["pc_slot"], CARD_TYPES[t].EXPANDER_LINES)])
+            mux = [args for t, args in carp if t != "selenium"]
+            if mux:
+                get_line_mux(**(mux[0]["mux_options"] or {}))
+        gpo = [args for t, args in specs if t not in ("selenium", "cardf") and not args.get("carp")]
+        if gpo:
+            get_gpo_control(reg_backend=gpo[0]["gpo_backend"], debugfs_path=gpo[0]["debugfs_path"])
+
+    def bring_up_group(self, names):
+        """Initialize the cards of one group in order"""
+        for name in names:
+            start = time.perf_counter()
+            self.cards[name] = create_card(self.layout[name])
+            self.init_times[name] = time.perf_counter() - start
+            self.log.info("{} ready in {:.3f}ms".format(name, self.init_times[name]*1000))
+
+    def bring_up(self):
+        """
+        Set up the shared resources and initialize every card
+
+        Returns:
+            dict: Card instances keyed by card name
+        """
+        start = time.perf_counter()
+        self.setup_shared()
+        self.shared_time = time.perf_counter() - start
+
+        groups = collections.defaultdict(list)
+        for name, spec in self.layout.items():
+            groups[bus_group(spec)].append(name)
+
+        if self.parallel and len(groups) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(groups),
+                                                       thread_name_prefix="chassis") as pool:
+                for future in [pool.submit(self.bring_up_group, names) for names in groups.values()]:
+                    future.result()
+        else:
+            for names in groups.values():
+                self.bring_up_group(names)
+
+        self.total_time = time.perf_counter() - start
+        self.log.info("Chassis ready in {:.3f}ms".format(self.total_time*1000))
+        return {name: self.cards[name] for name in self.layout}
+
+    def report(self):
+        """
+        Returns:
+            str: The initialization time of the shared resources, of each
+                 card and of the whole chassis
+        """
+        lines = ["shared resources: {:.3f}ms".format(self.shared_time*1000)]
+        for name in self.layout:
+            lines.append("{}: {:.3f}ms".format(name, self.init_times[name]*1000))
+        lines.append("total: {:.3f}ms".format(self.total_time*1000))
+        return "\n".join(lines)
+
+    def __getitem__(self, name):
+        return self.cards[name]
@@ -0,0 +1,159 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import socket
+import itertools
+import threading
+import contextlib
+from .daemon import DEFAULT_SOCKET, encode, read_frame
+
+class daemon_error(Exception):
+    """Raised when a command fails inside the daemon"""
+
+class pending_reply:
+    """The not yet received reply of a pipelined frame"""
+
+    def __init__(self, client, count):
+        self.client = client
+        self.count = count
+        self.replies = None
+
+    def result(self):
+        """
+        Wait for the reply of the frame
+
+        Returns:
+            list: The results of the commands in the frame
+
+        Raises:
+            daemon_error: If any command in the frame failed
+        """
+        if self.replies is None:
+            self.client._receive_until(self)
+        errors = [r[2] for r in self.replies if not r[1]]
+        if errors:
+            raise daemon_error("; ".join(errors))
+        return [r[2] for r in self.replies]
+
+class daemon_client:
+    """
+    A client for the card daemon
+
+    **Expected usage:**
+
+        client = pc_card_control.daemon_client()
+        argon0 = client.card("argon0")
+        offset = argon0.configure_synth(12e9)
+        with client.batch():
+            argon0.configure_transmit()
+            client.card("bismuth1").enable_pa()
+    """
+
+    def __init__(self, socket_path=DEFAULT_SOCKET):
+        """
+        Connect to the daemon
+
+        Args:
+            socket_path (str): Path of the daemon's socket
+                               (Default: DEFAULT_SOCKET)
+        """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.rfile = self.sock.makefile("rb")
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.outstanding = []
+        self.batched = None
+
+    def close(self):
+        """Close the connection to the daemon"""
+        self.rfile.close()
+        self.sock.close()
+
+    def send(self, commands):
+        """
+        Send a frame of commands without waiting for the reply
+
+        Args:
+            commands (list[tuple]): (card, method, args, kwargs) tuples
+
+        Returns:
+            pending_reply: Handle to the reply of the frame
+        """
+        frame = [[next(self.ids), card, method, list(args), kwargs]
+                 for card, method, args, kwargs in commands]
+        reply = pending_reply(self, len(frame))
+        with self.lock:
+            self.sock.sendall(encode(frame))
+            self.outstanding.append(reply)
+        return reply
+
+    def _receive_until(self, reply):
+        with self.lock:
+            while reply.replies is None:
+                replies, _ = read_frame(self.rfile)
+                if replies is None:
+                    raise ConnectionError("Daemon closed the connection")
+                self.outstanding.pop(0).replies = replies
+
+    def call(self, card, method, *args, **kwargs):
+        """
+        Execute a method of a card in the daemon. Inside a batch() block
+        the command is queued and None is returned.
+
+        Args:
+            card (str): Name of the card
+
+            method (str): Name of the method
+
+        Returns:
+            The return value of the method
+        """
+        if self.batched is not None:
+            self.batched.append((card, method, args, kwargs))
+            return None
+        return self.send([(card, method, args, kwargs)]).result()[0]
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Queue every call made inside the block and send them as a single
+        frame when the block exits
+        """
+        self.batched = []
+        try:
+            yield
+            commands = self.batched
+        finally:
+            self.batched = None
+        if commands:
+            self.send(commands).result()
+
+    def cards(self):
+        """
+        Returns:
+            dict: Card type names keyed by card name
+        """
+        return self.call(None, "cards")
+
+    def card(self, name):
+        """
+        Returns:
+            remote_card: A proxy exposing the API of the named card
+        """
+        return remote_card(self, name)
+
+class remote_card:
+    """A proxy mirroring the methods of a card owned by the daemon"""
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, method):
+        if method.startswith("_"):
+            raise AttributeError(method)
+        def call(*args, **kwargs):
+            return self._client.call(self._name, method, *args, **kwargs)
+        return call
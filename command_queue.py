@@ -0,0 +1,194 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import inspect
+import logging
+import threading
+
+COALESCED = {"configure_lpf":           (["lpf"], "rx_path"),
+             "configure_hpf":           (["hpf"], "rx_path"),
+             "configure_filters":       (["lpf", "hpf"], "rx_path"),
+             "configure_unfiltered":    (["lpf", "hpf"], "rx_path"),
+             "configure_dual_filters":  (["lpf", "hpf"], -1),
+             "configure_rx_lpf":        (["rx_lpf"], None),
+             "configure_rx_hpf":        (["rx_hpf"], None),
+             "configure_rx_filters":    (["rx_lpf", "rx_hpf"], None),
+             "configure_rx_unfiltered": (["rx_lpf", "rx_hpf"], None),
+             "configure_tx_filters":    (["tx_filt"], "tx_path"),
+             "configure_tx_unfiltered": (["tx_filt"], "tx_path"),
+             "configure_pa":            (["pa_level"], None),
+             "configure_rx_att":        (["rx_att"], None),
+             "configure_synth":         (["synth"], None)}
+"""
+dict: Methods that may be merged, mapped to the logical resources they
+      set and the name of their path argument (None if there is none,
+      -1 if the method always sets both paths). Every other method is
+      safety-critical and bypasses the merge.
+"""
+
+class queued_command:
+    """A card method call waiting in a command_queue"""
+
+    def __init__(self, method, args, kwargs, resources):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.resources = resources
+        self.result = None
+        self.error = None
+        self.superseded = False
+        self.done = threading.Event()
+
+class command_queue:
+    """
+    A queue in front of a card that merges pending commands per logical
+    resource so that only the final state is written to the hardware
+
+    **Expected usage:**
+
+        queue = pc_card_control.command_queue(my_selenium, interval=0.001)
+        queue.configure_filters(1e9)
+        queue.configure_unfiltered()
+        queue.flush()
+    """
+
+    def __init__(self, card, interval=None):
+        """
+        Create a command_queue instance
+
+        Args:
+            card (object): The card instance to operate on
+
+            interval (float): If set, pending commands are flushed
+                              automatically this many seconds after the
+                              first of them was queued (Default: None)
+        """
+        self.log = logging.getLogger("command_queue")
+        self.card = card
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        self.timer = None
+        self.submitted = 0
+        self.executed = 0
+        self.merged = 0
+
+    def resources(self, method, args, kwargs):
+        """
+        Compute the logical resources a call sets
+
+        Args:
+            method (str): Name of the card method
+
+            args (tuple): Positional arguments of the call
+
+            kwargs (dict): Keyword arguments of the call
+
+        Returns:
+            frozenset: (resource, path) pairs, or None for a command that
+                       must not be merged
+        """
+        if method not in COALESCED:
+            return None
+        names, path_arg = COALESCED[method]
+        bound = inspect.signature(getattr(self.card, method)).bind(*args, **kwargs)
+        bound.apply_defaults()
+        if method == "configure_synth" and bound.arguments.get("autofilter"):
+            names = names + ["tx_filt"]
+        path = path_arg if path_arg == -1 else bound.arguments.get(path_arg, None)
+        paths = [0, 1] if path == -1 else [path]
+        return frozenset((n, p) for n in names for p in paths)
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Queue a card method call. If the most recent pending command
+        touching any of the same resources only sets resources this call
+        sets again, it is dropped and this call takes its place in the
+        queue, so commands queued after it (which may depend on it, such
+        as Argon's TX filters on the synthesizer band) still run after
+        it. Otherwise the call is queued at the end. A safety-critical
+        command flushes the queue and runs immediately, raising its
+        error if it fails.
+
+        Args:
+            method (str): Name of the card method
+
+        Returns:
+            queued_command: The queued command. Its result (or error) is
+                            available once its done event is set
+        """
+        resources = self.resources(method, args, kwargs)
+        cmd = queued_command(method, args, kwargs, resources)
+        with self.lock:
+            self.submitted += 1
+        if resources is None:
+            self.flush()
+            self.run(cmd)
+            if cmd.error is not None:
+                raise cmd.error
+            return cmd
+
+        with self.lock:
+            for i in reversed(range(len(self.pending))):
+                p = self.pending[i]
+                if p.resources & resources:
+                    if p.resources <= resources:
+                        p.superseded = True
+                        p.done.set()
+                        self.merged += 1
+                        self.pending[i] = cmd
+                    else:
+                        self.pending.append(cmd)
+                    break
+            else:
+                self.pending.append(cmd)
+            if self.interval is not None and self.timer is None:
+                self.timer = threading.Timer(self.interval, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+        return cmd
+
+    def run(self, cmd):
+        """
+        Execute a single command on the card. An exception is stored in
+        the command's error instead of being raised, and its done event
+        is always set.
+        """
+        try:
+            cmd.result = getattr(self.card, cmd.method)(*cmd.args, **cmd.kwargs)
+        except Exception as e:
+            cmd.error = e
+            self.log.warning("{} failed: {}".format(cmd.method, e))
+        finally:
+            with self.lock:
+                self.executed += 1
+            cmd.done.set()
+
+    def flush(self):
+        """
+        Execute every pending command in queue order. A failing command
+        does not stop the others (see run).
+
+        Returns:
+            list[queued_command]: The commands that were executed
+        """
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            for cmd in pending:
+                self.run(cmd)
+            if pending:
+                self.log.debug("Flushed {} commands".format(len(pending)))
+            return pending
+
+    def __getattr__(self, method):
+        if method.startswith("_") or not hasattr(self.card, method):
+            raise AttributeError(method)
+        def submit(*args, **kwargs):
+            return self.submit(method, *args, **kwargs)
+        return submit
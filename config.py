@@ -0,0 +1,66 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import json
+from .selenium import *
+from .tellurium import *
+from .bismuth import *
+from .argon import *
+from .cardf import *
+
+CARD_TYPES = {"selenium":  selenium,
+              "tellurium": tellurium,
+              "bismuth":   bismuth,
+              "argon":     argon,
+              "cardf":     cardf}
+"""dict: Card class for each card type name used in a configuration"""
+
+def load_config(path):
+    """
+    Load a card configuration from a JSON file. The file maps a card name
+    to its type and constructor arguments, for example
+
+        {"argon0":    {"type": "argon", "args": [0, 2, 0, 1, 43]},
+         "selenium1": {"type": "selenium", "pc_slot": 1,
+                       "gpiochip_num": 3, "carp": 1}}
+
+    Any key other than "type" and "args" is passed as a keyword argument.
+    The shared resources are opened with the arguments of the first card
+    that uses them, for example "gpo_backend": "debugfs" for the AD9361
+    GPO control or "mux_options": {"mux_backend": "mmap", ...} for the
+    CARP line mux (see chassis).
+
+    Args:
+        path (str): Path of the JSON configuration file
+
+    Returns:
+        dict: The card configuration
+    """
+    with open(path) as f:
+        return json.load(f)
+
+def create_card(spec):
+    """
+    Instantiate a single card from its configuration entry
+
+    Args:
+        spec (dict): Configuration entry for the card
+
+    Returns:
+        object: The card instance
+    """
+    kwargs = {k: v for k, v in spec.items() if k not in ("type", "args")}
+    return CARD_TYPES[spec["type"]](*spec.get("args", []), **kwargs)
+
+def create_cards(config):
+    """
+    Instantiate every card in a configuration
+
+    Args:
+        config (dict): Card configuration as returned by load_config
+
+    Returns:
+        dict: Card instances keyed by card name
+    """
+    return {name: create_card(spec) for name, spec in config.items()}
@@ -0,0 +1,335 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+An offline latency model of the hardware primitives
+
+The model predicts how long a sequence of hardware primitives (see
+backend.add_listener) takes on target from a few parameters per
+gpiochip, I2C bus or IIO device: the I2C clock rate and per-transaction
+overhead, the SPI clock of the Argon I2C->SPI bridge, the cost of a
+gpiod line write or request and the cost of a libiio register access.
+The parameters can be calibrated from a trace recorded on target (see
+trace), after which any card call captured off-target against the
+simulated backend can be estimated, and estimates can be compared with
+measured traces.
+
+**To estimate a call off-target**
+
+    pc_card_control.set_backend(pc_card_control.sim_backend())
+    my_argon = pc_card_control.argon(0, 3, 0, 1, 0x2B)
+    model = pc_card_control.cost_model.load("node.json")
+    events = pc_card_control.capture(my_argon.configure_synth, 8000000000)
+    print(model.estimate(events)["total_s"])
+
+**To calibrate and compare with a recorded trace**
+
+    python -m pc_card_control.cost_model session.trace --calibrate --save node.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import collections
+from .backend import *
+from .constants import *
+from .i2c_dev import I2C_RDWR_IOCTL_MAX_MSGS
+from .trace import trace_event, read_trace
+
+DEFAULTS = {"gpio_write_s":          5e-6,
+            "gpio_request_s":       30e-6,
+            "i2c_clock_hz":        400000,
+            "i2c_overhead_s":       50e-6,
+            "i2c_restart_s":         5e-6,
+            "spi_bridges":          list(range(0x28, 0x30)),
+            "spi_clock_hz":       1843200,
+            "spi_bridge_latency_s": 10e-6,
+            "iio_reg_s":            60e-6}
+"""
+dict: Parameters used for targets without their own profile
+
+    gpio_write_s: Time of one line write (set_values)
+
+    gpio_request_s: Time of one line request
+
+    i2c_clock_hz: I2C SCL frequency
+
+    i2c_overhead_s: Fixed cost of one I2C transaction (syscall, start
+                    and stop conditions)
+
+    i2c_restart_s: Cost of each additional message of a combined
+                   I2C_RDWR transfer
+
+    spi_bridges: I2C addresses of I2C->SPI bridges (SC18IS602B)
+
+    spi_clock_hz: SPI clock of the bridges
+
+    spi_bridge_latency_s: Time for a bridge to start clocking SPI after
+                          the I2C write
+
+    iio_reg_s: Time of one libiio register read or write
+"""
+
+DEFAULT_PROFILES = {"gpiochip{}".format(CARP_GPIO_CHIP): {"gpio_write_s": 150e-6}}
+"""dict: Default per-target profiles. The CARP expander sits on I2C."""
+
+I2C_BITS_PER_BYTE = 9
+"""Eight data bits and the acknowledge"""
+
+class cost_model:
+    """Predicts the duration of hardware primitives"""
+
+    def __init__(self, profiles=None, defaults=None):
+        """
+        Create a cost_model instance
+
+        Args:
+            profiles (dict): Parameters per target name ("gpiochip2",
+                             "i2c1", "ad9361-phy", ...), overriding the
+                             defaults (Default: DEFAULT_PROFILES)
+
+            defaults (dict): Parameters of targets without a profile
+                             (Default: DEFAULTS)
+        """
+        self.defaults = dict(DEFAULTS, **(defaults or {}))
+        self.profiles = {k: dict(v) for k, v in (DEFAULT_PROFILES if profiles is None else profiles).items()}
+
+    def profile(self, target):
+        """
+        Returns:
+            dict: The parameters in effect for a target
+        """
+        return dict(self.defaults, **self.profiles.get(target, {}))
+
+    def i2c_cost(self, p, address, nbytes):
+        """Time of one I2C message of nbytes after the address byte"""
+        t = (1 + nbytes)*I2C_BITS_PER_BYTE/p["i2c_clock_hz"]
+        if address in p["spi_bridges"] and nbytes > 1:
+            #The function id byte is not clocked out on SPI
+            t += p["spi_bridge_latency_s"] + (nbytes - 1)*8/p["spi_clock_hz"]
+        return t
+
+    def event_cost(self, event):
+        """
+        Estimate the duration of one hardware primitive
+
+        Args:
+            event (trace_event): The primitive
+
+        Returns:
+            float: Estimated duration in seconds
+        """
+        p = self.profile(event.target)
+        op, detail = event.op, event.detail
+        if op in ("line_write", "line_release"):
+            return p["gpio_write_s"]
+        if op == "line_request":
+            return p["gpio_request_s"]
+        if op == "i2c_write":
+            return p["i2c_overhead_s"] + self.i2c_cost(p, detail[0], len(detail[1]))
+        if op == "i2c_read":
+            return p["i2c_overhead_s"] + (1 + detail[1])*I2C_BITS_PER_BYTE/p["i2c_clock_hz"]
+        if op == "i2c_transfer":
+            payloads = detail[1]
+            chunks = -(-len(payloads)//I2C_RDWR_IOCTL_MAX_MSGS)
+            return (chunks*p["i2c_overhead_s"] + (len(payloads) - chunks)*p["i2c_restart_s"] +
+                    sum(self.i2c_cost(p, detail[0], len(m)) for m in payloads))
+        if op in ("iio_reg_read", "iio_reg_write"):
+            return p["iio_reg_s"]
+        raise ValueError("Unknown operation {}".format(op))
+
+    def estimate(self, events, wait_threshold=50e-6):
+        """
+        Estimate the wall time of a sequence of hardware primitives
+
+        Gaps between consecutive events longer than wait_threshold (after
+        removing the recorded duration of the primitive) are counted as
+        deliberate waits, such as the Argon calibration delay, and added
+        to the estimate as they are.
+
+        Args:
+            events (list[trace_event]): The primitives, as captured or
+                                        read from a trace
+
+            wait_threshold (float): Shortest gap counted as a wait, in
+                                    seconds (Default: 50e-6)
+
+        Returns:
+            dict: "total_s", "hardware_s", "wait_s" and "ops" (estimated
+                  seconds per primitive kind)
+        """
+        ops = collections.Counter()
+        wait = 0.0
+        for i, event in enumerate(events):
+            ops[event.op] += self.event_cost(event)
+            if i:
+                prev = events[i-1]
+                gap = (event.start_ns - prev.start_ns - prev.duration_ns)/1e9
+                if gap > wait_threshold:
+                    wait += gap
+        hardware = sum(ops.values())
+        return {"total_s": hardware + wait, "hardware_s": hardware, "wait_s": wait, "ops": dict(ops)}
+
+    def calibrate(self, events):
+        """
+        Fit the per-target parameters to the durations of a trace
+        recorded on target
+
+        Line and IIO costs are the mean recorded durations. For each I2C
+        bus the clock rate and transaction overhead are fitted by least
+        squares to the single message writes and reads; when all of the
+        messages have the same length only the overhead is fitted.
+
+        Args:
+            events (list[trace_event]): The recorded trace
+        """
+        samples = collections.defaultdict(list)
+        for event in events:
+            key = {"line_write": "gpio_write_s", "line_request": "gpio_request_s",
+                   "iio_reg_read": "iio_reg_s", "iio_reg_write": "iio_reg_s"}.get(event.op)
+            if key:
+                samples[(event.target, key)].append(event.duration_ns/1e9)
+            elif event.op in ("i2c_write", "i2c_read"):
+                samples[(event.target, "i2c")].append(event)
+
+        for (target, key), values in samples.items():
+            profile = self.profiles.setdefault(target, {})
+            if key != "i2c":
+                profile[key] = sum(values)/len(values)
+                continue
+            p = self.profile(target)
+            points = []
+            for event in values:
+                if event.op == "i2c_write":
+                    address, nbytes = event.detail[0], len(event.detail[1])
+                    #Remove the SPI part, which does not depend on the I2C clock
+                    spi = self.i2c_cost(p, address, nbytes) - (1 + nbytes)*I2C_BITS_PER_BYTE/p["i2c_clock_hz"]
+                else:
+                    nbytes, spi = event.detail[1], 0.0
+                points.append(((1 + nbytes)*I2C_BITS_PER_BYTE, event.duration_ns/1e9 - spi))
+            n = len(points)
+            mean_bits = sum(b for b, _ in points)/n
+            mean_t = sum(t for _, t in points)/n
+            var = sum((b - mean_bits)**2 for b, _ in points)
+            if var > 0:
+                slope = sum((b - mean_bits)*(t - mean_t) for b, t in points)/var
+                if slope > 0:
+                    profile["i2c_clock_hz"] = 1/slope
+            clock = profile.get("i2c_clock_hz", p["i2c_clock_hz"])
+            profile["i2c_overhead_s"] = max(mean_t - mean_bits/clock, 0.0)
+
+    def compare(self, events):
+        """
+        Compare the estimated and recorded durations of a trace
+
+        Args:
+            events (list[trace_event]): A trace recorded on target
+
+        Returns:
+            list[dict]: One row per (op, target) with "op", "target",
+                        "count", "measured_s" and "estimated_s"
+        """
+        rows = {}
+        for event in events:
+            row = rows.setdefault((event.op, event.target), {"op": event.op, "target": event.target,
+                                                             "count": 0, "measured_s": 0.0, "estimated_s": 0.0})
+            row["count"] += 1
+            row["measured_s"] += event.duration_ns/1e9
+            row["estimated_s"] += self.event_cost(event)
+        return [rows[k] for k in sorted(rows)]
+
+    def save(self, path):
+        """
+        Save the calibrated profiles as JSON
+
+        Args:
+            path (str): Path of the file
+        """
+        with open(path, "w") as f:
+            json.dump({"defaults": self.defaults, "profiles": self.profiles}, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load profiles saved with save()
+
+        Args:
+            path (str): Path of the file
+
+        Returns:
+            cost_model: The model
+        """
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data.get("profiles"), data.get("defaults"))
+
+def capture(fn, *args, **kwargs):
+    """
+    Call a function and capture the hardware primitives it performs, for
+    estimate(). Off-target, run it against the simulated backend.
+
+    Args:
+        fn (function): The function to call, e.g. a card method
+
+    Returns:
+        list[trace_event]: The primitives performed, with start times
+                           relative to the call
+    """
+    events = []
+    origin = time.perf_counter_ns()
+    def listener(op, target, detail, start_ns, duration_ns):
+        events.append(trace_event(op, target, detail, start_ns - origin, duration_ns))
+    add_listener(listener)
+    try:
+        fn(*args, **kwargs)
+    finally:
+        remove_listener(listener)
+    return events
+
+def report(rows, out=sys.stdout):
+    """
+    Print the rows of compare() as a table
+
+    Args:
+        rows (list[dict]): The rows
+
+        out (file): Where to print (Default: sys.stdout)
+    """
+    print("{:<14} {:<12} {:>7} {:>13} {:>13} {:>8}".format(
+        "op", "target", "count", "measured ms", "estimated ms", "error"), file=out)
+    measured = estimated = 0.0
+    for row in rows:
+        measured += row["measured_s"]
+        estimated += row["estimated_s"]
+        error = (row["estimated_s"] - row["measured_s"])/row["measured_s"]*100 if row["measured_s"] else 0.0
+        print("{:<14} {:<12} {:>7} {:>13.3f} {:>13.3f} {:>7.1f}%".format(
+            row["op"], row["target"], row["count"], row["measured_s"]*1000, row["estimated_s"]*1000, error), file=out)
+    error = (estimated - measured)/measured*100 if measured else 0.0
+    print("{:<14} {:<12} {:>7} {:>13.3f} {:>13.3f} {:>7.1f}%".format(
+        "total", "", sum(r["count"] for r in rows), measured*1000, estimated*1000, error), file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pc_card_control.cost_model",
+                                     description="Compare estimated and measured hardware operation times")
+    parser.add_argument("trace", help="Trace recorded on target (see trace)")
+    parser.add_argument("--model", help="Load the model parameters from a JSON file")
+    parser.add_argument("--calibrate", action="store_true", help="Fit the model to the trace before comparing")
+    parser.add_argument("--save", help="Save the model parameters to a JSON file")
+    args = parser.parse_args(argv)
+
+    events = read_trace(args.trace)
+    model = cost_model.load(args.model) if args.model else cost_model()
+    if args.calibrate:
+        model.calibrate(events)
+    report(model.compare(events))
+    estimate = model.estimate(events)
+    print("# estimated wall time {:.3f}ms ({:.3f}ms hardware, {:.3f}ms waits)".format(
+        estimate["total_s"]*1000, estimate["hardware_s"]*1000, estimate["wait_s"]*1000))
+    if args.save:
+        model.save(args.save)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
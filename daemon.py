@@ -0,0 +1,266 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+A daemon that owns every configured card and serves their methods to
+other processes over a Unix domain socket
+
+**To run the daemon**
+
+    python -m pc_card_control.daemon cards.json
+
+Frames are a 5 byte header (payload length and encoding) followed by the
+payload. A request payload is a list of commands, each of the form
+[id, card, method, args, kwargs], so several commands can be batched into
+one frame. The reply to a frame is a list of [id, ok, result] entries in
+the same order. Frames on a connection are answered in order, so a
+client may pipeline several frames before reading the replies.
+
+The payload is encoded with msgpack when it is installed and with JSON
+otherwise. The daemon replies in the encoding of the request. A frame the
+daemon cannot decode, such as msgpack sent to a daemon without msgpack,
+is answered with a JSON error frame: a single [null, false, message]
+entry. A result that cannot be encoded is replaced by an error entry.
+
+Only the methods that configure a card or query its configuration are
+served (see SERVED_PREFIXES and SERVED_METHODS); raw bus access such as
+argon.send_spi is not. A frame whose payload is longer than MAX_FRAME is
+answered with a JSON error frame and the connection is closed.
+"""
+
+import os
+import json
+import struct
+import logging
+import argparse
+import socketserver
+from .config import *
+from .chassis import chassis
+from .state_shm import enable_state_publication, DEFAULT_STATE_PATH
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+DEFAULT_SOCKET = "/run/pc_card_control.sock"
+"""Default path of the daemon's Unix domain socket"""
+
+HEADER = struct.Struct(">IB")
+"""Frame header: payload length and payload encoding"""
+
+ENC_JSON    = 0
+ENC_MSGPACK = 1
+
+MAX_FRAME = 1 << 20
+"""Largest payload accepted by the daemon in bytes"""
+
+SERVED_PREFIXES = ("configure_", "enable_", "disable_")
+"""Name prefixes of the card methods served by the daemon"""
+
+SERVED_METHODS = {"reset", "reset_synth", "wait_for_lock", "read_lock_detect", "synth_band",
+                  "tuned_frequency", "rx_filter_band", "filter_band", "lpf_bits", "hpf_bits"}
+"""Other card methods served by the daemon: resets and read-only queries"""
+
+class frame_too_large(ValueError):
+    """
+    The length in a frame header exceeds the limit. The payload has not
+    been read, so the stream cannot be resynchronized.
+    """
+
+def encode(obj, encoding=None):
+    """
+    Encode an object as a frame
+
+    Args:
+        obj: Object to encode
+
+        encoding (int): ENC_JSON or ENC_MSGPACK. Defaults to msgpack when
+                        it is installed
+
+    Returns:
+        bytes: The encoded frame including its header
+    """
+    if encoding is None:
+        encoding = ENC_MSGPACK if msgpack else ENC_JSON
+    if encoding == ENC_MSGPACK:
+        payload = msgpack.packb(obj)
+    else:
+        payload = json.dumps(obj, separators=(",", ":")).encode()
+    return HEADER.pack(len(payload), encoding) + payload
+
+def read_frame(f, max_length=None):
+    """
+    Read and decode one frame from a binary file object
+
+    Args:
+        f (file): File object to read from
+
+        max_length (int): Largest payload length accepted, None for
+                          no limit (Default: None)
+
+    Returns:
+        tuple: (decoded object, encoding) or (None, None) at end of file
+
+    Raises:
+        ValueError: If the payload encoding is unsupported or the payload
+                    cannot be decoded. The whole frame has been read, so
+                    the next frame can still be read.
+
+        frame_too_large: If the payload is longer than max_length. The
+                         payload has not been read.
+    """
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None, None
+    length, encoding = HEADER.unpack(header)
+    if max_length is not None and length > max_length:
+        raise frame_too_large("Frame of {} bytes exceeds the limit of {} bytes".format(length, max_length))
+    payload = f.read(length)
+    if len(payload) < length:
+        return None, None
+    if encoding == ENC_MSGPACK and msgpack:
+        try:
+            return msgpack.unpackb(payload), encoding
+        except Exception as e:
+            raise ValueError("Invalid msgpack payload: {}".format(e))
+    if encoding == ENC_JSON:
+        try:
+            return json.loads(payload), encoding
+        except ValueError as e:
+            raise ValueError("Invalid JSON payload: {}".format(e))
+    raise ValueError("Unsupported frame encoding {}".format(encoding))
+
+def served(method):
+    """
+    Args:
+        method (str): Name of a card method
+
+    Returns:
+        bool: Whether the daemon serves the method
+    """
+    return isinstance(method, str) and (method.startswith(SERVED_PREFIXES) or method in SERVED_METHODS)
+
+class card_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    A Unix domain socket server executing commands on a set of cards.
+    Each connection is served from its own thread; the card and resource
+    locks keep concurrent commands consistent.
+    """
+    daemon_threads = True
+
+    def __init__(self, cards, socket_path=DEFAULT_SOCKET):
+        """
+        Create a card_server instance
+
+        Args:
+            cards (dict): Card instances keyed by card name
+
+            socket_path (str): Path of the socket to listen on
+                               (Default: DEFAULT_SOCKET)
+        """
+        self.log = logging.getLogger("pc_card_daemon")
+        self.cards = cards
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, card_handler)
+        os.chmod(socket_path, 0o660)
+
+    def execute(self, command):
+        """
+        Execute a single command
+
+        Args:
+            command (list): [id, card, method, args, kwargs]
+
+        Returns:
+            list: [id, ok, result]. On failure, result is the error message
+        """
+        cmd_id = command[0] if isinstance(command, list) and command else None
+        card = method = None
+        try:
+            cmd_id, card, method, args, kwargs = command
+            if card is None and method == "cards":
+                result = {k: type(v).__name__ for k, v in self.cards.items()}
+            else:
+                if not served(method):
+                    raise AttributeError("{} is not served by the daemon".format(method))
+                result = getattr(self.cards[card], method)(*args, **kwargs)
+            return [cmd_id, True, result]
+        except Exception as e:
+            self.log.warning("{}.{} failed: {}".format(card, method, e))
+            return [cmd_id, False, "{}: {}".format(type(e).__name__, e)]
+
+class card_handler(socketserver.StreamRequestHandler):
+    """Serves the frames of a single client connection"""
+
+    def handle(self):
+        while True:
+            try:
+                commands, encoding = read_frame(self.rfile, MAX_FRAME)
+            except frame_too_large as e:
+                self.server.log.warning("Rejected frame: {}".format(e))
+                self.reply([[None, False, "ValueError: {}".format(e)]], ENC_JSON)
+                return
+            except ValueError as e:
+                self.server.log.warning("Rejected frame: {}".format(e))
+                self.reply([[None, False, "ValueError: {}".format(e)]], ENC_JSON)
+                continue
+            if commands is None:
+                return
+            if not isinstance(commands, list):
+                self.reply([[None, False, "ValueError: A frame must be a list of commands"]], encoding)
+                continue
+            self.reply([self.server.execute(c) for c in commands], encoding)
+
+    def reply(self, replies, encoding):
+        """
+        Send the replies of a frame. A result that cannot be encoded is
+        replaced by an error entry so the client still gets its reply.
+
+        Args:
+            replies (list): [id, ok, result] entries
+
+            encoding (int): Encoding of the request
+        """
+        try:
+            frame = encode(replies, encoding)
+        except Exception:
+            frame = encode([self.encodable(r, encoding) for r in replies], encoding)
+        self.wfile.write(frame)
+        self.wfile.flush()
+
+    def encodable(self, reply, encoding):
+        """
+        Returns:
+            list: The reply, or an error entry if it cannot be encoded
+        """
+        try:
+            encode(reply, encoding)
+            return reply
+        except Exception as e:
+            self.server.log.warning("Reply to command {} cannot be encoded: {}".format(reply[0], e))
+            return [reply[0], False, "{}: The result cannot be encoded: {}".format(type(e).__name__, e)]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve personality card control over a Unix socket")
+    parser.add_argument("config", help="JSON card configuration")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Socket path (Default: {})".format(DEFAULT_SOCKET))
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--publish-state", nargs="?", const=DEFAULT_STATE_PATH, metavar="PATH",
+                        help="Publish card state in shared memory (Default path: {})".format(DEFAULT_STATE_PATH))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+    if args.publish_state:
+        enable_state_publication(args.publish_state)
+    server = card_server(chassis(load_config(args.config)).bring_up(), args.socket)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+if __name__ == "__main__":
+    main()
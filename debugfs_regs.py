@@ -0,0 +1,130 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Register access through a persistently open debugfs direct_reg_access
+file
+
+libiio opens, writes and closes the IIO debugfs direct_reg_access file
+for every register access. debugfs_regs keeps it open and accesses it
+with pwrite/preadv at offset 0, using cached command strings and a
+preallocated read buffer. It has the reg_read/reg_write interface of an
+IIO device, so iio_gpo_control can use it in place of libiio
+(iio_gpo_control(reg_backend="debugfs")).
+
+The file protocol is the IIO core's: writing "ADDR" selects the register
+read back by the next read, and writing "ADDR VAL" writes the register.
+"""
+
+import os
+
+IIO_SYSFS = "/sys/bus/iio/devices"
+IIO_DEBUGFS = "/sys/kernel/debug/iio"
+
+def debugfs_reg_path(dev_device, sysfs=IIO_SYSFS, debugfs=IIO_DEBUGFS):
+    """
+    Find the direct_reg_access file of an IIO device by name
+
+    Args:
+        dev_device (str): Name of the IIO device, e.g. "ad9361-phy"
+
+        sysfs (str): IIO devices directory in sysfs (Default: IIO_SYSFS)
+
+        debugfs (str): IIO directory in debugfs (Default: IIO_DEBUGFS)
+
+    Returns:
+        str: Path of the device's direct_reg_access file
+    """
+    for entry in sorted(os.listdir(sysfs)):
+        try:
+            with open(os.path.join(sysfs, entry, "name")) as f:
+                name = f.read().strip()
+        except OSError:
+            continue
+        if name == dev_device:
+            return os.path.join(debugfs, entry, "direct_reg_access")
+    raise FileNotFoundError("No IIO device named {}".format(dev_device))
+
+class debugfs_regs:
+    """Register access through an open direct_reg_access file"""
+
+    def __init__(self, path, fd=None):
+        """
+        Open a direct_reg_access file
+
+        Args:
+            path (str): Path of the file (see debugfs_reg_path). Any file
+                        can be used, e.g. a temporary file for testing
+
+            fd (int): An already open file descriptor to use instead of
+                      opening path (Default: None)
+        """
+        self.path = path
+        self.fd = fd if fd is not None else os.open(path, os.O_RDWR)
+        self.buf = bytearray(32)
+        self.commands = {}
+
+    def close(self):
+        """Close the file descriptor"""
+        os.close(self.fd)
+
+    def select(self, reg):
+        """Select the register read back by read_selected()"""
+        cmd = self.commands.get(reg)
+        if cmd is None:
+            cmd = b"0x%x" % reg
+            self.commands[reg] = cmd
+        os.pwrite(self.fd, cmd, 0)
+
+    def read_selected(self):
+        """
+        Returns:
+            int: Value of the selected register
+        """
+        n = os.preadv(self.fd, [self.buf], 0)
+        return int(bytes(self.buf[:n]).split()[0], 0)
+
+    def reg_read(self, reg):
+        """
+        Read a register
+
+        Args:
+            reg (int): Register number
+
+        Returns:
+            int: Register value
+        """
+        self.select(reg)
+        return self.read_selected()
+
+    def reg_write(self, reg, val):
+        """
+        Write a register
+
+        Args:
+            reg (int): Register number
+
+            val (int): Value to write
+        """
+        os.pwrite(self.fd, b"0x%x 0x%x" % (reg, val), 0)
+
+    def transact(self, sequence):
+        """
+        Perform a sequence of register writes and reads in order on the
+        open file
+
+        Args:
+            sequence (list[tuple]): (reg,) to read a register or
+                                    (reg, val) to write one
+
+        Returns:
+            list[int]: The values read, in order
+        """
+        values = []
+        for op in sequence:
+            if len(op) == 1:
+                values.append(self.reg_read(op[0]))
+            else:
+                self.reg_write(*op)
+        return values
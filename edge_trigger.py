@@ -0,0 +1,152 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import time
+import logging
+import threading
+import collections
+from . import metrics
+from .backend import *
+from .card_operation import *
+
+EDGE_METRIC = "pc_card_edge_reaction_seconds"
+"""Histogram of the time from a GPIO edge to the end of its action"""
+
+def write_sequence(calls):
+    """
+    Preload a sequence of card operations into a single callable. The
+    calls are made through the cards' @operation methods, so the card
+    state, settling and published state stay current. Consecutive calls
+    on the same card run as one operation (under its lock and batch), so
+    no other writer can interleave and their expander writes are applied
+    at once.
+
+    Args:
+        calls (list[tuple]): (method, args) pairs of bound card methods
+                             and their arguments, such as
+                             (my_tellurium.configure_pa, [0])
+
+    Returns:
+        function: Performs the calls in order
+    """
+    groups = []
+    for method, args in calls:
+        card = method.__self__
+        if not groups or groups[-1][0] is not card:
+            groups.append((card, []))
+        groups[-1][1].append((method, tuple(args)))
+    def run():
+        for card, group in groups:
+            with operation_context(card, "write_sequence"):
+                for method, args in group:
+                    method(*args)
+    return run
+
+class edge_reactor:
+    """
+    Runs a preloaded action on each edge of an input GPIO, such as a PTT
+    or TDD strobe. A dedicated thread blocks on the line's gpiod events,
+    so the reaction time is bounded by the kernel's wake-up latency
+    rather than a polling interval. The edge-to-action latency of every
+    event is recorded, measured from the kernel's event timestamp
+    (CLOCK_MONOTONIC).
+
+    **Expected usage:**
+
+        ptt = pc_card_control.edge_reactor(1, 120,
+            rising=my_tellurium.enable_pa,
+            falling=pc_card_control.write_sequence(
+                [(my_tellurium.disable_pa, []), (my_tellurium.configure_receive, [])]))
+    """
+
+    def __init__(self, gpiochip_num, line, rising=None, falling=None, consumer="PC_CARD_EDGE",
+                 history=1024, realtime_priority=None):
+        """
+        Request the input line and start the reaction thread
+
+        Args:
+            gpiochip_num (int): Number of the gpiochip of the input line
+
+            line (int): Offset of the input line
+
+            rising (function): Action on a rising edge (Default: None)
+
+            falling (function): Action on a falling edge (Default: None)
+
+            consumer (str): Consumer label of the line request
+                            (Default: "PC_CARD_EDGE")
+
+            history (int): Number of events to keep for statistics
+                           (Default: 1024)
+
+            realtime_priority (int): If set, run the thread with
+                                     SCHED_FIFO at this priority
+                                     (Default: None)
+        """
+        self.log = logging.getLogger("edge_reactor_{}_{}".format(gpiochip_num, line))
+        self.actions = {EVENT_RISING_EDGE: rising,
+                        EVENT_FALLING_EDGE: falling}
+        self.realtime_priority = realtime_priority
+        self.history = collections.deque(maxlen=history)
+        self.labels = (("chip", gpiochip_num), ("line", line))
+
+        if rising and falling:
+            req = LINE_REQ_EV_BOTH_EDGES
+        elif rising:
+            req = LINE_REQ_EV_RISING_EDGE
+        else:
+            req = LINE_REQ_EV_FALLING_EDGE
+        self.gpiochip = open_chip(gpiochip_num)
+        self.line = self.gpiochip.get_lines([line])
+        self.line.request(consumer=consumer, type=req)
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=self.log.name, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        """Reaction thread body"""
+        if self.realtime_priority is not None:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.realtime_priority))
+        line = self.line.to_list()[0]
+        while self.running:
+            if not self.line.event_wait(sec=0, nsec=100000000):
+                continue
+            event = line.event_read()
+            action = self.actions.get(event.type)
+            if action is None:
+                continue
+            edge_ns = event.sec*1000000000 + event.nsec
+            start_ns = time.monotonic_ns()
+            try:
+                action()
+            except Exception as e:
+                self.log.warning("Edge action failed: {}".format(e))
+            done_ns = time.monotonic_ns()
+            self.history.append((event.type, edge_ns, start_ns - edge_ns, done_ns - edge_ns))
+            metrics.observe(EDGE_METRIC, self.labels, (done_ns - edge_ns)/1e9)
+
+    def stats(self):
+        """
+        Summarize the latency of the recent events
+
+        Returns:
+            dict: count plus mean and max edge-to-start and edge-to-done
+                  latency in nanoseconds
+        """
+        events = list(self.history)
+        if not events:
+            return {"count": 0}
+        start = [e[2] for e in events]
+        done = [e[3] for e in events]
+        return {"count": len(events),
+                "mean_start_ns": sum(start)/len(start), "max_start_ns": max(start),
+                "mean_done_ns": sum(done)/len(done), "max_done_ns": max(done)}
+
+    def stop(self):
+        """Stop the reaction thread and release the line"""
+        self.running = False
+        self.thread.join()
+        self.line.release()
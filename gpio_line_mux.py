@@ -2,8 +2,18 @@
 #
 # SPDX-License-Identifier: MIT
 
-import gpiod
+import os
+import mmap
+import uuid
+import fcntl
+import struct
+import logging
+import threading
 from enum import Enum
+from .locks import *
+from . import state_shm
+from .backend import *
+from .mmap_regs import *
 from .constants import *
 
 CLOCK = [78]
@@ -16,6 +26,16 @@ OUTPUT_GPIOS = [83, 82, 81, 80]
 INPUT_GPIOS  = [87, 86, 85, 84]
 BIT_LENGTH = 4
 
+DEFAULT_MUX_STATE = "/run/pc_card_control/mux_routes"
+"""Default path of the persisted mux route table"""
+
+#Boot ID followed by the output connected to each mux input
+MUX_STATE = struct.Struct("<16s10b")
+
+#Output connected to each mux input, shared by every gpio_line_mux since
+#they all drive the same FPGA mux (-1 until known)
+mux_routes = [-1]*10
+
 class CARP_GPO_IN(Enum):
     """
     These are input mappings to "GPIO" line numbers
@@ -77,6 +97,72 @@ def bitfield(n):
     """
     return [1 if digit=='1' else 0 for digit in bin(n)[2:].zfill(BIT_LENGTH)]
 
+def boot_id():
+    """
+    Returns:
+        bytes: The kernel's random boot ID, which changes on every boot
+    """
+    with open("/proc/sys/kernel/random/boot_id") as f:
+        return uuid.UUID(f.read().strip()).bytes
+
+class mux_route_state:
+    """
+    The mux route table persisted in a small file (normally under /run)
+    for the current boot. The file is memory mapped and the routes are
+    stored into it on every route change, so persisting a route costs no
+    system call (which matters with the mmap mux backend).
+
+    The file is locked (flock) for as long as it is open, so only one
+    process can own the mux and trust or rewrite its routes. This also
+    makes the mmap mux backend exclusive, which claims nothing itself.
+    """
+
+    def __init__(self, path=DEFAULT_MUX_STATE):
+        """
+        Open and lock the route table file, creating it if needed
+
+        Args:
+            path (str): Path of the file (Default: DEFAULT_MUX_STATE)
+
+        Raises:
+            BlockingIOError: Another process owns the mux
+        """
+        self.path = path
+        self.boot = boot_id()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self.fd)
+            raise BlockingIOError("The line mux is owned by another process ({} is locked)".format(path))
+        if os.fstat(self.fd).st_size < MUX_STATE.size:
+            os.ftruncate(self.fd, MUX_STATE.size)
+        self.map = mmap.mmap(self.fd, MUX_STATE.size)
+
+    def load(self):
+        """
+        Returns:
+            list[int]: The persisted routes, or None if there are none
+                       for the current boot
+        """
+        boot, *routes = MUX_STATE.unpack_from(self.map, 0)
+        return routes if boot == self.boot else None
+
+    def save(self, routes):
+        """
+        Persist the routes
+
+        Args:
+            routes (list[int]): Output connected to each mux input
+        """
+        MUX_STATE.pack_into(self.map, 0, self.boot, *routes)
+
+    def close(self):
+        """Unmap the file and release its lock"""
+        self.map.close()
+        os.close(self.fd)
+
 class gpio_line_mux:
     """
     A class for controlling the FPGA gpio line mux (designed for CARP)
@@ -85,28 +171,110 @@ class gpio_line_mux:
 
     """
 
-    def __init__(self):
-        """Setup the GPIOs"""
-        self.gpiochip = gpiod.Chip('gpiochip{}'.format(BASE_GPIO_CHIP))
+    def __init__(self, mux_backend="gpiod", mmap_path="/dev/mem", mmap_base=None, layout=DEFAULT_MUX_LAYOUT,
+                 reset=None, state_path=DEFAULT_MUX_STATE):
+        """
+        Setup the GPIOs. The routes persisted for the current boot (see
+        mux_route_state) are trusted, so attaching to an already
+        configured mux costs no mux writes; the mux is only reset when
+        there are none (first use after boot) or when requested.
+
+        Args:
+            mux_backend (str): "gpiod" to drive the mux lines on the base
+                               gpiochip, or "mmap" to write them to a
+                               memory-mapped AXI GPIO data register (see
+                               mmap_regs) (Default: "gpiod")
+
+            mmap_path (str): File to map for the mmap backend, /dev/mem
+                             or /dev/uioN (Default: "/dev/mem")
+
+            mmap_base (int): Address of the registers in mmap_path.
+                             Required with /dev/mem (Default: None, 0
+                             for other files)
+
+            layout (dict): Register layout for the mmap backend
+                           (Default: DEFAULT_MUX_LAYOUT)
+
+            reset (bool): True to always reset the mux, False to never
+                          reset it, None to reset it only if no routes
+                          are persisted for the current boot
+                          (Default: None)
+
+            state_path (str): Path of the persisted route table, or None
+                              to not persist routes. The file is locked
+                              while the mux is open, so attaching from a
+                              second process fails (BlockingIOError).
+                              Routes are never persisted with a
+                              simulated backend
+                              (Default: DEFAULT_MUX_STATE)
+        """
+        self.log = logging.getLogger("gpio_line_mux")
+
+        #The data-then-clock sequence must not interleave between threads
+        self.lock = resource_lock("mux")
+
+        self.state = None
+        if state_path and getattr(get_backend(), "persistent", True):
+            try:
+                self.state = mux_route_state(state_path)
+            except BlockingIOError:
+                raise
+            except OSError as e:
+                self.log.warning("Cannot persist mux routes to {}: {}".format(state_path, e))
+        routes = self.state.load() if self.state else None
+
+        if mux_backend == "mmap":
+            if mmap_base is None and mmap_path == "/dev/mem":
+                raise ValueError("mmap_base is required to map /dev/mem")
+            self.gpiochip = mmap_gpio_bank(open_mmap_regs(mmap_path, mmap_base or 0), layout)
+        else:
+            self.gpiochip = open_chip(BASE_GPIO_CHIP)
 
         self.clock = self.gpiochip.get_lines(CLOCK)
-        self.clock.request(consumer="GPIO_MUX", type=gpiod.LINE_REQ_DIR_OUT)
+        self.clock.request(consumer="GPIO_MUX", type=LINE_REQ_DIR_OUT)
 
+        #Requested high so that attaching does not reset the mux
         self.reset = self.gpiochip.get_lines(RESET)
-        self.reset.request(consumer="GPIO_MUX", type=gpiod.LINE_REQ_DIR_OUT)
+        self.reset.request(consumer="GPIO_MUX", type=LINE_REQ_DIR_OUT, default_vals=H)
 
         self.input_lines = self.gpiochip.get_lines(INPUT_GPIOS)
-        self.input_lines.request(consumer="GPIO_MUX", type=gpiod.LINE_REQ_DIR_OUT)
+        self.input_lines.request(consumer="GPIO_MUX", type=LINE_REQ_DIR_OUT)
 
         self.output_lines = self.gpiochip.get_lines(OUTPUT_GPIOS)
-        self.output_lines.request(consumer="GPIO_MUX", type=gpiod.LINE_REQ_DIR_OUT)
-
-        self.reset_chip()
+        self.output_lines.request(consumer="GPIO_MUX", type=LINE_REQ_DIR_OUT)
+
+        if reset or (reset is None and routes is None):
+            self.reset_chip()
+        else:
+            self.log.debug("Attaching to mux routes {}".format(routes))
+            with self.lock:
+                mux_routes[:] = routes if routes is not None else [-1]*len(mux_routes)
+                self.publish_routes()
+
+    def close(self):
+        """Release the persisted route table, so another instance can own the mux"""
+        if self.state:
+            self.state.close()
+            self.state = None
 
     def reset_chip(self):
         """Resets all values to logic low"""
-        self.reset.set_values(L)
-        self.reset.set_values(H)
+        with self.lock:
+            self.reset.set_values(L)
+            self.reset.set_values(H)
+            mux_routes[:] = [CARP_GPO_OUT.LOW.value]*len(mux_routes)
+            self.routes_changed()
+
+    def routes_changed(self):
+        """Persist mux_routes and publish them"""
+        if self.state:
+            self.state.save(mux_routes)
+        self.publish_routes()
+
+    def publish_routes(self):
+        """Publish mux_routes if state publication is enabled"""
+        if state_shm.publisher is not None:
+            state_shm.publisher.publish_mux(mux_routes)
 
     def pulse(self):
         """
@@ -137,9 +305,10 @@ class gpio_line_mux:
             output_nums (list[int]): Values to set each output line to
         """
 
-        self.input_lines.set_values(input_nums)
-        self.output_lines.set_values(output_nums)
-        self.pulse()
+        with self.lock:
+            self.input_lines.set_values(input_nums)
+            self.output_lines.set_values(output_nums)
+            self.pulse()
 
 class mux_gpio:
     """
@@ -160,6 +329,7 @@ class mux_gpio:
         """
 
         self.parent = gpio_mux
+        self.input_nums = input_nums
         self.input_lines = [bitfield(input_num) for input_num in input_nums]
 
     def set_values(self, output_nums):
@@ -170,5 +340,31 @@ class mux_gpio:
             output_nums (int): The corresponding index of the output you
                                wish to connect the input to
         """
-        for z in zip(self.input_lines, output_nums):
-            self.parent.set_value(z[0], bitfield(z[1]))
+        with self.parent.lock:
+            for z in zip(self.input_lines, output_nums):
+                self.parent.set_value(z[0], bitfield(z[1]))
+            for input_num, output_num in zip(self.input_nums, output_nums):
+                mux_routes[input_num] = output_num
+            self.parent.routes_changed()
+
+_line_mux = None
+_line_mux_lock = threading.Lock()
+
+def get_line_mux(**kwargs):
+    """
+    Returns the process-wide gpio_line_mux, requesting its lines on
+    first use. Cards share it so that creating a card does not reset the
+    routes set up by the cards before it.
+
+    Args:
+        kwargs: gpio_line_mux arguments, used if the mux is created by
+                this call
+
+    Returns:
+        gpio_line_mux: The shared line mux
+    """
+    global _line_mux
+    with _line_mux_lock:
+        if _line_mux is None:
+            _line_mux = gpio_line_mux(**kwargs)
+        return _line_mux
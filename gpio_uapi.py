@@ -0,0 +1,300 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Direct access to the GPIO character device (GPIO_V2 uAPI) through ctypes
+
+uapi_chip opens /dev/gpiochipN and issues the GPIO_V2 line request,
+get values and set values ioctls itself, without the gpiod binding.
+Each set of lines keeps preallocated ioctl structures, so a write costs
+the ioctl and little else. It presents the libgpiod v1 shape used by the
+cards and is selected with hw_backend(gpiod_api="uapi").
+
+**To compare the toggle latency with the gpiod path**
+
+Each binding is timed both on its raw line handles and through the line
+bank and traced chip the cards write through.
+
+    python -m pc_card_control.gpio_uapi 1 78 --count 100000
+"""
+
+import os
+import sys
+import time
+import ctypes
+import select
+import argparse
+import statistics
+from .backend import LINE_REQ_DIR_IN, LINE_REQ_DIR_OUT, LINE_REQ_EV_FALLING_EDGE, \
+    LINE_REQ_EV_RISING_EDGE, LINE_REQ_EV_BOTH_EDGES, EVENT_RISING_EDGE, EVENT_FALLING_EDGE
+
+GPIO_MAX_NAME_SIZE = 32
+GPIO_V2_LINES_MAX = 64
+GPIO_V2_LINE_NUM_ATTRS_MAX = 10
+
+GPIO_V2_LINE_FLAG_INPUT        = 1 << 2
+GPIO_V2_LINE_FLAG_OUTPUT       = 1 << 3
+GPIO_V2_LINE_FLAG_EDGE_RISING  = 1 << 4
+GPIO_V2_LINE_FLAG_EDGE_FALLING = 1 << 5
+
+GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES = 2
+
+GPIO_V2_LINE_EVENT_RISING_EDGE  = 1
+GPIO_V2_LINE_EVENT_FALLING_EDGE = 2
+
+class gpio_v2_line_attribute(ctypes.Structure):
+    """struct gpio_v2_line_attribute from linux/gpio.h (the union as u64)"""
+    _fields_ = [("id",      ctypes.c_uint32),
+                ("padding", ctypes.c_uint32),
+                ("values",  ctypes.c_uint64)]
+
+class gpio_v2_line_config_attribute(ctypes.Structure):
+    """struct gpio_v2_line_config_attribute from linux/gpio.h"""
+    _fields_ = [("attr", gpio_v2_line_attribute),
+                ("mask", ctypes.c_uint64)]
+
+class gpio_v2_line_config(ctypes.Structure):
+    """struct gpio_v2_line_config from linux/gpio.h"""
+    _fields_ = [("flags",     ctypes.c_uint64),
+                ("num_attrs", ctypes.c_uint32),
+                ("padding",   ctypes.c_uint32*5),
+                ("attrs",     gpio_v2_line_config_attribute*GPIO_V2_LINE_NUM_ATTRS_MAX)]
+
+class gpio_v2_line_request(ctypes.Structure):
+    """struct gpio_v2_line_request from linux/gpio.h"""
+    _fields_ = [("offsets",           ctypes.c_uint32*GPIO_V2_LINES_MAX),
+                ("consumer",          ctypes.c_char*GPIO_MAX_NAME_SIZE),
+                ("config",            gpio_v2_line_config),
+                ("num_lines",         ctypes.c_uint32),
+                ("event_buffer_size", ctypes.c_uint32),
+                ("padding",           ctypes.c_uint32*5),
+                ("fd",                ctypes.c_int32)]
+
+class gpio_v2_line_values(ctypes.Structure):
+    """struct gpio_v2_line_values from linux/gpio.h"""
+    _fields_ = [("bits", ctypes.c_uint64),
+                ("mask", ctypes.c_uint64)]
+
+class gpio_v2_line_event(ctypes.Structure):
+    """struct gpio_v2_line_event from linux/gpio.h"""
+    _fields_ = [("timestamp_ns", ctypes.c_uint64),
+                ("id",           ctypes.c_uint32),
+                ("offset",       ctypes.c_uint32),
+                ("seqno",        ctypes.c_uint32),
+                ("line_seqno",   ctypes.c_uint32),
+                ("padding",      ctypes.c_uint32*6)]
+
+def _iowr(type, nr, size):
+    return (3 << 30) | (size << 16) | (type << 8) | nr
+
+GPIO_V2_GET_LINE_IOCTL        = _iowr(0xB4, 0x07, ctypes.sizeof(gpio_v2_line_request))
+GPIO_V2_LINE_GET_VALUES_IOCTL = _iowr(0xB4, 0x0E, ctypes.sizeof(gpio_v2_line_values))
+GPIO_V2_LINE_SET_VALUES_IOCTL = _iowr(0xB4, 0x0F, ctypes.sizeof(gpio_v2_line_values))
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.ioctl.argtypes = [ctypes.c_int, ctypes.c_ulong, ctypes.c_void_p]
+
+def libc_ioctl(fd, request, arg):
+    """
+    Issue an ioctl on a ctypes structure in place, through libc
+
+    Args:
+        fd (int): File descriptor
+
+        request (int): ioctl request
+
+        arg (ctypes.Structure): The argument, updated by the kernel
+    """
+    if _libc.ioctl(fd, request, ctypes.addressof(arg)) < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+class uapi_chip:
+    """A /dev/gpiochipN handle"""
+
+    def __init__(self, num, fd=None, ioctl=libc_ioctl):
+        """
+        Open a gpiochip
+
+        Args:
+            num (int): Number of the gpiochip
+
+            fd (int): An already open file descriptor to use instead of
+                      opening /dev/gpiochipN (Default: None)
+
+            ioctl (function): Function used to issue ioctls, with the
+                              signature of libc_ioctl
+                              (Default: libc_ioctl)
+        """
+        self.num = num
+        self.fd = fd if fd is not None else os.open("/dev/gpiochip{}".format(num), os.O_RDWR | os.O_CLOEXEC)
+        self.ioctl = ioctl
+
+    def name(self):
+        return "gpiochip{}".format(self.num)
+
+    def close(self):
+        """Close the file descriptor"""
+        os.close(self.fd)
+
+    def get_lines(self, offsets):
+        return uapi_lines(self, offsets)
+
+class uapi_event:
+    """A line event in the shape of a libgpiod v1 LineEvent"""
+
+    def __init__(self, type, sec, nsec):
+        self.type = type
+        self.sec = sec
+        self.nsec = nsec
+
+class uapi_lines:
+    """A set of lines of a uapi_chip, used like libgpiod v1 Line/LineBulk"""
+
+    def __init__(self, chip, offsets, fd=None, bits=None):
+        self.chip = chip
+        self.offsets = list(offsets)
+        self.fd = fd
+        self.bits = bits if bits is not None else list(range(len(self.offsets)))
+        #Preallocated set/get values arguments
+        self.values = gpio_v2_line_values()
+        self.values.mask = sum(1 << b for b in self.bits)
+        self.event = gpio_v2_line_event()
+
+    def request(self, consumer=None, type=LINE_REQ_DIR_OUT, default_vals=None):
+        """
+        Request the lines with one GPIO_V2_GET_LINE ioctl. Output lines
+        are requested with their initial values.
+        """
+        req = gpio_v2_line_request()
+        for i, o in enumerate(self.offsets):
+            req.offsets[i] = o
+        req.num_lines = len(self.offsets)
+        req.consumer = (consumer or "").encode()[:GPIO_MAX_NAME_SIZE-1]
+        if type == LINE_REQ_DIR_OUT:
+            req.config.flags = GPIO_V2_LINE_FLAG_OUTPUT
+            if default_vals:
+                req.config.num_attrs = 1
+                attr = req.config.attrs[0]
+                attr.attr.id = GPIO_V2_LINE_ATTR_ID_OUTPUT_VALUES
+                attr.attr.values = sum(1 << i for i, v in enumerate(default_vals) if v)
+                attr.mask = self.values.mask
+        else:
+            flags = GPIO_V2_LINE_FLAG_INPUT
+            if type in (LINE_REQ_EV_RISING_EDGE, LINE_REQ_EV_BOTH_EDGES):
+                flags |= GPIO_V2_LINE_FLAG_EDGE_RISING
+            if type in (LINE_REQ_EV_FALLING_EDGE, LINE_REQ_EV_BOTH_EDGES):
+                flags |= GPIO_V2_LINE_FLAG_EDGE_FALLING
+            req.config.flags = flags
+        self.chip.ioctl(self.chip.fd, GPIO_V2_GET_LINE_IOCTL, req)
+        self.fd = req.fd
+
+    def set_values(self, values):
+        bits = 0
+        for b, v in zip(self.bits, values):
+            if v:
+                bits |= 1 << b
+        self.values.bits = bits
+        self.chip.ioctl(self.fd, GPIO_V2_LINE_SET_VALUES_IOCTL, self.values)
+
+    def get_values(self):
+        self.chip.ioctl(self.fd, GPIO_V2_LINE_GET_VALUES_IOCTL, self.values)
+        return [(self.values.bits >> b) & 1 for b in self.bits]
+
+    def release(self):
+        os.close(self.fd)
+        self.fd = None
+
+    def to_list(self):
+        return [uapi_lines(self.chip, [o], self.fd, [b]) for o, b in zip(self.offsets, self.bits)]
+
+    def event_wait(self, sec=0, nsec=0):
+        poll = select.poll()
+        poll.register(self.fd, select.POLLIN)
+        return bool(poll.poll(sec*1000 + nsec/1000000))
+
+    def event_read(self):
+        os.readv(self.fd, [self.event])
+        ts = self.event.timestamp_ns
+        return uapi_event(EVENT_RISING_EDGE if self.event.id == GPIO_V2_LINE_EVENT_RISING_EDGE
+                          else EVENT_FALLING_EDGE, ts//1000000000, ts%1000000000)
+
+def toggle_latency(lines, count):
+    """
+    Time writes alternating 1 and 0 to a line
+
+    Args:
+        lines: Requested single line, from any backend
+
+        count (int): Number of writes
+
+    Returns:
+        list[int]: Duration of each write in nanoseconds
+    """
+    high, low = [1], [0]
+    samples = []
+    clock = time.perf_counter_ns
+    for i in range(count):
+        start = clock()
+        lines.set_values(high if i & 1 else low)
+        samples.append(clock() - start)
+    return samples
+
+def report(name, samples):
+    """
+    Print the mean, median and 99th percentile of latency samples
+
+    Args:
+        name (str): Label of the samples
+
+        samples (list[int]): Durations in nanoseconds
+    """
+    samples = sorted(samples)
+    print("{:<8} mean {:>8.0f}ns  median {:>8.0f}ns  p99 {:>8.0f}ns".format(
+        name, statistics.fmean(samples), samples[len(samples)//2], samples[len(samples)*99//100]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pc_card_control.gpio_uapi",
+                                     description="Compare line toggle latency of the gpiod binding and the GPIO_V2 uAPI")
+    parser.add_argument("chip", type=int, help="gpiochip number")
+    parser.add_argument("line", type=int, help="Line offset (it is toggled!)")
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    from .backend import hw_backend, set_backend, open_line_bank
+    print("Raw: the binding's own line handles")
+    paths = [("gpiod", lambda: hw_backend().open_chip(args.chip)),
+             ("uapi", lambda: uapi_chip(args.chip))]
+    for name, open_chip in paths:
+        lines = open_chip().get_lines([args.line])
+        lines.request(consumer="PC_CARD_BENCH", type=LINE_REQ_DIR_OUT)
+        report(name, toggle_latency(lines, args.count))
+        lines.release()
+
+    #Cards write through the backend wrappers: the traced chip and the
+    #line bank of their bulk request
+    print("Card path: line bank on the traced chip")
+    for name, api in (("gpiod", "auto"), ("uapi", "uapi")):
+        previous = set_backend(hw_backend(gpiod_api=api))
+        try:
+            bank = open_line_bank(args.chip)
+            lines = bank.get_lines([args.line])
+            lines.request(consumer="PC_CARD_BENCH", type=LINE_REQ_DIR_OUT)
+            bank.request(consumer="PC_CARD_BENCH")
+            report(name, toggle_latency(lines, args.count))
+            bank.release()
+        finally:
+            set_backend(previous)
+
+    #The cost of a syscall that does no work, for reference
+    samples = []
+    for i in range(args.count):
+        start = time.perf_counter_ns()
+        os.getppid()
+        samples.append(time.perf_counter_ns() - start)
+    report("getppid", samples)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Adapter presenting the libgpiod v2 Python API like the v1 API used by
+the cards (Chip.get_lines, request, set_values)
+
+hw_backend uses it when libgpiod v2 is installed (or when selected with
+hw_backend(gpiod_api="v2")).
+
+As with v1, request() issues the kernel request at once, with output
+lines driven to default_vals (or low), so ownership conflicts (EBUSY)
+are raised when a card is created. Cards request all of their lines on a
+chip as one bulk (see backend.line_bank), so this costs one request per
+chip. Requesting lines that are already
+held reconfigures their request in place instead of releasing it.
+
+With hw_backend(lazy_requests=True), output requests are deferred
+instead: request() only records the lines, and the first write to any
+pending line of a chip requests every pending line of that chip at once.
+Lines whose consumer labels share a prefix ("TELLURIUM_LPF",
+"TELLURIUM_HPF", ...) are merged into a single kernel request, labelled
+with the prefix, so a card holds about one request (and one file
+descriptor) per chip instead of one per line. Each line is requested
+with its initial value (default_vals, or the value of the write that
+triggered the request). Conflicts then only show up at the first write,
+and lines that are never written are never claimed.
+"""
+
+import datetime
+import threading
+import collections
+import gpiod
+from gpiod.line import Direction, Edge, Value
+from .backend import LINE_REQ_DIR_IN, LINE_REQ_DIR_OUT, LINE_REQ_EV_FALLING_EDGE, \
+    LINE_REQ_EV_RISING_EDGE, LINE_REQ_EV_BOTH_EDGES, EVENT_RISING_EDGE, EVENT_FALLING_EDGE
+
+EDGES = {LINE_REQ_EV_FALLING_EDGE: Edge.FALLING,
+         LINE_REQ_EV_RISING_EDGE:  Edge.RISING,
+         LINE_REQ_EV_BOTH_EDGES:   Edge.BOTH}
+
+def value(v):
+    return Value.ACTIVE if v else Value.INACTIVE
+
+def consumer_group(consumer):
+    """
+    Returns the label shared by requests that may be merged
+
+    Args:
+        consumer (str): Consumer label of a v1 style request
+
+    Returns:
+        str: The label up to the first underscore
+    """
+    return (consumer or "PC_CARD").split("_")[0]
+
+class v2_request:
+    """
+    A kernel line request and the settings of each of its lines. Edge
+    events read from the request but not yet consumed are kept here, so
+    every v2_lines of the request (e.g. a bulk and its to_list() lines)
+    sees them.
+    """
+
+    def __init__(self, request, config):
+        self.request = request
+        self.config = config
+        self.events = collections.deque()
+
+class v2_chip:
+    """A gpiochip opened through the libgpiod v2 API"""
+
+    def __init__(self, num, lazy=False):
+        """
+        Create a v2_chip instance
+
+        Args:
+            num (int): Number of the gpiochip
+
+            lazy (bool): Defer and merge output requests until the lines
+                         are first written (Default: False)
+        """
+        self.num = num
+        self.lazy = lazy
+        self.path = "/dev/gpiochip{}".format(num)
+        self.lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+        self.requests = {}
+
+    def name(self):
+        return "gpiochip{}".format(self.num)
+
+    def get_lines(self, offsets):
+        return v2_lines(self, offsets)
+
+    def request(self, offsets, consumer, type, default_vals):
+        """Request lines, deferring output requests until first written if lazy"""
+        with self.lock:
+            if type in EDGES or type == LINE_REQ_DIR_IN:
+                settings = gpiod.LineSettings(direction=Direction.INPUT, edge_detection=EDGES.get(type, Edge.NONE))
+                self.claim(offsets, {o: settings for o in offsets}, consumer)
+                return
+            vals = default_vals or [0]*len(offsets)
+            if not self.lazy:
+                self.claim(offsets, {o: gpiod.LineSettings(direction=Direction.OUTPUT, output_value=value(v))
+                                     for o, v in zip(offsets, vals)}, consumer)
+                return
+            held = [o for o in offsets if o in self.requests]
+            if held:
+                self.claim(held, {o: gpiod.LineSettings(direction=Direction.OUTPUT, output_value=value(v))
+                                  for o, v in zip(offsets, vals) if o in self.requests}, consumer)
+            for o, v in zip(offsets, vals):
+                if o not in self.requests:
+                    self.pending[o] = (consumer_group(consumer), v)
+
+    def claim(self, offsets, settings, consumer):
+        """Request lines now, or reconfigure the request already holding them"""
+        held = {id(self.requests[o]): self.requests[o] for o in offsets if o in self.requests}
+        if len(held) == 1:
+            req = next(iter(held.values()))
+            if set(offsets) <= set(req.config):
+                req.config.update(settings)
+                req.request.reconfigure_lines(dict(req.config))
+                return
+        for o in offsets:
+            self.drop(o)
+        req = v2_request(gpiod.request_lines(self.path, consumer=consumer, config=dict(settings)), settings)
+        for o in offsets:
+            self.requests[o] = req
+
+    def flush(self):
+        """Request every pending output line, one request per consumer group"""
+        groups = collections.defaultdict(dict)
+        for o, (group, v) in self.pending.items():
+            groups[group][o] = gpiod.LineSettings(direction=Direction.OUTPUT, output_value=value(v))
+        self.pending.clear()
+        for group, settings in groups.items():
+            req = v2_request(gpiod.request_lines(self.path, consumer=group, config=dict(settings)), settings)
+            for o in settings:
+                self.requests[o] = req
+
+    def set_values(self, offsets, values):
+        with self.lock:
+            if any(o in self.pending for o in offsets):
+                for o, v in zip(offsets, values):
+                    if o in self.pending:
+                        self.pending[o] = (self.pending[o][0], v)
+                self.flush()
+            by_request = {}
+            for o, v in zip(offsets, values):
+                req = self.requests[o]
+                by_request.setdefault(id(req), (req, {}))[1][o] = value(v)
+            for req, mapping in by_request.values():
+                req.request.set_values(mapping)
+
+    def get_values(self, offsets):
+        with self.lock:
+            if any(o in self.pending for o in offsets):
+                self.flush()
+            return [1 if self.requests[o].request.get_value(o) == Value.ACTIVE else 0 for o in offsets]
+
+    def drop(self, offset):
+        """Forget a line, releasing its request once none of its lines are held"""
+        self.pending.pop(offset, None)
+        req = self.requests.pop(offset, None)
+        if req is not None and req not in self.requests.values():
+            req.request.release()
+
+    def release(self, offsets):
+        with self.lock:
+            for o in offsets:
+                self.drop(o)
+
+class v2_event:
+    """A line event in the shape of a libgpiod v1 LineEvent"""
+
+    def __init__(self, type, sec, nsec):
+        self.type = type
+        self.sec = sec
+        self.nsec = nsec
+
+class v2_lines:
+    """A set of lines of a v2_chip, used like libgpiod v1 Line/LineBulk"""
+
+    def __init__(self, chip, offsets):
+        self.chip = chip
+        self.offsets = list(offsets)
+
+    def request(self, consumer=None, type=LINE_REQ_DIR_OUT, default_vals=None):
+        self.chip.request(self.offsets, consumer, type, default_vals)
+
+    def set_values(self, values):
+        self.chip.set_values(self.offsets, values)
+
+    def get_values(self):
+        return self.chip.get_values(self.offsets)
+
+    def release(self):
+        self.chip.release(self.offsets)
+
+    def to_list(self):
+        return [v2_lines(self.chip, [o]) for o in self.offsets]
+
+    def event_wait(self, sec=0, nsec=0):
+        req = self.chip.requests[self.offsets[0]]
+        if req.events:
+            return True
+        return req.request.wait_edge_events(datetime.timedelta(seconds=sec, microseconds=nsec/1000))
+
+    def event_read(self):
+        req = self.chip.requests[self.offsets[0]]
+        if not req.events:
+            for event in req.request.read_edge_events():
+                ts = event.timestamp_ns
+                req.events.append(v2_event(EVENT_RISING_EDGE if event.event_type == event.Type.RISING_EDGE
+                                           else EVENT_FALLING_EDGE, ts//1000000000, ts%1000000000))
+        return req.events.popleft()
@@ -0,0 +1,199 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import fcntl
+import ctypes
+
+I2C_SLAVE = 0x0703
+"""ioctl request to set the target address of plain reads and writes"""
+I2C_FUNCS = 0x0705
+"""ioctl request to get the functionality mask of the adapter"""
+I2C_RDWR  = 0x0707
+"""ioctl request for a combined transfer of several messages"""
+
+I2C_M_RD   = 0x0001
+"""Message flag: read from the device"""
+I2C_M_STOP = 0x8000
+"""Message flag: send a STOP after this message"""
+
+I2C_FUNC_PROTOCOL_MANGLING = 0x00000004
+"""Functionality bit: the adapter honors I2C_M_STOP and the other
+   protocol mangling flags"""
+
+I2C_RDWR_IOCTL_MAX_MSGS = 42
+"""Maximum number of messages the kernel accepts in one I2C_RDWR ioctl"""
+
+class i2c_msg(ctypes.Structure):
+    """struct i2c_msg from linux/i2c.h"""
+    _fields_ = [("addr",  ctypes.c_uint16),
+                ("flags", ctypes.c_uint16),
+                ("len",   ctypes.c_uint16),
+                ("buf",   ctypes.POINTER(ctypes.c_uint8))]
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+    """struct i2c_rdwr_ioctl_data from linux/i2c-dev.h"""
+    _fields_ = [("msgs",  ctypes.POINTER(i2c_msg)),
+                ("nmsgs", ctypes.c_uint32)]
+
+class i2c_transfer:
+    """
+    A precompiled set of write messages ready to be sent with I2C_RDWR.
+    The payload buffers and message arrays are built once and reused for
+    every transfer.
+    """
+
+    def __init__(self, address, payloads, stop=True, max_msgs=I2C_RDWR_IOCTL_MAX_MSGS):
+        """
+        Compile a transfer
+
+        Args:
+            address (int): 7-bit I2C address of every message
+
+            payloads (list[bytes]): The bytes of each write message
+
+            stop (bool): Request a STOP after each message, for devices
+                         like the I2C->SPI bridge that act on STOP. The
+                         adapter must support protocol mangling
+                         (Default: True)
+
+            max_msgs (int): Messages per I2C_RDWR ioctl. Each ioctl ends
+                            with a STOP, so 1 separates the messages on
+                            adapters without protocol mangling
+                            (Default: I2C_RDWR_IOCTL_MAX_MSGS)
+        """
+        self.address = address
+        self.payloads = [bytes(p) for p in payloads]
+        flags = I2C_M_STOP if stop else 0
+        self.buffers = [(ctypes.c_uint8*len(p)).from_buffer_copy(p) for p in self.payloads]
+        self.chunks = []
+        for i in range(0, len(self.buffers), max_msgs):
+            bufs = self.buffers[i:i+max_msgs]
+            msgs = (i2c_msg*len(bufs))()
+            for m, b in zip(msgs, bufs):
+                m.addr = address
+                m.flags = flags
+                m.len = len(b)
+                m.buf = ctypes.cast(b, ctypes.POINTER(ctypes.c_uint8))
+            self.chunks.append((msgs, i2c_rdwr_ioctl_data(msgs, len(bufs))))
+
+class i2c_dev:
+    """
+    A raw /dev/i2c-N handle. Besides plain reads and writes it sends
+    precompiled i2c_transfer objects as combined I2C_RDWR transfers, so a
+    whole register image costs one ioctl per I2C_RDWR_IOCTL_MAX_MSGS
+    messages instead of one syscall per register.
+
+    Combining messages relies on I2C_M_STOP to end each message with a
+    STOP, which adapters only honor with I2C_FUNC_PROTOCOL_MANGLING.
+    Others (such as the Cadence and xiic controllers on Zynq) ignore it,
+    and a device acting on STOP would see the messages as one frame. The
+    adapter's functionality is queried when the bus is opened, and
+    without mangling every message is sent as its own I2C_RDWR ioctl.
+    """
+
+    def __init__(self, i2cbus, fd=None, ioctl=fcntl.ioctl):
+        """
+        Open an I2C bus
+
+        Args:
+            i2cbus (int): Number of the I2C bus
+
+            fd (int): An already open file descriptor to use instead of
+                      opening /dev/i2c-N (Default: None)
+
+            ioctl (function): Function used to issue ioctls, with the
+                              signature of fcntl.ioctl
+                              (Default: fcntl.ioctl)
+        """
+        self.i2cbus = i2cbus
+        self.fd = fd if fd is not None else os.open("/dev/i2c-{}".format(i2cbus), os.O_RDWR)
+        self.ioctl = ioctl
+        self.target = None
+        funcs = ctypes.c_ulong()
+        self.ioctl(self.fd, I2C_FUNCS, funcs)
+        self.funcs = funcs.value
+        self.mangling = bool(self.funcs & I2C_FUNC_PROTOCOL_MANGLING)
+
+    def close(self):
+        """Close the file descriptor"""
+        os.close(self.fd)
+
+    def set_target(self, address):
+        """
+        Set the address used by read() and write()
+
+        Args:
+            address (int): 7-bit I2C address
+        """
+        if address != self.target:
+            self.ioctl(self.fd, I2C_SLAVE, address)
+            self.target = address
+
+    def read(self, address, count):
+        """
+        Read bytes from a device with a single I2C read transfer
+
+        Args:
+            address (int): 7-bit I2C address
+
+            count (int): Number of bytes to read
+
+        Returns:
+            bytes: The bytes read
+        """
+        self.set_target(address)
+        return os.read(self.fd, count)
+
+    def write(self, address, data):
+        """
+        Write bytes to a device with a single I2C write transfer
+
+        Args:
+            address (int): 7-bit I2C address
+
+            data (bytes): The bytes to write
+        """
+        self.set_target(address)
+        os.write(self.fd, data)
+
+    def write_i2c_block_data(self, address, cmd, data):
+        """
+        Write a command byte followed by data, like SMBus
+
+        Args:
+            address (int): 7-bit I2C address
+
+            cmd (int): Command byte
+
+            data (list[int]): Bytes to write after the command byte
+        """
+        self.write(address, bytes([cmd]) + bytes(data))
+
+    def compile(self, address, payloads):
+        """
+        Precompile write messages for transfer(). Without protocol
+        mangling the messages are sent one per ioctl.
+
+        Args:
+            address (int): 7-bit I2C address
+
+            payloads (list[bytes]): The bytes of each write message
+
+        Returns:
+            i2c_transfer: The compiled transfer
+        """
+        if self.mangling:
+            return i2c_transfer(address, payloads)
+        return i2c_transfer(address, payloads, stop=False, max_msgs=1)
+
+    def transfer(self, compiled):
+        """
+        Send a compiled transfer with combined I2C_RDWR ioctls
+
+        Args:
+            compiled (i2c_transfer): The transfer to send
+        """
+        for msgs, data in compiled.chunks:
+            self.ioctl(self.fd, I2C_RDWR, data)
@@ -2,8 +2,11 @@
 
 # SPDX-License-Identifier: MIT
 
-import iio
+import threading
 from enum import Enum
+from .locks import *
+from .backend import *
+from .debugfs_regs import debugfs_reg_path
 from .constants import *
 
 """Registers specific to an AD9361"""
@@ -21,17 +24,33 @@ class AD9361_GPO(Enum):
 class iio_gpo_control:
     """ A class for controlling the GPOs on an IIO device like gpiod"""
 
-    def __init__(self, dev_device="ad9361-phy"):
+    def __init__(self, dev_device="ad9361-phy", reg_backend="iio", debugfs_path=None):
         """
         Initialize an iio_gpo_control instance
 
         Args:
             dev_device (str): Name of IIO dev device to control
                               (Default: "ad9361-phy")
+
+            reg_backend (str): "iio" to access registers through libiio,
+                               or "debugfs" to keep the device's debugfs
+                               direct_reg_access file open (see
+                               debugfs_regs) (Default: "iio")
+
+            debugfs_path (str): Path of the direct_reg_access file for
+                                the debugfs backend. Found from
+                                dev_device if not set (Default: None)
         """
-        self.ctx = iio.LocalContext()
-        self.ctrl = self.ctx.find_device(dev_device)
-        self.write(GPIO_CTRL_NUM, self.read(GPIO_CTRL_NUM) | (1 << GPIO_CTRL_BIT))
+        #Register read-modify-writes must not interleave between threads
+        self.lock = resource_lock("iio", dev_device)
+        if reg_backend == "debugfs":
+            self.ctx = None
+            self.ctrl = open_debugfs_regs(debugfs_path or debugfs_reg_path(dev_device), dev_device)
+        else:
+            self.ctx = open_iio_context()
+            self.ctrl = self.ctx.find_device(dev_device)
+        with self.lock:
+            self.write(GPIO_CTRL_NUM, self.read(GPIO_CTRL_NUM) | (1 << GPIO_CTRL_BIT))
 
     def read(self, reg):
         """
@@ -80,10 +99,11 @@ class iio_gpo_control:
             output_value (int): The desired setting of the bit in the
                                 register
         """
-        if output_value == 0:
-            self.write(GPIO_REG_NUM, self.read(GPIO_REG_NUM) & ~(1 << pin_num))
-        else:
-            self.write(GPIO_REG_NUM, self.read(GPIO_REG_NUM) | (1 << pin_num))
+        with self.lock:
+            if output_value == 0:
+                self.write(GPIO_REG_NUM, self.read(GPIO_REG_NUM) & ~(1 << pin_num))
+            else:
+                self.write(GPIO_REG_NUM, self.read(GPIO_REG_NUM) | (1 << pin_num))
 
 class iio_gpo_line:
     """
@@ -113,3 +133,32 @@ class iio_gpo_line:
         """
         for z in zip(self.input_lines, output_vals):
             self.parent.set_value(z[0], z[1])
+
+_gpo_controls = {}
+_gpo_controls_lock = threading.Lock()
+
+def get_gpo_control(dev_device="ad9361-phy", reg_backend="iio", debugfs_path=None):
+    """
+    Returns the process-wide iio_gpo_control of an IIO device, opening
+    it on first use
+
+    Args:
+        dev_device (str): Name of IIO dev device to control
+                          (Default: "ad9361-phy")
+
+        reg_backend (str): Register backend used if the control is
+                           opened by this call (Default: "iio")
+
+        debugfs_path (str): direct_reg_access file of the debugfs backend
+                            used if the control is opened by this call
+                            (Default: None)
+
+    Returns:
+        iio_gpo_control: The shared GPO control
+    """
+    with _gpo_controls_lock:
+        ctrl = _gpo_controls.get(dev_device)
+        if ctrl is None:
+            ctrl = iio_gpo_control(dev_device, reg_backend, debugfs_path)
+            _gpo_controls[dev_device] = ctrl
+        return ctrl
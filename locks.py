@@ -0,0 +1,31 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import threading
+
+_registry_lock = threading.Lock()
+_resource_locks = {}
+
+def resource_lock(kind, key=None):
+    """
+    Returns the lock shared by every user of a hardware resource within
+    this process. Operations on independent resources take different
+    locks and can run in parallel from separate threads.
+
+    Args:
+        kind (str): Kind of resource ("gpiochip", "i2c", "mux" or "iio")
+
+        key: Identifier of the resource within its kind, such as the
+             gpiochip number, the I2C bus number or the IIO device name
+             (Default: None)
+
+    Returns:
+        threading.RLock: The lock for the requested resource
+    """
+    with _registry_lock:
+        lock = _resource_locks.get((kind, key))
+        if lock is None:
+            lock = threading.RLock()
+            _resource_locks[(kind, key)] = lock
+        return lock
@@ -0,0 +1,235 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Always-on latency metrics
+
+Every public card method and every hardware primitive (line write, I2C
+transfer, IIO register access) is counted and timed into a latency
+histogram. The metrics are available from snapshot() and in the
+Prometheus text format from prometheus_text(), and textfile_exporter
+writes them periodically for the node exporter's textfile collector.
+"""
+
+import os
+import bisect
+import logging
+import threading
+
+BUCKETS = [10e-6, 25e-6, 50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3,
+           10e-3, 25e-3, 50e-3, 100e-3, 250e-3, 1.0]
+"""list[float]: Upper bounds in seconds of the histogram buckets"""
+
+METHOD_METRIC = "pc_card_method_duration_seconds"
+HW_METRIC     = "pc_card_hw_op_duration_seconds"
+ERROR_METRIC  = "pc_card_method_errors_total"
+
+HELP = {METHOD_METRIC: "Duration of card API calls",
+        HW_METRIC:     "Duration of hardware primitives",
+        ERROR_METRIC:  "Card API calls that raised an exception"}
+
+class histogram:
+    """A fixed-bucket latency histogram"""
+
+    def __init__(self):
+        self.counts = [0]*(len(BUCKETS)+1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        """
+        Record one observation
+
+        Args:
+            seconds (float): The observed duration
+        """
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Cumulative bucket counts keyed by upper bound, plus sum
+                  and count
+        """
+        with self.lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = {}
+        running = 0
+        for le, c in zip(BUCKETS + [float("inf")], counts):
+            running += c
+            cumulative[le] = running
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+_registry_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+def get_histogram(name, labels):
+    """
+    Returns the histogram for a metric and label set, creating it on
+    first use
+
+    Args:
+        name (str): Metric name
+
+        labels (tuple): (label, value) pairs
+
+    Returns:
+        histogram: The histogram
+    """
+    key = (name, labels)
+    h = _histograms.get(key)
+    if h is None:
+        with _registry_lock:
+            h = _histograms.setdefault(key, histogram())
+    return h
+
+def observe(name, labels, seconds):
+    """
+    Record a duration
+
+    Args:
+        name (str): Metric name
+
+        labels (tuple): (label, value) pairs
+
+        seconds (float): The observed duration
+    """
+    get_histogram(name, labels).observe(seconds)
+
+def count(name, labels, amount=1):
+    """
+    Increment a counter
+
+    Args:
+        name (str): Metric name
+
+        labels (tuple): (label, value) pairs
+
+        amount (int): Amount to add (Default: 1)
+    """
+    with _registry_lock:
+        _counters[(name, labels)] = _counters.get((name, labels), 0) + amount
+
+def observe_method(card, method, start_ns, duration_ns, failed=False):
+    """Record a card API call"""
+    labels = (("card", card), ("method", method))
+    observe(METHOD_METRIC, labels, duration_ns/1e9)
+    if failed:
+        count(ERROR_METRIC, labels)
+
+def observe_hw(op, target, detail, start_ns, duration_ns):
+    """Record a hardware primitive. Registered as a backend listener"""
+    observe(HW_METRIC, (("op", op), ("target", target)), duration_ns/1e9)
+
+def snapshot():
+    """
+    Returns:
+        dict: Histogram snapshots and counter values keyed by
+              (metric name, labels)
+    """
+    with _registry_lock:
+        histograms = list(_histograms.items())
+        counters = dict(_counters)
+    result = {k: h.snapshot() for k, h in histograms}
+    result.update(counters)
+    return result
+
+def reset():
+    """Discard every recorded metric"""
+    with _registry_lock:
+        _histograms.clear()
+        _counters.clear()
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in items) + "}"
+
+def prometheus_text():
+    """
+    Render every metric in the Prometheus text exposition format
+
+    Returns:
+        str: The metrics
+    """
+    lines = []
+    with _registry_lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted(_counters.items())
+    seen = set()
+    for (name, labels), h in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append("# HELP {} {}".format(name, HELP.get(name, name)))
+            lines.append("# TYPE {} histogram".format(name))
+        snap = h.snapshot()
+        for le, c in snap["buckets"].items():
+            bound = "+Inf" if le == float("inf") else repr(le)
+            lines.append("{}_bucket{} {}".format(name, _format_labels(labels, [("le", bound)]), c))
+        lines.append("{}_sum{} {}".format(name, _format_labels(labels), repr(snap["sum"])))
+        lines.append("{}_count{} {}".format(name, _format_labels(labels), snap["count"]))
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append("# HELP {} {}".format(name, HELP.get(name, name)))
+            lines.append("# TYPE {} counter".format(name))
+        lines.append("{}{} {}".format(name, _format_labels(labels), value))
+    return "\n".join(lines) + "\n"
+
+def write_textfile(path):
+    """
+    Atomically write the metrics to a textfile-collector file
+
+    Args:
+        path (str): Path of the .prom file
+    """
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(prometheus_text())
+    os.replace(tmp, path)
+
+class textfile_exporter:
+    """
+    Periodically writes the metrics to a Prometheus textfile-collector
+    file from a background thread
+
+    **Expected usage:**
+
+        exporter = pc_card_control.textfile_exporter(
+            "/var/lib/node_exporter/textfile_collector/pc_card.prom")
+    """
+
+    def __init__(self, path, interval=15.0):
+        """
+        Start the exporter
+
+        Args:
+            path (str): Path of the .prom file
+
+            interval (float): Seconds between writes (Default: 15.0)
+        """
+        self.log = logging.getLogger("textfile_exporter")
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="textfile_exporter", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                write_textfile(self.path)
+            except OSError as e:
+                self.log.warning("Could not write {}: {}".format(self.path, e))
+
+    def stop(self):
+        """Stop the exporter after writing the metrics one last time"""
+        self.stopped.set()
+        self.thread.join()
+        write_textfile(self.path)
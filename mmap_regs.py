@@ -0,0 +1,140 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Memory-mapped GPIO registers
+
+When the FPGA GPIO line mux signals come from an AXI GPIO block, its
+data register can be mapped through UIO or /dev/mem and the lines set
+with plain 32-bit stores instead of gpiod ioctls. mmap_gpio_bank
+presents such a register like a gpiochip, keyed by the gpiochip line
+numbers the signals would otherwise have, so gpio_line_mux can use it
+in place of the chip (gpio_line_mux(mux_backend="mmap", ...)).
+
+Any file can be mapped, e.g. a temporary file for testing.
+"""
+
+import os
+import mmap
+import ctypes
+import threading
+
+DEFAULT_MUX_LAYOUT = {"data": 0x0,
+                      "tri":  0x4,
+                      "bits": {78+i: i for i in range(10)}}
+"""
+dict: Register layout of the line mux signals: byte offset of the data
+      register, byte offset of the direction (tristate) register or None,
+      and the data bit of each gpiochip line (CLOCK 78 on bit 0, RESET 79
+      on bit 1, the data lines 80-87 on bits 2-9)
+"""
+
+class mmap_regs:
+    """A mapped window of 32-bit registers"""
+
+    def __init__(self, path, base=0, size=0x1000, fd=None):
+        """
+        Map registers
+
+        Args:
+            path (str): File to map: /dev/mem, /dev/uioN or any file
+
+            base (int): Physical (or file) address of the registers
+                        (Default: 0)
+
+            size (int): Size of the window in bytes (Default: 0x1000)
+
+            fd (int): An already open file descriptor to use instead of
+                      opening path (Default: None)
+        """
+        self.path = path
+        aligned = base & ~(mmap.ALLOCATIONGRANULARITY - 1)
+        self.delta = base - aligned
+        own = fd is None
+        if own:
+            fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            self.map = mmap.mmap(fd, size + self.delta, offset=aligned)
+        finally:
+            if own:
+                os.close(fd)
+        self.registers = {}
+
+    def register(self, offset):
+        """
+        Returns:
+            ctypes.c_uint32: The register at a byte offset, read and
+                             written through .value
+        """
+        reg = self.registers.get(offset)
+        if reg is None:
+            reg = ctypes.c_uint32.from_buffer(self.map, self.delta + offset)
+            self.registers[offset] = reg
+        return reg
+
+    def read32(self, offset):
+        return self.register(offset).value
+
+    def write32(self, offset, value):
+        self.register(offset).value = value
+
+class mmap_gpio_bank:
+    """
+    A GPIO data register used like a gpiochip. A shadow of the register
+    is kept so that each write is a single store.
+    """
+
+    def __init__(self, regs, layout=DEFAULT_MUX_LAYOUT):
+        """
+        Create a mmap_gpio_bank instance
+
+        Args:
+            regs (mmap_regs): The mapped registers
+
+            layout (dict): Register layout (Default: DEFAULT_MUX_LAYOUT)
+        """
+        self.regs = regs
+        self.layout = layout
+        self.lock = threading.Lock()
+        self.data = regs.register(layout["data"])
+        self.shadow = self.data.value
+
+    def get_lines(self, offsets):
+        return mmap_lines(self, [self.layout["bits"][o] for o in offsets])
+
+    def make_outputs(self, bits):
+        """Clear the tristate bits of lines used as outputs"""
+        if self.layout.get("tri") is not None:
+            with self.lock:
+                tri = self.regs.register(self.layout["tri"])
+                tri.value &= ~sum(1 << b for b in bits)
+
+    def write(self, mask, bits):
+        with self.lock:
+            self.shadow = (self.shadow & ~mask) | bits
+            self.data.value = self.shadow
+
+class mmap_lines:
+    """Lines of a mmap_gpio_bank, used like gpiod lines"""
+
+    def __init__(self, bank, bits):
+        self.bank = bank
+        self.bits = bits
+        self.mask = sum(1 << b for b in bits)
+
+    def request(self, consumer=None, type=None, default_vals=None):
+        #Store the initial values before the lines stop being tristated,
+        #so they are never driven from the old data register
+        self.set_values(default_vals or [0]*len(self.bits))
+        self.bank.make_outputs(self.bits)
+
+    def set_values(self, values):
+        bits = 0
+        for b, v in zip(self.bits, values):
+            if v:
+                bits |= 1 << b
+        self.bank.write(self.mask, bits)
+
+    def get_values(self):
+        return [(self.bank.shadow >> b) & 1 for b in self.bits]
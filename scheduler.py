@@ -0,0 +1,206 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import time
+import heapq
+import logging
+import itertools
+import functools
+import threading
+import collections
+
+class scheduled_command:
+    """A card operation waiting for its deadline in a command_scheduler"""
+
+    def __init__(self, scheduler, deadline_ns, func):
+        self.scheduler = scheduler
+        self.deadline_ns = deadline_ns
+        """int: Requested time.monotonic_ns() at which to run"""
+        self.func = func
+        self.achieved_ns = None
+        """int: time.monotonic_ns() at which the operation was started"""
+        self.finished_ns = None
+        """int: time.monotonic_ns() at which the operation returned"""
+        self.result = None
+        self.exception = None
+        self.cancelled = False
+        self.started = False
+        """bool: The operation has been taken from the queue to run"""
+        self.done = threading.Event()
+
+    @property
+    def lateness_ns(self):
+        """int: Achieved minus requested start time"""
+        if self.achieved_ns is None:
+            return None
+        return self.achieved_ns - self.deadline_ns
+
+    def cancel(self):
+        """
+        Prevent the operation from running if it has not started yet
+
+        Returns:
+            bool: True if the operation will not run
+        """
+        with self.scheduler.cond:
+            if not self.started:
+                self.cancelled = True
+            return self.cancelled
+
+class command_scheduler:
+    """
+    Runs card operations at time.monotonic_ns() deadlines from a dedicated
+    thread. The thread sleeps until shortly before the deadline and spins
+    for the final approach, so the start time is not subject to the
+    wake-up jitter of the sleep.
+
+    **Expected usage:**
+
+        sched = pc_card_control.command_scheduler()
+        t = time.monotonic_ns() + 5_000_000
+        cmd = sched.schedule(t, my_tellurium.enable_pa)
+        cmd.done.wait()
+        print(cmd.lateness_ns)
+    """
+
+    def __init__(self, spin_ns=200000, history=1024, on_complete=None):
+        """
+        Create a command_scheduler and start its thread
+
+        Args:
+            spin_ns (int): How long before a deadline to stop sleeping and
+                           spin (Default: 200us)
+
+            history (int): Number of executed commands to keep for
+                           statistics (Default: 1024)
+
+            on_complete (function): Called with each scheduled_command
+                                    after it has run (Default: None)
+        """
+        self.log = logging.getLogger("command_scheduler")
+        self.spin_ns = spin_ns
+        self.on_complete = on_complete
+        self.history = collections.deque(maxlen=history)
+        self.queue = []
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="command_scheduler", daemon=True)
+        self.thread.start()
+
+    def schedule(self, deadline_ns, func, *args, **kwargs):
+        """
+        Schedule an operation. The arguments are bound here, and if the
+        operation belongs to a card with a prepare() method (such as
+        argon), its register payloads are precomputed here too, so only
+        the transfer remains at the deadline.
+
+        Args:
+            deadline_ns (int): time.monotonic_ns() at which to run
+
+            func (function): The operation, such as a bound card method
+
+        Returns:
+            scheduled_command: Handle to the scheduled operation
+        """
+        prepare = getattr(getattr(func, "__self__", None), "prepare", None)
+        if prepare is not None:
+            prepare(func.__name__, *args, **kwargs)
+        if args or kwargs:
+            func = functools.partial(func, *args, **kwargs)
+        cmd = scheduled_command(self, deadline_ns, func)
+        with self.cond:
+            if not self.running:
+                raise RuntimeError("The scheduler is stopped")
+            heapq.heappush(self.queue, (deadline_ns, next(self.seq), cmd))
+            self.cond.notify()
+        return cmd
+
+    def schedule_in(self, delay, func, *args, **kwargs):
+        """
+        Schedule an operation relative to now
+
+        Args:
+            delay (float): Seconds from now at which to run
+
+            func (function): The operation, such as a bound card method
+
+        Returns:
+            scheduled_command: Handle to the scheduled operation
+        """
+        return self.schedule(time.monotonic_ns() + int(delay*1e9), func, *args, **kwargs)
+
+    def run(self):
+        """Scheduler thread body"""
+        while True:
+            with self.cond:
+                while self.running and not self.queue:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                deadline_ns = self.queue[0][0]
+                remaining = deadline_ns - time.monotonic_ns()
+                if remaining > self.spin_ns:
+                    #Coarse sleep; woken early if an earlier deadline arrives
+                    self.cond.wait((remaining - self.spin_ns)/1e9)
+                    continue
+                cmd = heapq.heappop(self.queue)[2]
+                if cmd.cancelled:
+                    cmd.done.set()
+                    continue
+                #From here on cancel() no longer stops the command
+                cmd.started = True
+
+            while time.monotonic_ns() < deadline_ns:
+                pass
+            self.execute(cmd)
+
+    def execute(self, cmd):
+        """Run a command at its deadline and record the achieved time"""
+        cmd.achieved_ns = time.monotonic_ns()
+        try:
+            cmd.result = cmd.func()
+        except Exception as e:
+            cmd.exception = e
+            self.log.warning("Scheduled command failed: {}".format(e))
+        cmd.finished_ns = time.monotonic_ns()
+        self.history.append(cmd)
+        cmd.done.set()
+        if self.on_complete:
+            try:
+                self.on_complete(cmd)
+            except Exception as e:
+                self.log.error("on_complete callback failed: {}".format(e))
+
+    def stats(self):
+        """
+        Summarize the timing of the recently executed commands
+
+        Returns:
+            dict: count plus mean and max lateness in nanoseconds
+        """
+        lateness = [c.lateness_ns for c in self.history]
+        if not lateness:
+            return {"count": 0, "mean_lateness_ns": None, "max_lateness_ns": None}
+        return {"count": len(lateness),
+                "mean_lateness_ns": sum(lateness)/len(lateness),
+                "max_lateness_ns": max(lateness)}
+
+    def stop(self):
+        """
+        Stop the scheduler thread. Pending commands are not run: they are
+        marked cancelled, with a RuntimeError as their exception, and
+        their done event is set.
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        self.thread.join()
+        with self.cond:
+            pending = [entry[2] for entry in self.queue]
+            self.queue.clear()
+        for cmd in pending:
+            cmd.cancelled = True
+            cmd.exception = RuntimeError("The scheduler was stopped")
+            cmd.done.set()
@@ -2,8 +2,11 @@
 #
 # SPDX-License-Identifier: MIT
 
-import gpiod
+import threading
 import logging
+from .card_operation import *
+from .carp_expander import *
+from .backend import *
 from .constants import *
 
 class selenium:
@@ -15,6 +18,30 @@ class selenium:
         my_selenium = pc_card_control.selenium(0, 2)
     """
 
+    LPF_FREQS = {  145000000: [0, 1, 0],
+                   440000000: [0, 1, 1],
+                  1370000000: [1, 0, 1],
+                  3000000000: [1, 1, 0],
+                  9999999999: [0, 0, 1]} #UNFILTERED
+    """dict: LPF codes keyed by the highest frequency they pass"""
+
+    HPF_FREQS = { 3780000000: [1, 1, 0],
+                  1930000000: [1, 0, 1],
+                   840000000: [0, 1, 1],
+                   135000000: [0, 1, 0],
+                           0: [0, 0, 1]} #UNFILTERED
+    """dict: HPF codes keyed by the lowest frequency they pass"""
+
+    SETTLING = {"configure_lpf":          10e-6,
+                "configure_hpf":          10e-6,
+                "configure_filters":      10e-6,
+                "configure_dual_filters": 10e-6,
+                "configure_unfiltered":   10e-6}
+    """dict: Analog settling time in seconds after each operation (see operation)"""
+
+    EXPANDER_LINES = [1, 2, 3, 4]
+    """list[int]: CARP expander lines driven by the card, relative to 6*pc_slot"""
+
     def __init__(self, pc_slot, gpiochip_num, carp=0, reset=1):
         """
         Initialize a Selenium board
@@ -36,6 +63,13 @@ class selenium:
         #Setup logger
         self.log = logging.getLogger("selenium_{}".format(pc_slot))
 
+        #Serializes operations on this card between threads
+        self.lock = threading.RLock()
+
+        #Logical state of the card, published by state_shm when enabled
+        self.state = {}
+        self.pc_slot = pc_slot
+
         #Debug log to express initialization parameters
         self.log.debug("Selenium init")
         self.log.debug("Using base GPIOCHIP{}".format(BASE_GPIO_CHIP))
@@ -45,52 +79,106 @@ class selenium:
         self.log.debug("Using Personality Card slot {}".format(pc_slot))
 
         if carp:
-            self.gpiochip2 = gpiod.Chip('gpiochip{}'.format(CARP_GPIO_CHIP))
+            self.gpiochip2 = get_carp_expander()
+            self.gpiochip2.claim(slot_lines(pc_slot, self.EXPANDER_LINES))
+            self.batch     = self.gpiochip2.batch
         else:
-            self.gpiochip0 = gpiod.Chip('gpiochip{}'.format(BASE_GPIO_CHIP))
-        self.gpiochip  = gpiod.Chip("gpiochip{}".format(gpiochip_num))
+            self.gpiochip0 = open_chip(BASE_GPIO_CHIP)
+        self.gpiochip  = open_chip(gpiochip_num)
+        if carp:
+            #Writes to the card's chip must not overtake expander writes
+            #still pending in the operation's batch
+            self.gpiochip  = self.gpiochip2.ordered(self.gpiochip)
 
-        self.lpf = [[None]*3, [None]*3]
-        self.hpf = [[None]*3, [None]*3]
+        # The filter lines are requested as one bulk per chip so that a
+        # full retune of both paths costs one write per chip. lpf and hpf
+        # hold the (bank, index) position of each control bit.
+        self.lpf = [[(0, 0), (0, 1), (0, 2)], [(1, 2), (1, 3), (1, 4)]]
+        self.hpf = [[(0, 3), (1, 0), (1, 1)], [(1, 5), (1, 6), (1, 7)]]
 
         # The first four of these lines live on an I2C expander on CARP
         # The position of the GPIOs on the expander are relative to the
         # slot number
         if carp:
-            self.lpf[0][0] = self.gpiochip2.get_lines([6*pc_slot+1])
-            self.lpf[0][1] = self.gpiochip2.get_lines([6*pc_slot+2])
-            self.lpf[0][2] = self.gpiochip2.get_lines([6*pc_slot+3])
-            self.hpf[0][0] = self.gpiochip2.get_lines([6*pc_slot+4])
+            base_lines = self.gpiochip2.get_lines([6*pc_slot+1, 6*pc_slot+2, 6*pc_slot+3, 6*pc_slot+4])
         else:
-            self.lpf[0][0] = self.gpiochip0.get_lines([95])
-            self.lpf[0][1] = self.gpiochip0.get_lines([96])
-            self.lpf[0][2] = self.gpiochip0.get_lines([97])
-            self.hpf[0][0] = self.gpiochip0.get_lines([98])
+            base_lines = self.gpiochip0.get_lines([95, 96, 97, 98])
 
         # The rest of the lines live on an I2C expander on the Selenium
-        self.hpf[0][1] = self.gpiochip.get_lines([0])
-        self.hpf[0][2] = self.gpiochip.get_lines([1])
-        self.lpf[1][0] = self.gpiochip.get_lines([2])
-        self.lpf[1][1] = self.gpiochip.get_lines([3])
-        self.lpf[1][2] = self.gpiochip.get_lines([4])
-        self.hpf[1][0] = self.gpiochip.get_lines([5])
-        self.hpf[1][1] = self.gpiochip.get_lines([6])
-        self.hpf[1][2] = self.gpiochip.get_lines([7])
-
-        for i in self.lpf:
-            for j in i:
-                j.request(consumer='SELENIUM_LPF', type=gpiod.LINE_REQ_DIR_OUT)
-        for i in self.hpf:
-            for j in i:
-                j.request(consumer='SELENIUM_HPF', type=gpiod.LINE_REQ_DIR_OUT)
+        card_lines = self.gpiochip.get_lines([0, 1, 2, 3, 4, 5, 6, 7])
+
+        self.banks = [base_lines, card_lines]
+        self.bank_values = [[0]*4, [0]*8]
+        for bank in self.banks:
+            bank.request(consumer='SELENIUM_FILT', type=LINE_REQ_DIR_OUT)
 
         if reset:
             self.reset()
 
+    @operation
     def reset(self):
         """ Base reset for the board. Configure for unfiltered """
         self.configure_unfiltered()
 
+    def write_filters(self, assignments):
+        """
+        Apply filter control bits with one write per chip that changes
+
+        Args:
+            assignments (list[tuple]): ((bank, index), value) pairs
+        """
+        changed = set()
+        for (bank, index), val in assignments:
+            self.bank_values[bank][index] = val
+            changed.add(bank)
+        for bank in sorted(changed):
+            self.banks[bank].set_values(self.bank_values[bank])
+
+    def lpf_bits(self, freq, rx_path):
+        """
+        Compute the LPF control bits for a frequency and record the choice
+
+        Args:
+            freq (int): Desired frequency
+
+            rx_path (int): Index of RF path ([0-1] or -1 for both)
+
+        Returns:
+            list[tuple]: ((bank, index), value) pairs
+        """
+        for k, v in self.LPF_FREQS.items():
+            if freq <= k:
+                bits = []
+                for path in ([0, 1] if rx_path == -1 else [rx_path]):
+                    self.log.info("Set LPF to {} for rx_path {}".format(k, path))
+                    self.state["rx_lpf{}".format(path)] = k
+                    bits += zip(self.lpf[path], v)
+                return bits
+        return []
+
+    def hpf_bits(self, freq, rx_path):
+        """
+        Compute the HPF control bits for a frequency and record the choice
+
+        Args:
+            freq (int): Desired frequency
+
+            rx_path (int): Index of RF path ([0-1] or -1 for both)
+
+        Returns:
+            list[tuple]: ((bank, index), value) pairs
+        """
+        for k, v in self.HPF_FREQS.items():
+            if freq >= k:
+                bits = []
+                for path in ([0, 1] if rx_path == -1 else [rx_path]):
+                    self.log.info("Set HPF to {} for rx_path {}".format(k, path))
+                    self.state["rx_hpf{}".format(path)] = k
+                    bits += zip(self.hpf[path], v)
+                return bits
+        return []
+
+    @operation
     def configure_lpf(self, freq, rx_path=-1):
         """
         Configure the Low-pass Filter (LPF)
@@ -101,25 +189,9 @@ class selenium:
             rx_path (int): Index of RF path to set LPF for ([0-1] or -1 for
                            both). (Default: -1)
         """
-        freqs = {  145000000: [0, 1, 0],
-                   440000000: [0, 1, 1],
-                  1370000000: [1, 0, 1],
-                  3000000000: [1, 1, 0],
-                  9999999999: [0, 0, 1]} #UNFILTERED
-
-        for k, v in freqs.items():
-            if freq <= k:
-
-                if rx_path == -1 or rx_path == 0:
-                    self.log.info("Set LPF to {} for rx_path 0".format(k))
-                    for gpio, val in zip(self.lpf[0], v):
-                        gpio.set_values([val])
-                if rx_path == -1 or rx_path == 1:
-                    self.log.info("Set LPF to {} for rx_path 1".format(k))
-                    for gpio, val in zip(self.lpf[1], v):
-                        gpio.set_values([val])
-                return
+        self.write_filters(self.lpf_bits(freq, rx_path))
 
+    @operation
     def configure_hpf(self, freq, rx_path=-1):
         """
         Configure the High-pass Filter (HPF)
@@ -130,24 +202,24 @@ class selenium:
             rx_path (int): Index of RF path to set HPF for ([0-1] or -1 for
                            both). (Default: -1)
         """
-        freqs = { 3780000000: [1, 1, 0],
-                  1930000000: [1, 0, 1],
-                   840000000: [0, 1, 1],
-                   135000000: [0, 1, 0],
-                           0: [0, 0, 1]} #UNFILTERED
+        self.write_filters(self.hpf_bits(freq, rx_path))
 
-        for k, v in freqs.items():
-            if freq >= k:
-                if rx_path == -1 or rx_path == 0:
-                    self.log.info("Set HPF to {} for rx_path 0".format(k))
-                    for gpio, val in zip(self.hpf[0], v):
-                        gpio.set_values([val])
-                if rx_path == -1 or rx_path == 1:
-                    self.log.info("Set HPF to {} for rx_path 1".format(k))
-                    for gpio, val in zip(self.hpf[1], v):
-                        gpio.set_values([val])
-                return
+    def filter_band(self, freq):
+        """
+        Returns the filter band configure_filters would select, without
+        touching the hardware
 
+        Args:
+            freq (int): Desired frequency
+
+        Returns:
+            tuple: (LPF band, HPF band) keys into LPF_FREQS and HPF_FREQS
+        """
+        lpf = next((k for k in self.LPF_FREQS if freq <= k), None)
+        hpf = next((k for k in self.HPF_FREQS if freq >= k), None)
+        return (lpf, hpf)
+
+    @operation
     def configure_filters(self, freq, rx_path=-1):
         """
         Configure both HPF and LPF
@@ -158,9 +230,26 @@ class selenium:
             rx_path (int): Index of RF path to set filters for
                            ([0-1] or -1 for both). (Default: -1)
         """
-        self.configure_lpf(freq, rx_path)
-        self.configure_hpf(freq, rx_path)
+        self.write_filters(self.lpf_bits(freq, rx_path) + self.hpf_bits(freq, rx_path))
+
+    @operation
+    def configure_dual_filters(self, freq0, freq1=None):
+        """
+        Configure both HPF and LPF of both RF paths in a single pass, with
+        one write per chip
+
+        Args:
+            freq0 (int): Desired frequency for rx_path 0
+
+            freq1 (int): Desired frequency for rx_path 1. Uses freq0 if
+                         not set (Default: None)
+        """
+        if freq1 is None:
+            freq1 = freq0
+        self.write_filters(self.lpf_bits(freq0, 0) + self.hpf_bits(freq0, 0) +
+                           self.lpf_bits(freq1, 1) + self.hpf_bits(freq1, 1))
 
+    @operation
     def configure_unfiltered(self, rx_path=-1):
         """
         Configure the RX filters to the unfiltered setting
@@ -169,5 +258,4 @@ class selenium:
             rx_path (int): Index of RF path to set filters for
                            ([0-1] or -1 for both). (Default: -1)
         """
-        self.configure_lpf(4000000000, rx_path)
-        self.configure_hpf(100000000, rx_path)
+        self.write_filters(self.lpf_bits(4000000000, rx_path) + self.hpf_bits(100000000, rx_path))
@@ -0,0 +1,256 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+A simulated hardware backend. It keeps the state of every line, register
+and bus in memory and reports each hardware operation to a callback,
+which is used for dry runs.
+
+**Expected usage:**
+
+    pc_card_control.set_backend(pc_card_control.sim_backend(on_op=print))
+"""
+
+import time
+import threading
+import collections
+
+class sim_backend:
+    """Backend opening simulated hardware"""
+
+    #State of the simulated hardware must not be persisted
+    persistent = False
+
+    def __init__(self, on_op=None, lock_detect=2):
+        """
+        Create a sim_backend instance
+
+        Args:
+            on_op (function): Called with a description of each hardware
+                              operation (Default: None)
+
+            lock_detect (int): rb_LD_VTUNE value reported by simulated
+                               Argon synthesizers (Default: 2, locked)
+        """
+        self.on_op = on_op
+        self.lock_detect = lock_detect
+        self.chips = {}
+        self.iio_devices = {}
+        self.ops = 0
+        self.report_lock = threading.Lock()
+        #Cards are brought up from several threads, and each simulated
+        #chip and device must be created only once
+        self.open_lock = threading.Lock()
+
+    def report(self, text):
+        """
+        Count an operation and pass it to on_op. Operations reported from
+        several threads are passed one at a time.
+        """
+        with self.report_lock:
+            self.ops += 1
+            if self.on_op:
+                self.on_op(text)
+
+    def open_chip(self, num):
+        with self.open_lock:
+            chip = self.chips.get(num)
+            if chip is None:
+                chip = sim_chip(self, num)
+                self.chips[num] = chip
+            return chip
+
+    def open_smbus(self, num):
+        return sim_i2c(self, num)
+
+    def open_i2c_dev(self, num):
+        return sim_i2c(self, num)
+
+    def open_iio_context(self):
+        return sim_iio_context(self)
+
+    def open_debugfs_regs(self, path, name):
+        return sim_iio_context(self).find_device(name)
+
+    def open_mmap_regs(self, path, base, size):
+        from .mmap_regs import mmap_regs
+        return mmap_regs(path, 0, size, fd=-1)
+
+class sim_chip:
+    """A simulated gpiochip"""
+
+    def __init__(self, backend, num):
+        self.backend = backend
+        self.num = num
+        self.values = {}
+        self.events = collections.defaultdict(collections.deque)
+        self.event_cond = threading.Condition()
+
+    def inject_edge(self, offset, event_type):
+        """
+        Simulate an edge on an input line
+
+        Args:
+            offset (int): Offset of the line
+
+            event_type (int): EVENT_RISING_EDGE or EVENT_FALLING_EDGE
+        """
+        ts = time.monotonic_ns()
+        with self.event_cond:
+            self.events[offset].append(sim_event(event_type, ts//1000000000, ts%1000000000))
+            self.event_cond.notify_all()
+
+    def name(self):
+        return "gpiochip{}".format(self.num)
+
+    def get_lines(self, offsets):
+        return sim_lines(self, offsets)
+
+class sim_lines:
+    """A simulated set of gpiochip lines"""
+
+    def __init__(self, chip, offsets):
+        self.chip = chip
+        self.offsets = list(offsets)
+
+    def request(self, consumer=None, type=None, default_vals=None):
+        vals = default_vals or [0]*len(self.offsets)
+        for o, v in zip(self.offsets, vals):
+            self.chip.values[o] = v
+        self.chip.backend.report("gpiochip{} request {} as {}".format(self.chip.num, self.offsets, consumer))
+
+    def set_values(self, values):
+        for o, v in zip(self.offsets, values):
+            self.chip.values[o] = v
+        self.chip.backend.report("gpiochip{} set {} = {}".format(self.chip.num, self.offsets, list(values)))
+
+    def get_values(self):
+        return [self.chip.values.get(o, 0) for o in self.offsets]
+
+    def release(self):
+        pass
+
+    def to_list(self):
+        return [sim_lines(self.chip, [o]) for o in self.offsets]
+
+    def event_wait(self, sec=0, nsec=0):
+        with self.chip.event_cond:
+            return self.chip.event_cond.wait_for(
+                lambda: any(self.chip.events[o] for o in self.offsets), sec + nsec/1e9)
+
+    def event_read(self):
+        with self.chip.event_cond:
+            self.chip.event_cond.wait_for(lambda: self.chip.events[self.offsets[0]])
+            return self.chip.events[self.offsets[0]].popleft()
+
+class sim_event:
+    """A simulated line event"""
+
+    def __init__(self, type, sec, nsec):
+        self.type = type
+        self.sec = sec
+        self.nsec = nsec
+
+class sim_i2c:
+    """
+    A simulated I2C bus, usable both as SMBus and as an i2c_dev. Reads
+    return an Argon lock detect readback.
+    """
+
+    def __init__(self, backend, num):
+        self.backend = backend
+        self.num = num
+
+    def write_i2c_block_data(self, address, cmd, data):
+        self.backend.report("i2c{} 0x{:02x} write {}".format(self.num, address, bytes([cmd] + list(data)).hex()))
+
+    def write(self, address, data):
+        self.backend.report("i2c{} 0x{:02x} write {}".format(self.num, address, bytes(data).hex()))
+
+    def read(self, address, count):
+        self.backend.report("i2c{} 0x{:02x} read {}".format(self.num, address, count))
+        return bytes([0, self.backend.lock_detect << 1, 0] + [0]*(count-3))[:count]
+
+    def compile(self, address, payloads):
+        return sim_transfer(address, payloads)
+
+    def transfer(self, compiled):
+        self.backend.report("i2c{} 0x{:02x} transfer {} messages".format(self.num, compiled.address, len(compiled.payloads)))
+
+    def close(self):
+        pass
+
+class sim_transfer:
+    """A compiled burst of write messages for a sim_i2c"""
+
+    def __init__(self, address, payloads):
+        self.address = address
+        self.payloads = [bytes(p) for p in payloads]
+
+class sim_iio_context:
+    """A simulated IIO context"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def find_device(self, name):
+        with self.backend.open_lock:
+            dev = self.backend.iio_devices.get(name)
+            if dev is None:
+                dev = sim_iio_device(self.backend, name)
+                self.backend.iio_devices[name] = dev
+            return dev
+
+class sim_iio_device:
+    """A simulated IIO device with a register file"""
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+        self.regs = {}
+        self.channels = {}
+
+    def find_channel(self, name, output=False):
+        key = (name, output)
+        chan = self.channels.get(key)
+        if chan is None:
+            chan = sim_iio_channel(self, name)
+            self.channels[key] = chan
+        return chan
+
+    def reg_read(self, reg):
+        self.backend.report("{} read 0x{:02x}".format(self.name, reg))
+        return self.regs.get(reg, 0)
+
+    def reg_write(self, reg, val):
+        self.regs[reg] = val
+        self.backend.report("{} write 0x{:02x} = 0x{:02x}".format(self.name, reg, val))
+
+class sim_iio_channel:
+    """
+    A simulated IIO channel. Its rssi attribute reads "0.00 dB" until
+    set, e.g. chan.attrs["rssi"].value = "35.50 dB"
+    """
+
+    def __init__(self, device, name):
+        self.device = device
+        self.name = name
+        self.attrs = {"rssi": sim_iio_attr(self, "rssi", "0.00 dB")}
+
+class sim_iio_attr:
+    """A simulated IIO channel attribute"""
+
+    def __init__(self, channel, name, value):
+        self.channel = channel
+        self.name = name
+        self._value = value
+
+    @property
+    def value(self):
+        self.channel.device.backend.report("{} {} read {}".format(self.channel.device.name, self.channel.name, self.name))
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
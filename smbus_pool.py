@@ -0,0 +1,188 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import time
+import threading
+import contextlib
+from .locks import *
+from .backend import *
+
+_pool_lock = threading.Lock()
+_pool = {}
+
+class shared_bus:
+    """
+    A single SMBus handle shared by every card on an I2C bus. Every
+    transaction takes the bus lock; hold() keeps the lock for a whole
+    burst of transactions. Utilization statistics are kept per bus.
+    """
+
+    def __init__(self, i2cbus, backend="smbus"):
+        """
+        Open an I2C bus. Use get_bus() rather than creating instances
+        directly so the handle is shared.
+
+        Args:
+            i2cbus (int): Number of the I2C bus
+
+            backend (str): "smbus" to use python-smbus, or "i2c-dev" to
+                           use a raw /dev/i2c-N descriptor with combined
+                           transfers (Default: "smbus")
+        """
+        self.i2cbus = i2cbus
+        self.backend = backend
+        if backend == "i2c-dev":
+            self.raw = open_i2c_dev(i2cbus)
+            self.bus = self.raw
+        else:
+            self.bus = open_smbus(i2cbus)
+            self.raw = None
+        self.lock = resource_lock("i2c", i2cbus)
+        self.local = threading.local()
+        self.opened = time.monotonic()
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.holds = 0
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+
+    @contextlib.contextmanager
+    def hold(self):
+        """
+        Hold the bus for a burst of transactions so that no other user of
+        the bus can interleave with them. Holds may be nested.
+        """
+        depth = getattr(self.local, "depth", 0)
+        start = time.monotonic()
+        with self.lock:
+            acquired = time.monotonic()
+            self.local.depth = depth + 1
+            try:
+                yield self
+            finally:
+                self.local.depth = depth
+                if depth == 0:
+                    self.holds += 1
+                    self.wait_time += acquired - start
+                    self.busy_time += time.monotonic() - acquired
+
+    def write_i2c_block_data(self, address, cmd, data):
+        """
+        Write an I2C block to a device
+
+        Args:
+            address (int): 7-bit I2C address
+
+            cmd (int): Command byte
+
+            data (list[int]): Bytes to write after the command byte
+        """
+        with self.hold():
+            self.bus.write_i2c_block_data(address, cmd, data)
+            self.transactions += 1
+            self.bytes_written += len(data) + 1
+
+    def compile(self, address, payloads):
+        """
+        Precompile a burst of write messages for transfer()
+
+        Args:
+            address (int): 7-bit I2C address
+
+            payloads (list[bytes]): The bytes of each write message,
+                                    starting with the command byte
+
+        Returns:
+            The compiled burst
+        """
+        if self.backend == "i2c-dev":
+            return self.raw.compile(address, payloads)
+        return [(address, p[0], list(p[1:])) for p in payloads]
+
+    def transfer(self, compiled):
+        """
+        Send a compiled burst while holding the bus. With the i2c-dev
+        backend the burst is sent as combined I2C_RDWR transfers,
+        otherwise as one SMBus block write per message.
+
+        Args:
+            compiled: A burst returned by compile()
+        """
+        with self.hold():
+            if self.backend == "i2c-dev":
+                self.raw.transfer(compiled)
+                self.transactions += len(compiled.payloads)
+                self.bytes_written += sum(len(p) for p in compiled.payloads)
+            else:
+                for address, cmd, data in compiled:
+                    self.bus.write_i2c_block_data(address, cmd, data)
+                    self.transactions += 1
+                    self.bytes_written += len(data) + 1
+
+    def read(self, address, count):
+        """
+        Read bytes from a device with a single plain I2C read
+
+        Args:
+            address (int): 7-bit I2C address
+
+            count (int): Number of bytes to read
+
+        Returns:
+            bytes: The bytes read
+        """
+        with self.hold():
+            if self.raw is None:
+                self.raw = open_i2c_dev(self.i2cbus)
+            data = self.raw.read(address, count)
+            self.transactions += 1
+            self.bytes_read += count
+        return data
+
+    def stats(self):
+        """
+        Returns:
+            dict: Transaction and byte counts, number of holds, total
+                  busy and lock wait time, and the fraction of time the
+                  bus was busy since it was opened
+        """
+        elapsed = time.monotonic() - self.opened
+        return {"bus": self.i2cbus,
+                "transactions": self.transactions,
+                "bytes_written": self.bytes_written,
+                "bytes_read": self.bytes_read,
+                "holds": self.holds,
+                "busy_time": self.busy_time,
+                "wait_time": self.wait_time,
+                "utilization": self.busy_time/elapsed if elapsed > 0 else 0.0}
+
+def get_bus(i2cbus, backend="smbus"):
+    """
+    Returns the shared handle for an I2C bus, opening it on first use
+
+    Args:
+        i2cbus (int): Number of the I2C bus
+
+        backend (str): Backend to open the bus with if it is not open yet
+                       ("smbus" or "i2c-dev") (Default: "smbus")
+
+    Returns:
+        shared_bus: The shared bus handle
+    """
+    with _pool_lock:
+        bus = _pool.get(i2cbus)
+        if bus is None:
+            bus = shared_bus(i2cbus, backend)
+            _pool[i2cbus] = bus
+        return bus
+
+def bus_stats():
+    """
+    Returns:
+        list[dict]: The statistics of every open bus
+    """
+    with _pool_lock:
+        buses = list(_pool.values())
+    return [b.stats() for b in buses]
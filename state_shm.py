@@ -0,0 +1,273 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Publication of the cards' logical state in shared memory
+
+The process owning the hardware publishes each card's filter bands, PA
+level, RX attenuation, synthesizer band, RX/TX state and the line mux
+routes into a small fixed-layout file under /dev/shm. Any process can
+read a consistent snapshot with state_reader without owning the
+hardware. A seqlock-style counter in the header is odd while an update
+is in progress; readers retry until they copy the segment between two
+identical even counter values.
+
+Python cannot issue memory barriers, so on weakly ordered CPUs (the ARM
+targets) a reader could see the counter and the records out of order.
+The writer therefore also stores a CRC32 of the records with the even
+counter, and a copy is only accepted if its CRC matches. A reader gives
+up after a timeout rather than spinning forever, e.g. on a segment left
+odd by a publisher that died mid-update (the next publisher to attach
+repairs it).
+
+Each card has its own record, keyed by its slot and card type, so the
+cards of a stack in one slot (e.g. Argon on Selenium on Oxygen, all in
+slot 0) do not overwrite each other.
+
+**To publish (hardware owner)**
+
+    pc_card_control.enable_state_publication()
+
+**To observe (any process)**
+
+    reader = pc_card_control.state_reader()
+    print(reader.snapshot())
+"""
+
+import os
+import mmap
+import time
+import zlib
+import struct
+import threading
+
+DEFAULT_STATE_PATH = "/dev/shm/pc_card_control_state"
+"""Default path of the shared state segment"""
+
+MAGIC = 0x53434350
+"""Segment magic ("PCCS")"""
+LAYOUT_VERSION = 2
+
+HEADER = struct.Struct("<IHHQII")
+"""Header: magic, layout version, reserved, sequence counter, CRC32 of
+the records and mux routes, reserved"""
+
+FIELDS = ["slot", "card_type", "pa_level", "pa_enabled", "lna_enabled", "rx_att",
+          "synth_band", "transmit",
+          "rx_lpf0", "rx_lpf1", "rx_hpf0", "rx_hpf1", "tx_filter0", "tx_filter1",
+          "rx_bpf", "updates"]
+"""
+list[str]: Fields of a card record. Filter fields hold the key of the
+           selected filter band in Hz (the upper edge for the CARDF
+           band-pass filter). -1 means unknown or not applicable.
+"""
+RECORD = struct.Struct("<8b7qQ")
+
+RECORDS = 10
+"""Number of card records"""
+BACKPACK_SLOT = 4
+"""Slot number published for the CARDF backpack"""
+MUX_ROUTES = 10
+"""Number of line mux routes published"""
+
+CARD_TYPES = ["none", "selenium", "tellurium", "bismuth", "argon", "cardf"]
+"""list[str]: Card type names by card_type value"""
+
+SEQ_OFFSET = 8
+CRC_OFFSET = 16
+RECORDS_OFFSET = HEADER.size
+MUX_OFFSET = RECORDS_OFFSET + RECORDS*RECORD.size
+SIZE = MUX_OFFSET + MUX_ROUTES
+
+_EMPTY = [-1, 0] + [-1]*6 + [-1]*7 + [0]
+
+def _crc(map):
+    return zlib.crc32(map[RECORDS_OFFSET:SIZE])
+
+class state_publisher:
+    """Writes card state into the shared segment"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        """
+        Create or attach to the shared state segment
+
+        Args:
+            path (str): Path of the segment (Default: DEFAULT_STATE_PATH)
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, SIZE)
+            self.map = mmap.mmap(fd, SIZE)
+        finally:
+            os.close(fd)
+        magic, version, _, seq, _, _ = HEADER.unpack_from(self.map, 0)
+        self.begin()
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            HEADER.pack_into(self.map, 0, MAGIC, LAYOUT_VERSION, 0, seq | 1, 0, 0)
+            for i in range(RECORDS):
+                RECORD.pack_into(self.map, RECORDS_OFFSET + i*RECORD.size, *_EMPTY)
+            struct.pack_into("<{}b".format(MUX_ROUTES), self.map, MUX_OFFSET, *[-1]*MUX_ROUTES)
+        #Also completes an update left odd by a publisher that died
+        self.end()
+
+        #Record index of each (slot, card type) already in the segment
+        self.records = {}
+        for i in range(RECORDS):
+            slot, type = RECORD.unpack_from(self.map, RECORDS_OFFSET + i*RECORD.size)[:2]
+            if type:
+                self.records[(slot, type)] = i
+
+    def begin(self):
+        """Mark an update as in progress (sequence counter odd)"""
+        seq = struct.unpack_from("<Q", self.map, SEQ_OFFSET)[0]
+        struct.pack_into("<Q", self.map, SEQ_OFFSET, (seq | 1) if seq % 2 == 0 else seq + 2)
+
+    def end(self):
+        """
+        Store the CRC of the records and mark the update as complete
+        (sequence counter even)
+        """
+        struct.pack_into("<I", self.map, CRC_OFFSET, _crc(self.map))
+        seq = struct.unpack_from("<Q", self.map, SEQ_OFFSET)[0]
+        struct.pack_into("<Q", self.map, SEQ_OFFSET, (seq + 1) if seq % 2 else seq)
+
+    def record(self, slot, type):
+        """Returns the record index of a card, allocating it on first use"""
+        index = self.records.get((slot, type))
+        if index is None:
+            if len(self.records) == RECORDS:
+                raise ValueError("No free state record for a {} in slot {}".format(CARD_TYPES[type], slot))
+            index = len(self.records)
+            self.records[(slot, type)] = index
+        return index
+
+    def publish(self, slot, card_type, state):
+        """
+        Publish the state of a card
+
+        Args:
+            slot (int): Slot of the card (BACKPACK_SLOT for the backpack)
+
+            card_type (str): Card type name (see CARD_TYPES)
+
+            state (dict): Values of the record fields to update
+        """
+        type = CARD_TYPES.index(card_type)
+        with self.lock:
+            offset = RECORDS_OFFSET + self.record(slot, type)*RECORD.size
+            values = list(RECORD.unpack_from(self.map, offset))
+            values[0] = slot
+            values[1] = type
+            for k, v in state.items():
+                values[FIELDS.index(k)] = -1 if v is None else int(v)
+            values[-1] += 1
+            self.begin()
+            RECORD.pack_into(self.map, offset, *values)
+            self.end()
+
+    def publish_mux(self, routes):
+        """
+        Publish the line mux routes
+
+        Args:
+            routes (list[int]): Output connected to each mux input
+                                (-1 if unknown)
+        """
+        with self.lock:
+            self.begin()
+            struct.pack_into("<{}b".format(MUX_ROUTES), self.map, MUX_OFFSET, *routes)
+            self.end()
+
+class state_reader:
+    """Reads consistent snapshots of the shared state segment"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        """
+        Attach to the shared state segment
+
+        Args:
+            path (str): Path of the segment (Default: DEFAULT_STATE_PATH)
+        """
+        self.path = path
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            self.map = mmap.mmap(fd, SIZE, prot=mmap.PROT_READ)
+        finally:
+            os.close(fd)
+
+    def snapshot(self, timeout=0.1):
+        """
+        Read a consistent snapshot
+
+        Args:
+            timeout (float): Seconds to keep retrying while an update is
+                             in progress (Default: 0.1)
+
+        Returns:
+            dict: "seq", "cards" (a dict of fields per published card,
+                  in the order they were first published) and "mux"
+                  (output of each mux route)
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            seq = struct.unpack_from("<Q", self.map, SEQ_OFFSET)[0]
+            if seq % 2 == 0:
+                data = bytes(self.map[:SIZE])
+                if (struct.unpack_from("<Q", self.map, SEQ_OFFSET)[0] == seq and
+                        struct.unpack_from("<I", data, CRC_OFFSET)[0] == _crc(data)):
+                    break
+            if time.monotonic() >= deadline:
+                raise TimeoutError("No consistent snapshot of {} within {}s".format(self.path, timeout))
+            os.sched_yield()
+        magic, version, _, _, _, _ = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            raise ValueError("Unknown state segment layout")
+        cards = []
+        for i in range(RECORDS):
+            record = dict(zip(FIELDS, RECORD.unpack_from(data, RECORDS_OFFSET + i*RECORD.size)))
+            if record["card_type"]:
+                record["card_type"] = CARD_TYPES[record["card_type"]]
+                cards.append(record)
+        mux = list(struct.unpack_from("<{}b".format(MUX_ROUTES), data, MUX_OFFSET))
+        return {"seq": seq, "cards": cards, "mux": mux}
+
+def card_type(card):
+    """
+    Returns the card type name of a card instance
+
+    Args:
+        card: A card instance
+
+    Returns:
+        str: The name of the card class (or of the card class it derives
+             from) in CARD_TYPES, or "none"
+    """
+    for cls in type(card).__mro__:
+        if cls.__name__ in CARD_TYPES:
+            return cls.__name__
+    return "none"
+
+publisher = None
+"""state_publisher: The active publisher, or None if publication is off"""
+
+def enable_state_publication(path=DEFAULT_STATE_PATH):
+    """
+    Start publishing card state. Cards publish after each operation.
+
+    Args:
+        path (str): Path of the segment (Default: DEFAULT_STATE_PATH)
+
+    Returns:
+        state_publisher: The active publisher
+    """
+    global publisher
+    publisher = state_publisher(path)
+    return publisher
+
+def disable_state_publication():
+    """Stop publishing card state"""
+    global publisher
+    publisher = None
@@ -0,0 +1,124 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import time
+import logging
+import collections
+from .card_operation import *
+
+sweep_point = collections.namedtuple("sweep_point", ["frequency", "tuned_frequency", "if_offset",
+                                                     "synth_band", "filter_band", "config_time"])
+"""
+namedtuple: A single dwell of a sweep. tuned_frequency is the frequency to
+            tune the transceiver to, if_offset the synthesizer frequency
+            applied (0 without synthesizer) and config_time the time in
+            seconds spent reconfiguring the cards for this dwell,
+            including the wait for their outputs to settle.
+"""
+
+FILTER_METHODS = {"selenium":  ("filter_band", "configure_filters"),
+                  "tellurium": ("rx_filter_band", "configure_rx_filters")}
+"""dict: Band lookup and configure methods of each filter card type"""
+
+_UNSET = object()
+
+def frequency_range(start, stop, step):
+    """
+    Build a list of frequencies from start to stop (inclusive)
+
+    Args:
+        start (int): First frequency
+
+        stop (int): Last frequency
+
+        step (int): Frequency step
+
+    Returns:
+        list[int]: The frequencies
+    """
+    count = int((stop - start)//step) + 1
+    return [start + i*step for i in range(count)]
+
+class sweep:
+    """
+    A frequency sweep across an Argon and/or a filter card (Selenium or
+    Tellurium). The steps are visited grouped by synthesizer band and, in
+    frequency order within a band, by filter band, and the cards are only
+    reconfigured when the band changes. Filters are selected for the
+    frequency seen by the transceiver (after the synthesizer). Each point
+    is yielded once both cards have settled, with their settling times
+    overlapped (see wait_ready).
+
+    **Expected usage:**
+
+        steps = pc_card_control.frequency_range(6e9, 18e9, 10e6)
+        for point in pc_card_control.sweep(steps, my_argon, my_selenium):
+            capture(point.tuned_frequency)
+    """
+
+    def __init__(self, frequencies, synth=None, filters=None, ordered=True):
+        """
+        Create a sweep
+
+        Args:
+            frequencies (list[int]): Frequencies to visit
+
+            synth (argon): Argon to tune (Default: None)
+
+            filters (object): Selenium or Tellurium whose RX filters
+                              follow the sweep (Default: None)
+
+            ordered (bool): Reorder the steps to minimize
+                            reconfiguration. If False they are visited in
+                            the given order (Default: True)
+        """
+        self.log = logging.getLogger("sweep")
+        self.synth = synth
+        self.filters = filters
+        self.frequencies = list(frequencies)
+        self.ordered = ordered
+        if filters is not None:
+            band, configure = FILTER_METHODS[type(filters).__name__]
+            self.filter_band = getattr(filters, band)
+            self.configure_filters = getattr(filters, configure)
+        self.synth_changes = 0
+        self.filter_changes = 0
+
+    def plan(self):
+        """
+        Compute the visit order without touching the hardware
+
+        Returns:
+            list[tuple]: (frequency, synth band, tuned frequency,
+                         filter band) in visit order
+        """
+        steps = []
+        for freq in self.frequencies:
+            band = self.synth.synth_band(freq) if self.synth else -1
+            tuned = self.synth.tuned_frequency(freq, band) if self.synth else freq
+            fband = self.filter_band(tuned) if self.filters else None
+            steps.append((freq, band, tuned, fband))
+        if self.ordered:
+            steps.sort(key=lambda s: (s[1], s[2]))
+        return steps
+
+    def __iter__(self):
+        synth_band = _UNSET
+        filter_band = _UNSET
+        for freq, band, tuned, fband in self.plan():
+            start = time.perf_counter()
+            if self.synth and band != synth_band:
+                tuned = self.synth.configure_synth(freq)
+                band = self.synth.current_synth_setting
+                synth_band = band
+                self.synth_changes += 1
+            if self.filters and fband != filter_band:
+                self.configure_filters(tuned)
+                filter_band = fband
+                self.filter_changes += 1
+            wait_ready(*[c for c in (self.synth, self.filters) if c is not None])
+            yield sweep_point(freq, tuned, freq - tuned, band, fband,
+                              time.perf_counter() - start)
+        self.log.info("Sweep of {} steps: {} synth and {} filter changes".format(
+                      len(self.frequencies), self.synth_changes, self.filter_changes))
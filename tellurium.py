@@ -2,10 +2,13 @@
 
 # SPDX-License-Identifier: MIT
 
-import gpiod
+import threading
 import logging
 from .gpio_line_mux import *
 from .iio_gpo_control import *
+from .card_operation import *
+from .carp_expander import *
+from .backend import *
 from .constants import *
 
 class tellurium:
@@ -17,7 +20,38 @@ class tellurium:
 
         my_tellurium = pc_card_control.tellurium(0, 2, 0)
     """
-    def __init__(self, pc_slot, gpiochip_num, transceiver_num, carp=0, control_rxtx=1, reset=1):
+
+    RX_LPF_FREQS = {  145000000: [0, 1, 0],
+                      440000000: [0, 1, 1],
+                     1370000000: [1, 0, 1],
+                     3000000000: [1, 1, 0],
+                     9999999999: [0, 0, 1]} #UNFILTERED
+    """dict: RX LPF codes keyed by the highest frequency they pass"""
+
+    RX_HPF_FREQS = { 3780000000: [1, 1, 0],
+                     1930000000: [1, 0, 1],
+                      840000000: [0, 1, 1],
+                      135000000: [0, 1, 0],
+                              0: [0, 0, 1]} #UNFILTERED
+    """dict: RX HPF codes keyed by the lowest frequency they pass"""
+
+    SETTLING = {"configure_rx_lpf":        10e-6,
+                "configure_rx_hpf":        10e-6,
+                "configure_rx_filters":    10e-6,
+                "configure_rx_unfiltered": 10e-6,
+                "configure_tx_filters":    10e-6,
+                "configure_tx_unfiltered": 10e-6,
+                "configure_pa":            10e-6,
+                "enable_pa":               50e-6,
+                "disable_pa":              10e-6,
+                "configure_receive":       50e-6,
+                "configure_transmit":      50e-6}
+    """dict: Analog settling time in seconds after each operation (see operation)"""
+
+    EXPANDER_LINES = [1, 2, 3, 4, 5]
+    """list[int]: CARP expander lines driven by the card, relative to 6*pc_slot"""
+
+    def __init__(self, pc_slot, gpiochip_num, transceiver_num, carp=0, control_rxtx=1, reset=1, gpo_backend="iio", debugfs_path=None, mux_options=None):
         """
         Initialize a Tellurium board
 
@@ -39,11 +73,32 @@ class tellurium:
 
             reset (int): Should the reset() function be called at the end
                          of initialization (Default:1)
+
+            gpo_backend (str): Register backend of the transceiver GPO
+                               control if it is not already open: "iio",
+                               or "debugfs" to keep the direct_reg_access
+                               file open (Default: "iio")
+
+            debugfs_path (str): direct_reg_access file for the debugfs
+                                GPO backend. Found from the IIO device
+                                name if not set (Default: None)
+
+            mux_options (dict): gpio_line_mux arguments on CARP, used if
+                                the line mux is not already open, e.g.
+                                {"mux_backend": "mmap", "mmap_base": ...}
+                                (Default: None)
         """
 
         #Setup logger
         self.log = logging.getLogger("tellurium_{}".format(pc_slot))
 
+        #Serializes operations on this card between threads
+        self.lock = threading.RLock()
+
+        #Logical state of the card, published by state_shm when enabled
+        self.state = {}
+        self.pc_slot = pc_slot
+
         #Debug log to express initialization parameters
         self.log.debug("Tellurium init")
         self.log.debug("Using base GPIOCHIP{}".format(BASE_GPIO_CHIP))
@@ -55,13 +110,21 @@ class tellurium:
         if control_rxtx:
             self.log.debug("Set to control RX/TX")
 
-        self.gpiochip0 = gpiod.Chip('gpiochip{}'.format(BASE_GPIO_CHIP))
+        self.gpiochip0 = open_line_bank(BASE_GPIO_CHIP)
         if carp:
-            self.gpiochip2 = gpiod.Chip('gpiochip{}'.format(CARP_GPIO_CHIP))
-            self.line_mux  = gpio_line_mux()
+            self.gpiochip2 = get_carp_expander()
+            self.gpiochip2.claim(slot_lines(pc_slot, self.EXPANDER_LINES))
+            self.batch     = self.gpiochip2.batch
+            self.line_mux  = get_line_mux(**(mux_options or {}))
         else:
-            self.gpo_ctrl = iio_gpo_control()
-        self.gpiochip  = gpiod.Chip("gpiochip{}".format(gpiochip_num))
+            self.gpo_ctrl = get_gpo_control(reg_backend=gpo_backend, debugfs_path=debugfs_path)
+        self.gpiochip  = open_line_bank(gpiochip_num)
+        if carp:
+            #Writes to the other chips must not overtake expander writes
+            #still pending in the operation's batch
+            self.gpiochip0 = self.gpiochip2.ordered(self.gpiochip0)
+            self.gpiochip  = self.gpiochip2.ordered(self.gpiochip)
+            self.line_mux  = self.gpiochip2.ordered(self.line_mux)
 
         if carp:
             match pc_slot:
@@ -119,23 +182,29 @@ class tellurium:
 
         self.pa_enable = self.gpiochip.get_lines([7])
 
-        self.pa_enable.request(consumer='TELLURIUM_PA_ENABLE', type=gpiod.LINE_REQ_DIR_OUT)
+        self.pa_enable.request(consumer='TELLURIUM_PA_ENABLE', type=LINE_REQ_DIR_OUT)
         if control_rxtx:
-            self.rx.request(consumer='TELLURIUM_RX_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
-            self.tx.request(consumer='TELLURIUM_TX_CTRL', type=gpiod.LINE_REQ_DIR_OUT)
+            self.rx.request(consumer='TELLURIUM_RX_CTRL', type=LINE_REQ_DIR_OUT)
+            self.tx.request(consumer='TELLURIUM_TX_CTRL', type=LINE_REQ_DIR_OUT)
 
         for i in self.rx_lpf:
-            i.request(consumer='TELLURIUM_LPF', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='TELLURIUM_LPF', type=LINE_REQ_DIR_OUT)
         for i in self.rx_hpf:
-            i.request(consumer='TELLURIUM_HPF', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='TELLURIUM_HPF', type=LINE_REQ_DIR_OUT)
         for i in self.pa:
-            i.request(consumer='TELLURIUM_PA', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='TELLURIUM_PA', type=LINE_REQ_DIR_OUT)
         for i in self.tx_filt:
-            i.request(consumer='TELLURIUM_TX_FILT', type=gpiod.LINE_REQ_DIR_OUT)
+            i.request(consumer='TELLURIUM_TX_FILT', type=LINE_REQ_DIR_OUT)
+
+        #The lines above only set the initial values; each chip's lines are
+        #claimed here in one request, driven to those values
+        self.gpiochip0.request(consumer='TELLURIUM')
+        self.gpiochip.request(consumer='TELLURIUM')
 
         if reset:
             self.reset()
 
+    @operation
     def reset(self):
         """
         Base reset for the board. Disables RX/TX filtering, sets to not use
@@ -146,6 +215,7 @@ class tellurium:
         self.configure_pa(0)
         self.disable_pa()
 
+    @operation
     def configure_rx_lpf(self, freq):
         """
         Configure the Low-pass Filters (LPF) for the requested frequency
@@ -153,19 +223,15 @@ class tellurium:
         Args:
             freq (int): Desired frequency to set.
         """
-        freqs = {  145000000: [0, 1, 0],
-                   440000000: [0, 1, 1],
-                  1370000000: [1, 0, 1],
-                  3000000000: [1, 1, 0],
-                  9999999999: [0, 0, 1]} #UNFILTERED
-
-        for k, v in freqs.items():
+        for k, v in self.RX_LPF_FREQS.items():
             if freq <= k:
                 for gpio, val in zip(self.rx_lpf, v):
                     gpio.set_values([val])
                 self.log.info("Set RX LPF to {}".format(k))
+                self.state["rx_lpf0"] = k
                 return
 
+    @operation
     def configure_rx_hpf(self, freq):
         """
         Configure the High-pass Filters (HPF) for the requested frequency
@@ -173,19 +239,31 @@ class tellurium:
         Args:
             freq (int): Desired frequency to set.
         """
-        freqs = { 3780000000: [1, 1, 0],
-                  1930000000: [1, 0, 1],
-                   840000000: [0, 1, 1],
-                   135000000: [0, 1, 0],
-                           0: [0, 0, 1]} #UNFILTERED
-
-        for k, v in freqs.items():
+        for k, v in self.RX_HPF_FREQS.items():
             if freq >= k:
                 for gpio, val in zip(self.rx_hpf, v):
                     gpio.set_values([val])
                 self.log.info("Set RX HPF to {}".format(k))
+                self.state["rx_hpf0"] = k
                 return
 
+    def rx_filter_band(self, freq):
+        """
+        Returns the filter band configure_rx_filters would select, without
+        touching the hardware
+
+        Args:
+            freq (int): Desired frequency to set.
+
+        Returns:
+            tuple: (LPF band, HPF band) keys into RX_LPF_FREQS and
+                   RX_HPF_FREQS
+        """
+        lpf = next((k for k in self.RX_LPF_FREQS if freq <= k), None)
+        hpf = next((k for k in self.RX_HPF_FREQS if freq >= k), None)
+        return (lpf, hpf)
+
+    @operation
     def configure_rx_filters(self, freq):
         """
         Configure the LPF and HPF for the requested frequency
@@ -196,11 +274,13 @@ class tellurium:
         self.configure_rx_lpf(freq)
         self.configure_rx_hpf(freq)
 
+    @operation
     def configure_rx_unfiltered(self):
         """Configure the RX filters to the unfiltered setting"""
         self.configure_rx_lpf(4000000000)
         self.configure_rx_hpf(100000000)
 
+    @operation
     def configure_pa(self, power_level):
         """
         Configure the PA
@@ -222,7 +302,9 @@ class tellurium:
         for gpio, val in zip(self.pa, power[power_level]):
             gpio.set_values([val])
         self.log.info("Power level set to {}".format(power_level))
+        self.state["pa_level"] = power_level
 
+    @operation
     def enable_pa(self):
         """
         Enable the PAs. Disable the LNAs
@@ -230,7 +312,9 @@ class tellurium:
         self.log.info("Enabling PAs")
         self.pa_enable.set_values([1])
         self.tx_enable.set_values([1])
+        self.state["pa_enabled"] = 1
 
+    @operation
     def disable_pa(self):
         """
         Disable the PAs.
@@ -238,7 +322,9 @@ class tellurium:
         self.log.info("Disabling PAs")
         self.tx_enable.set_values([0])
         self.pa_enable.set_values([0])
+        self.state["pa_enabled"] = 0
 
+    @operation
     def configure_receive(self):
         """
         Disable the PAs. If control_rxtx set, turn off TX and enable RX.
@@ -249,7 +335,9 @@ class tellurium:
             self.tx.set_values([0])
         if self.rx:
             self.rx.set_values([1])
+        self.state["transmit"] = 0
 
+    @operation
     def configure_transmit(self):
         """
         Disable the LNAs.
@@ -259,7 +347,9 @@ class tellurium:
             self.rx.set_values([0])
         if self.tx:
             self.tx.set_values([1])
+        self.state["transmit"] = 1
 
+    @operation
     def configure_tx_filters(self, freq):
         """
         Configure the TX filters for the requested frequency
@@ -278,8 +368,10 @@ class tellurium:
                 self.log.info("Configuring TX filters for {}".format(k))
                 for gpio, val in zip(self.tx_filt, v):
                     gpio.set_values([val])
+                self.state["tx_filter0"] = k
                 return
 
+    @operation
     def configure_tx_unfiltered(self):
         """Configure the TX filters to the unfiltered setting"""
         self.configure_tx_filters(4000000000)
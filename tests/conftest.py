@@ -0,0 +1,18 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import os
+import sys
+import importlib.util
+
+#The repository is the package itself, so load it under its installed name
+#whatever the checkout directory is called
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if "pc_card_control" not in sys.modules:
+    spec = importlib.util.spec_from_file_location("pc_card_control", os.path.join(ROOT, "__init__.py"),
+                                                  submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["pc_card_control"] = module
+    spec.loader.exec_module(module)
@@ -0,0 +1,88 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import sys
+import pytest
+import pc_card_control
+from pc_card_control.agc import *
+
+@pytest.fixture
+def sim():
+    backend = pc_card_control.sim_backend()
+    previous = pc_card_control.get_backend()
+    pc_card_control.set_backend(backend)
+    yield backend
+    pc_card_control.set_backend(previous)
+    #The shared GPO control was opened on the simulated IIO context
+    sys.modules["pc_card_control.iio_gpo_control"]._gpo_controls.clear()
+
+@pytest.fixture
+def agc(sim):
+    card = pc_card_control.bismuth(0, 5, 0)
+    return rx_att_agc(card, dwell=0.05, start=False)
+
+def set_rssi(sim, db):
+    sim.iio_devices["ad9361-phy"].find_channel("voltage0").attrs["rssi"].value = "{:.2f} dB".format(db)
+
+def run(agc, start, stop, step=0.01):
+    """Sample from start to stop seconds and return the time reached"""
+    t = start
+    while t < stop:
+        agc.sample(now=t)
+        t = round(t + step, 6)
+    return t
+
+def test_parse_rssi():
+    assert parse_rssi("34.25 dB") == 34.25
+
+def test_narrow_band_rejected(sim):
+    card = pc_card_control.bismuth(0, 5, 0)
+    with pytest.raises(ValueError):
+        rx_att_agc(card, strong_db=30, weak_db=30 + RX_ATT_STEP_DB, start=False)
+
+def test_step_needs_dwell(sim, agc):
+    set_rssi(sim, 10)
+    run(agc, 0, 0.05)
+    assert agc.card.state["rx_att"] == 0
+    agc.sample(now=0.05)
+    assert agc.card.state["rx_att"] == 1
+    #The next step needs a full dwell at the new level
+    run(agc, 0.06, 0.1)
+    assert agc.card.state["rx_att"] == 1
+    agc.sample(now=0.1)
+    assert agc.card.state["rx_att"] == 2
+
+def test_hysteresis_band_holds(sim, agc):
+    set_rssi(sim, 10)
+    run(agc, 0, 0.06)
+    assert agc.card.state["rx_att"] == 1
+    set_rssi(sim, 30)
+    run(agc, 0.06, 1)
+    assert agc.card.state["rx_att"] == 1
+    assert agc.stats()["steps_up"] == 1
+
+def test_direction_change_restarts_dwell(sim, agc):
+    set_rssi(sim, 10)
+    run(agc, 0, 0.04)
+    set_rssi(sim, 30)
+    agc.sample(now=0.04)
+    set_rssi(sim, 10)
+    run(agc, 0.05, 0.1)
+    assert agc.card.state["rx_att"] == 0
+
+def test_steps_elided_at_limits(sim, agc):
+    set_rssi(sim, 5)
+    run(agc, 0, 1)
+    assert agc.card.state["rx_att"] == RX_ATT_MAX
+    assert agc.counts["steps_up"] == RX_ATT_MAX
+    assert agc.counts["elided"] > 0
+    set_rssi(sim, 60)
+    elided = agc.counts["elided"]
+    run(agc, 1, 2)
+    assert agc.card.state["rx_att"] == 0
+    assert agc.counts["steps_down"] == RX_ATT_MAX
+    assert agc.counts["elided"] > elided
+
+def test_shares_card_context(sim, agc):
+    assert agc.ctx is agc.card.gpo_ctrl.ctx
@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import time
+import logging
+import threading
+from pc_card_control.card_operation import *
+
+class card:
+    SETTLING = {"enable": 0.5, "tune": 1.0}
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.log = logging.getLogger("test_card")
+        self.state = {}
+
+    @operation
+    def enable(self):
+        pass
+
+    @operation
+    def tune(self, frequency):
+        return frequency
+
+    @operation
+    def enable_and_tune(self, frequency):
+        self.enable()
+        return self.tune(frequency)
+
+def test_none_returns_ready_at():
+    c = card()
+    ready = c.enable()
+    assert isinstance(ready, ready_at)
+    assert ready == c.ready_at
+    assert 0.4 < ready.remaining() <= 0.5
+
+def test_value_passed_through():
+    c = card()
+    assert c.tune(12e9) == 12e9
+    assert c.ready_at.remaining() > 0.9
+
+def test_with_ready():
+    c = card()
+    freq, ready = with_ready(c.tune, 9e9)
+    assert freq == 9e9
+    assert ready == c.ready_at
+    #A later operation does not move the ready_at already returned
+    c.ready_at = ready_at(time.monotonic_ns() + int(5e9))
+    assert ready.remaining() <= 1.0
+
+def test_nested_settling_is_longest():
+    c = card()
+    assert c.enable_and_tune(6e9) == 6e9
+    assert 0.9 < c.ready_at.remaining() <= 1.0
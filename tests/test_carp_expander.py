@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+import pc_card_control
+from pc_card_control.carp_expander import *
+
+@pytest.fixture
+def sim():
+    backend = pc_card_control.sim_backend()
+    previous = pc_card_control.get_backend()
+    pc_card_control.set_backend(backend)
+    yield backend
+    pc_card_control.set_backend(previous)
+
+def test_slot_lines():
+    assert slot_lines(2, [1, 2, 3]) == [13, 14, 15]
+
+def test_claim_keeps_values(sim):
+    expander = carp_expander()
+    expander.claim(slot_lines(0, [1, 2]))
+    expander.get_lines([1]).set_values([1])
+    expander.claim(slot_lines(1, [1]), [1])
+    assert expander.offsets == [1, 2, 7]
+    assert [sim.chips[CARP_GPIO_CHIP].values[o] for o in (1, 2, 7)] == [1, 0, 1]
+
+def test_failed_claim_restores_request(sim, monkeypatch):
+    expander = carp_expander()
+    expander.claim([1, 2])
+    expander.get_lines([2]).set_values([1])
+    get_lines = expander.gpiochip.get_lines
+    def failing(offsets):
+        lines = get_lines(offsets)
+        if len(offsets) > 2:
+            def request(**kwargs):
+                raise OSError(16, "Device or resource busy")
+            lines.request = request
+        return lines
+    monkeypatch.setattr(expander.gpiochip, "get_lines", failing)
+    with pytest.raises(OSError):
+        expander.claim([7])
+    assert expander.offsets == [1, 2]
+    assert 7 not in expander.index
+    expander.get_lines([1]).set_values([1])
+    assert expander.lines.get_values() == [1, 1]
+
+def test_batch_defers_writes(sim):
+    expander = carp_expander()
+    expander.claim([1, 2])
+    with expander.batch():
+        expander.get_lines([1]).set_values([1])
+        expander.get_lines([2]).set_values([1])
+        assert expander.writes == 0
+    assert expander.writes == 1
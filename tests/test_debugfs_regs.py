@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import sys
+import pc_card_control
+from pc_card_control.debugfs_regs import *
+
+def open_regs(tmp_path, contents=b""):
+    path = tmp_path / "direct_reg_access"
+    path.write_bytes(contents)
+    return path, debugfs_regs(str(path))
+
+def test_select_writes_address(tmp_path):
+    path, regs = open_regs(tmp_path)
+    regs.select(0x2a)
+    assert path.read_bytes() == b"0x2a"
+    assert regs.commands == {0x2a: b"0x2a"}
+    regs.close()
+
+def test_reg_write_writes_address_and_value(tmp_path):
+    path, regs = open_regs(tmp_path)
+    regs.reg_write(0x26, 0x1f)
+    assert path.read_bytes() == b"0x26 0x1f"
+    regs.close()
+
+def test_read_selected_parses_value(tmp_path):
+    path, regs = open_regs(tmp_path, b"0x3c\n")
+    assert regs.read_selected() == 0x3c
+    #A regular file reads back the selection written at offset 0
+    assert regs.reg_read(0x27) == 0x27
+    regs.close()
+
+def test_transact_keeps_order(tmp_path):
+    path, regs = open_regs(tmp_path)
+    assert regs.transact([(0x26, 0xff), (0x2b,), (0x26, 0x00)]) == [0x2b]
+    regs.close()
+
+def test_debugfs_reg_path(tmp_path):
+    for entry, name in (("iio:device0", "xadc"), ("iio:device1", "ad9361-phy")):
+        (tmp_path / entry).mkdir()
+        (tmp_path / entry / "name").write_text(name + "\n")
+    path = debugfs_reg_path("ad9361-phy", sysfs=str(tmp_path), debugfs="/debug")
+    assert path == "/debug/iio:device1/direct_reg_access"
+
+def test_gpo_control_uses_debugfs_path(tmp_path):
+    gpo = sys.modules["pc_card_control.iio_gpo_control"]
+    path = tmp_path / "direct_reg_access"
+    path.write_bytes(b"")
+    try:
+        ctrl = gpo.get_gpo_control("test-phy", reg_backend="debugfs", debugfs_path=str(path))
+        assert ctrl.ctx is None
+        #The regular file reads back the selected register number
+        assert path.read_bytes() == b"0x%x 0x%x" % (gpo.GPIO_CTRL_NUM, gpo.GPIO_CTRL_NUM | (1 << gpo.GPIO_CTRL_BIT))
+    finally:
+        gpo._gpo_controls.pop("test-phy", None)
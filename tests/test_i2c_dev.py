@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+from pc_card_control.i2c_dev import *
+
+class fake_ioctl:
+    """Records the messages of every I2C_RDWR ioctl"""
+
+    def __init__(self, funcs=I2C_FUNC_PROTOCOL_MANGLING):
+        self.funcs = funcs
+        self.calls = []
+
+    def __call__(self, fd, request, arg):
+        if request == I2C_FUNCS:
+            arg.value = self.funcs
+        elif request == I2C_RDWR:
+            msgs = [arg.msgs[i] for i in range(arg.nmsgs)]
+            self.calls.append([(m.addr, m.flags, bytes(m.buf[:m.len])) for m in msgs])
+        else:
+            self.calls.append((request, arg))
+        return 0
+
+def test_transfer_packs_messages():
+    ioctl = fake_ioctl()
+    dev = i2c_dev(1, fd=-1, ioctl=ioctl)
+    dev.transfer(dev.compile(0x2b, [b"\x01\x02\x03", b"\x04"]))
+    assert ioctl.calls == [[(0x2b, I2C_M_STOP, b"\x01\x02\x03"),
+                            (0x2b, I2C_M_STOP, b"\x04")]]
+
+def test_transfer_without_stop():
+    compiled = i2c_transfer(0x10, [b"\xaa"], stop=False)
+    assert compiled.chunks[0][0][0].flags == 0
+
+def test_transfer_chunks_at_kernel_limit():
+    ioctl = fake_ioctl()
+    dev = i2c_dev(1, fd=-1, ioctl=ioctl)
+    payloads = [bytes([i, i]) for i in range(2*I2C_RDWR_IOCTL_MAX_MSGS + 5)]
+    compiled = dev.compile(0x2b, payloads)
+    dev.transfer(compiled)
+    dev.transfer(compiled)
+    assert [len(c) for c in ioctl.calls] == [I2C_RDWR_IOCTL_MAX_MSGS, I2C_RDWR_IOCTL_MAX_MSGS, 5]*2
+    sent = [data for call in ioctl.calls[:3] for _, _, data in call]
+    assert sent == payloads
+
+def test_target_is_set_once():
+    ioctl = fake_ioctl()
+    dev = i2c_dev(1, fd=-1, ioctl=ioctl)
+    dev.set_target(0x2b)
+    dev.set_target(0x2b)
+    dev.set_target(0x2c)
+    assert ioctl.calls == [(I2C_SLAVE, 0x2b), (I2C_SLAVE, 0x2c)]
+
+def test_without_mangling_one_message_per_ioctl():
+    ioctl = fake_ioctl(funcs=0)
+    dev = i2c_dev(1, fd=-1, ioctl=ioctl)
+    assert not dev.mangling
+    dev.transfer(dev.compile(0x2b, [b"\x01\x02", b"\x03"]))
+    assert ioctl.calls == [[(0x2b, 0, b"\x01\x02")], [(0x2b, 0, b"\x03")]]
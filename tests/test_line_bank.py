@@ -0,0 +1,52 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+import pc_card_control
+from pc_card_control.backend import *
+
+@pytest.fixture
+def sim():
+    ops = []
+    backend = pc_card_control.sim_backend(on_op=ops.append)
+    previous = pc_card_control.get_backend()
+    pc_card_control.set_backend(backend)
+    yield ops
+    pc_card_control.set_backend(previous)
+
+def test_one_request_with_initial_values(sim):
+    bank = open_line_bank(5)
+    enable = bank.get_lines([7])
+    filters = [bank.get_lines([o]) for o in (1, 2)]
+    enable.request(consumer="X_ENABLE", type=LINE_REQ_DIR_OUT, default_vals=[1])
+    for lines in filters:
+        lines.request(consumer="X_FILT", type=LINE_REQ_DIR_OUT)
+    assert sim == []
+    bank.request(consumer="X")
+    assert sim == ["gpiochip5 request [7, 1, 2] as X"]
+    assert enable.get_values() == [1]
+
+def test_writes_whole_request(sim):
+    bank = open_line_bank(5)
+    a = bank.get_lines([1])
+    b = bank.get_lines([2, 3])
+    bank.request(consumer="X")
+    sim.clear()
+    b.set_values([1, 0])
+    a.set_values([1])
+    assert sim == ["gpiochip5 set [1, 2, 3] = [0, 1, 0]",
+                   "gpiochip5 set [1, 2, 3] = [1, 1, 0]"]
+
+def test_unchanged_write_elided(sim):
+    bank = open_line_bank(5)
+    a = bank.get_lines([1])
+    bank.request(consumer="X")
+    sim.clear()
+    a.set_values([0])
+    assert sim == []
+
+def test_inputs_rejected(sim):
+    bank = open_line_bank(5)
+    with pytest.raises(ValueError):
+        bank.get_lines([1]).request(type=LINE_REQ_DIR_IN)
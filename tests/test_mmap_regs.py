@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+import struct
+from pc_card_control.mmap_regs import *
+
+def map_bank(tmp_path, data=0, tri=0xffffffff):
+    path = tmp_path / "regs"
+    path.write_bytes(struct.pack("<II", data, tri) + bytes(0x1000 - 8))
+    regs = mmap_regs(str(path))
+    return path, regs, mmap_gpio_bank(regs)
+
+def registers(path):
+    return struct.unpack_from("<II", path.read_bytes())
+
+def test_request_clears_tristate(tmp_path):
+    path, regs, bank = map_bank(tmp_path)
+    bank.get_lines([78, 80]).request(type=None)
+    assert registers(path)[1] == 0xffffffff & ~0b101
+
+def test_writes_store_shadow(tmp_path):
+    path, regs, bank = map_bank(tmp_path, data=0x400)
+    clock = bank.get_lines([78])
+    data = bank.get_lines([80, 81, 82])
+    data.set_values([1, 0, 1])
+    clock.set_values([1])
+    assert registers(path)[0] == 0x400 | 0b10101
+    data.set_values([0, 1, 0])
+    assert registers(path)[0] == 0x400 | 0b01001
+    assert data.get_values() == [0, 1, 0]
+
+def test_shadow_starts_from_register(tmp_path):
+    path, regs, bank = map_bank(tmp_path, data=0b10)
+    assert bank.get_lines([78, 79]).get_values() == [0, 1]
+
+def test_default_values(tmp_path):
+    path, regs, bank = map_bank(tmp_path)
+    bank.get_lines([79]).request(default_vals=[1])
+    assert registers(path) == (0b10, 0xffffffff & ~0b10)
+
+def test_unaligned_base(tmp_path):
+    path = tmp_path / "regs"
+    path.write_bytes(bytes(0x2000))
+    regs = mmap_regs(str(path), base=0x1010, size=0x10)
+    regs.write32(0x4, 0x12345678)
+    assert struct.unpack_from("<I", path.read_bytes(), 0x1014)[0] == 0x12345678
+
+def test_initial_values_stored_before_driving(tmp_path):
+    path, regs, bank = map_bank(tmp_path)
+    stores = []
+    make_outputs = bank.make_outputs
+    def record(bits):
+        stores.append(("tri", registers(path)[0]))
+        make_outputs(bits)
+    bank.make_outputs = record
+    bank.get_lines([79]).request(default_vals=[1])
+    #RESET was already high in the data register when it was driven
+    assert stores == [("tri", 0b10)]
@@ -0,0 +1,392 @@
+# SPDX-FileCopyrightText: 2024 Red Wire Technologies <support@redwiretechnologies.us>
+#
+# SPDX-License-Identifier: MIT
+
+"""
+Recording and replay of hardware operation traces
+
+A trace_recorder registers as a backend listener (see backend) and
+writes every hardware primitive performed through the library (line
+requests and writes, I2C writes, reads and transfers, IIO register
+accesses) to a compact binary file, with its start time and duration.
+A trace_replayer performs a recorded trace again through the active
+backend, either simulated or real, at the original pace or as fast as
+possible.
+
+**To record**
+
+    with pc_card_control.trace_recorder("session.trace"):
+        my_argon.configure_synth(8000000000)
+
+**To replay**
+
+    python -m pc_card_control.trace replay session.trace --max-speed
+
+File layout: the magic b"PCCT" and a u16 version, then one record per
+event. Each record is a header (op code, target index, start time in ns
+relative to the start of the recording, duration in ns, payload length)
+followed by an op specific payload. Targets (gpiochip, bus or IIO
+device names) are defined once by a "target" record and referred to by
+index afterwards. Line requests carry the request type and initial
+values, so they are replayed with the recorded direction (an input is
+never driven) and level. Line releases are recorded too, so a request
+that replaces an earlier one over the same lines (such as the CARP
+expander's) is replayed after the earlier one has been released.
+"""
+
+import sys
+import time
+import struct
+import logging
+import argparse
+import threading
+import collections
+from .backend import *
+from .smbus_pool import *
+
+MAGIC = b"PCCT"
+VERSION = 3
+"""int: Format version written. Version 1 files, whose line requests
+        lack the request type and initial values, and version 2 files,
+        which lack line releases, can still be read"""
+
+NO_TYPE = 0xff
+"""Request type byte of a line request made without a type"""
+
+FILE_HEADER = struct.Struct("<4sH")
+RECORD = struct.Struct("<BHQIH")
+"""Record header: op code, target index, start ns, duration ns, payload length"""
+
+OPS = ["target", "line_request", "line_write", "i2c_write", "i2c_read",
+       "i2c_transfer", "iio_reg_read", "iio_reg_write", "line_release"]
+"""list[str]: Record kinds by op code"""
+
+trace_event = collections.namedtuple("trace_event", ["op", "target", "detail", "start_ns", "duration_ns"])
+"""A recorded hardware primitive, with start_ns relative to the start of the trace"""
+
+def encode_detail(op, detail):
+    """
+    Encode the detail of a hardware primitive as a record payload
+
+    Args:
+        op (str): Name of the primitive (see backend.add_listener)
+
+        detail (tuple): Its arguments
+
+    Returns:
+        bytes: The payload
+    """
+    if op == "line_request":
+        offsets, consumer, type, default_vals = detail
+        return (struct.pack("<B{}HBB".format(len(offsets)), len(offsets), *offsets,
+                            NO_TYPE if type is None else type, 1 if default_vals else 0) +
+                (bytes(default_vals) if default_vals else b"") + (consumer or "").encode())
+    if op == "line_write":
+        offsets, values = detail
+        return struct.pack("<B{0}H{0}B".format(len(offsets)), len(offsets), *offsets, *values)
+    if op == "line_release":
+        offsets = detail[0]
+        return struct.pack("<B{}H".format(len(offsets)), len(offsets), *offsets)
+    if op == "i2c_write":
+        address, data = detail
+        return bytes([address]) + data
+    if op == "i2c_read":
+        return struct.pack("<BH", *detail)
+    if op == "i2c_transfer":
+        address, payloads = detail
+        return bytes([address, len(payloads)]) + b"".join(
+            struct.pack("<H", len(p)) + bytes(p) for p in payloads)
+    if op in ("iio_reg_read", "iio_reg_write"):
+        return struct.pack("<II", *detail)
+    raise ValueError("Unknown operation {}".format(op))
+
+def decode_detail(op, payload, version=VERSION):
+    """
+    Decode a record payload
+
+    Args:
+        op (str): Name of the primitive
+
+        payload (bytes): The payload
+
+        version (int): Format version of the file (Default: VERSION)
+
+    Returns:
+        tuple: The arguments of the primitive, as passed to listeners
+    """
+    if op == "line_request":
+        n = payload[0]
+        offsets = list(struct.unpack_from("<{}H".format(n), payload, 1))
+        pos = 1 + 2*n
+        if version < 2:
+            return (offsets, payload[pos:].decode() or None, None, None)
+        type, has_defaults = payload[pos], payload[pos+1]
+        pos += 2
+        default_vals = None
+        if has_defaults:
+            default_vals = list(payload[pos:pos+n])
+            pos += n
+        return (offsets, payload[pos:].decode() or None, None if type == NO_TYPE else type, default_vals)
+    if op == "line_write":
+        n = payload[0]
+        fields = struct.unpack_from("<{0}H{0}B".format(n), payload, 1)
+        return (list(fields[:n]), list(fields[n:]))
+    if op == "line_release":
+        return (list(struct.unpack_from("<{}H".format(payload[0]), payload, 1)),)
+    if op == "i2c_write":
+        return (payload[0], payload[1:])
+    if op == "i2c_read":
+        return struct.unpack("<BH", payload)
+    if op == "i2c_transfer":
+        address, count = payload[0], payload[1]
+        payloads = []
+        pos = 2
+        for i in range(count):
+            length = struct.unpack_from("<H", payload, pos)[0]
+            payloads.append(payload[pos+2:pos+2+length])
+            pos += 2 + length
+        return (address, payloads)
+    if op in ("iio_reg_read", "iio_reg_write"):
+        return struct.unpack("<II", payload)
+    raise ValueError("Unknown operation {}".format(op))
+
+class trace_recorder:
+    """Records every hardware primitive to a trace file"""
+
+    def __init__(self, path):
+        """
+        Create a trace_recorder instance. Recording starts with start()
+        or when used as a context manager.
+
+        Args:
+            path (str): Path of the trace file to write
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = None
+        self.targets = {}
+        self.origin_ns = None
+        self.events = 0
+
+    def start(self):
+        """Open the trace file and start recording"""
+        self.file = open(self.path, "wb")
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        add_listener(self.record)
+
+    def stop(self):
+        """Stop recording and close the trace file"""
+        remove_listener(self.record)
+        with self.lock:
+            self.file.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def record(self, op, target, detail, start_ns, duration_ns):
+        """Backend listener writing one record"""
+        payload = encode_detail(op, detail)
+        with self.lock:
+            if self.file.closed:
+                return
+            if self.origin_ns is None:
+                self.origin_ns = start_ns
+            index = self.targets.get(target)
+            if index is None:
+                index = len(self.targets)
+                self.targets[target] = index
+                name = target.encode()
+                self.file.write(RECORD.pack(0, index, 0, 0, len(name)) + name)
+            self.file.write(RECORD.pack(OPS.index(op), index, max(start_ns - self.origin_ns, 0),
+                                        min(duration_ns, 0xffffffff), len(payload)) + payload)
+            self.events += 1
+
+def read_trace(path):
+    """
+    Read the events of a trace file
+
+    Args:
+        path (str): Path of the trace file
+
+    Returns:
+        list[trace_event]: The recorded events, in order
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version = FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version not in (1, 2, VERSION):
+        raise ValueError("{} is not a trace file".format(path))
+    targets = []
+    events = []
+    pos = FILE_HEADER.size
+    while pos < len(data):
+        code, index, start_ns, duration_ns, length = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        payload = data[pos:pos+length]
+        pos += length
+        if code == 0:
+            targets.append(payload.decode())
+            continue
+        op = OPS[code]
+        events.append(trace_event(op, targets[index], decode_detail(op, payload, version), start_ns, duration_ns))
+    return events
+
+class trace_replayer:
+    """Performs the hardware primitives of a trace again"""
+
+    def __init__(self, events, speed=1.0, i2c_backend="smbus"):
+        """
+        Create a trace_replayer instance. The hardware is opened through
+        the active backend (see set_backend) as the trace requires it.
+
+        Args:
+            events (list[trace_event]): The trace (see read_trace)
+
+            speed (float): Pace relative to the recording, or None to
+                           replay as fast as possible (Default: 1.0)
+
+            i2c_backend (str): Backend for I2C buses that are not already
+                               open (Default: "smbus")
+        """
+        self.log = logging.getLogger("trace_replayer")
+        self.events = events
+        self.speed = speed
+        self.i2c_backend = i2c_backend
+        self.chips = {}
+        self.lines = {}
+        self.compiled = {}
+        self.iio = None
+        self.devices = {}
+
+    def line_handle(self, target, offsets, consumer=None, type=LINE_REQ_DIR_OUT, default_vals=None):
+        """
+        Get the lines of an event, requesting them as recorded if needed.
+        Lines written without a recorded request (version 1 traces) are
+        requested as outputs. Lines still held by an earlier request
+        whose release was not recorded (version 1 and 2 traces) are
+        released first, as a request over them would fail.
+        """
+        key = (target, tuple(offsets))
+        lines = self.lines.get(key)
+        if lines is None:
+            chip = self.chips.get(target)
+            if chip is None:
+                chip = open_chip(int(target[len("gpiochip"):]))
+                self.chips[target] = chip
+            for held in [k for k in self.lines if k[0] == target and set(k[1]) & set(offsets)]:
+                self.release(*held)
+            lines = chip.get_lines(offsets)
+            lines.request(consumer=consumer or "PC_CARD_REPLAY",
+                          type=LINE_REQ_DIR_OUT if type is None else type, default_vals=default_vals)
+            self.lines[key] = lines
+        return lines
+
+    def release(self, target, offsets):
+        """Release the lines of an event if they are held"""
+        lines = self.lines.pop((target, tuple(offsets)), None)
+        if lines is not None:
+            lines.release()
+
+    def device(self, target):
+        """Get an IIO device by name"""
+        dev = self.devices.get(target)
+        if dev is None:
+            if self.iio is None:
+                self.iio = open_iio_context()
+            dev = self.iio.find_device(target)
+            self.devices[target] = dev
+        return dev
+
+    def perform(self, event):
+        """
+        Perform one event
+
+        Args:
+            event (trace_event): The event
+        """
+        op, target, detail = event.op, event.target, event.detail
+        if op == "line_request":
+            self.line_handle(target, *detail)
+        elif op == "line_write":
+            self.line_handle(target, detail[0]).set_values(detail[1])
+        elif op == "line_release":
+            self.release(target, *detail)
+        elif op.startswith("i2c"):
+            bus = get_bus(int(target[len("i2c"):]), self.i2c_backend)
+            if op == "i2c_write":
+                bus.write_i2c_block_data(detail[0], detail[1][0], list(detail[1][1:]))
+            elif op == "i2c_read":
+                bus.read(*detail)
+            else:
+                key = (target, detail[0], tuple(bytes(p) for p in detail[1]))
+                burst = self.compiled.get(key)
+                if burst is None:
+                    burst = bus.compile(detail[0], [bytes(p) for p in detail[1]])
+                    self.compiled[key] = burst
+                bus.transfer(burst)
+        elif op == "iio_reg_read":
+            self.device(target).reg_read(detail[0])
+        elif op == "iio_reg_write":
+            self.device(target).reg_write(*detail)
+
+    def run(self):
+        """
+        Replay the trace
+
+        Returns:
+            dict: "events", "recorded_s" (span of the recording),
+                  "replayed_s" (wall time of the replay),
+                  "busy_s" (time spent in the primitives) and "ops"
+                  (count of each primitive)
+        """
+        ops = collections.Counter()
+        busy_ns = 0
+        start = time.perf_counter_ns()
+        for event in self.events:
+            if self.speed:
+                delay = start + event.start_ns/self.speed - time.perf_counter_ns()
+                if delay > 0:
+                    time.sleep(delay/1e9)
+            op_start = time.perf_counter_ns()
+            self.perform(event)
+            busy_ns += time.perf_counter_ns() - op_start
+            ops[event.op] += 1
+        replayed_ns = time.perf_counter_ns() - start
+        recorded_ns = (self.events[-1].start_ns + self.events[-1].duration_ns) if self.events else 0
+        self.log.info("Replayed {} events in {:.3f}ms".format(len(self.events), replayed_ns/1e6))
+        return {"events": len(self.events), "recorded_s": recorded_ns/1e9,
+                "replayed_s": replayed_ns/1e9, "busy_s": busy_ns/1e9, "ops": dict(ops)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pc_card_control.trace",
+                                     description="Inspect or replay hardware operation traces")
+    parser.add_argument("action", choices=["dump", "replay"])
+    parser.add_argument("trace", help="Trace file")
+    parser.add_argument("--max-speed", action="store_true", help="Replay as fast as possible")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay pace relative to the recording (Default: 1.0)")
+    parser.add_argument("--dry-run", action="store_true", help="Replay against the simulated backend")
+    args = parser.parse_args(argv)
+
+    events = read_trace(args.trace)
+    if args.action == "dump":
+        for event in events:
+            print("{:>12.6f}ms {:>9.3f}us {:<14} {:<10} {}".format(
+                event.start_ns/1e6, event.duration_ns/1e3, event.op, event.target, event.detail))
+        return 0
+
+    if args.dry_run:
+        from .sim import sim_backend
+        set_backend(sim_backend())
+    result = trace_replayer(events, None if args.max_speed else args.speed).run()
+    print("{} events, recorded over {:.3f}ms, replayed in {:.3f}ms ({:.3f}ms in hardware primitives)".format(
+        result["events"], result["recorded_s"]*1000, result["replayed_s"]*1000, result["busy_s"]*1000))
+    for op, count in sorted(result["ops"].items()):
+        print("    {:<14} {}".format(op, count))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())